@@ -9,11 +9,13 @@ import secrets
 import string
 
 from database import get_db
-from auth import get_current_admin_user
+from auth import get_current_admin_user, invalidate_principal
+from ttl_cache import all_stats as cache_stats
 from models import (
     User, InviteCode, Contact, Message, UserSettings,
-    ApiKeyPool, UserQuota, DataBackup, CloudTrigger, MemoryStore
+    ApiKeyPool, UserQuota, DataBackup, CloudTrigger
 )
+from memory_stats import global_stats
 
 router = APIRouter()
 
@@ -249,6 +251,7 @@ async def update_user(
 
     db.commit()
     db.refresh(user)
+    invalidate_principal(user.id)
 
     return user.to_dict()
 
@@ -287,6 +290,7 @@ async def update_user_level(
 
     db.commit()
     db.refresh(user)
+    invalidate_principal(user.id)
 
     return {
         "status": "ok",
@@ -318,6 +322,7 @@ async def delete_user(
     # 删除用户
     db.delete(user)
     db.commit()
+    invalidate_principal(user_id)
     
     return {"status": "ok", "message": "用户及其数据已删除"}
 
@@ -363,8 +368,9 @@ async def system_stats(
     total_triggers = db.query(CloudTrigger).count()
     active_triggers = db.query(CloudTrigger).filter(CloudTrigger.is_active == True).count()
 
-    total_memories = db.query(MemoryStore).count()
-    users_with_memories = db.query(func.count(func.distinct(MemoryStore.user_id))).scalar() or 0
+    memory_overview = global_stats(db)
+    total_memories = memory_overview["total_memories"]
+    users_with_memories = memory_overview["users_with_memories"]
 
     return {
         "users": {
@@ -400,3 +406,11 @@ async def system_stats(
             }
         }
     }
+
+
+@router.get("/cache-stats")
+async def get_cache_stats(
+    admin_id: int = Depends(get_current_admin_user)
+):
+    """进程内缓存统计（命中率、容量），每个 worker 单独统计"""
+    return {"caches": cache_stats()}
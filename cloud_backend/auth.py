@@ -11,6 +11,7 @@ import os
 
 from database import get_db
 from models import User, InviteCode
+from ttl_cache import TTLCache, MISSING
 
 # JWT配置
 SECRET_KEY = os.getenv("SECRET_KEY", "change-this-secret-key")
@@ -23,6 +24,12 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # HTTP Bearer认证
 security = HTTPBearer()
 
+# 用户身份缓存：避免每个请求都查一次 users 表
+# 管理员修改用户状态/等级时主动失效，其余情况依赖较短的 ttl 兜底
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+principal_cache = TTLCache("auth_principals", AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
 router = APIRouter()
 
 
@@ -46,6 +53,18 @@ class TokenResponse(BaseModel):
     user: dict
 
 
+class UserPrincipal(BaseModel):
+    """已认证用户的权限快照（缓存在进程内，不含敏感字段）"""
+    id: int
+    is_active: bool
+    is_admin: bool
+    user_level: int
+    expires_at: Optional[datetime] = None
+
+    class Config:
+        frozen = True
+
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -91,37 +110,84 @@ def decode_token(token: str) -> dict:
         )
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> int:
-    """获取当前登录用户ID（依赖注入）"""
-    token = credentials.credentials
+def load_principal(user_id: int, db: Session) -> Optional[UserPrincipal]:
+    """读取用户权限快照，优先走缓存；用户不存在返回 None"""
+    principal = principal_cache.get(user_id)
+    if principal is not MISSING:
+        return principal
+
+    row = db.query(
+        User.id, User.is_active, User.is_admin, User.user_level, User.expires_at
+    ).filter(User.id == user_id).first()
+    principal = None
+    if row:
+        principal = UserPrincipal(
+            id=row.id,
+            is_active=bool(row.is_active),
+            is_admin=bool(row.is_admin),
+            user_level=row.user_level or 0,
+            expires_at=row.expires_at
+        )
+    # 不存在的用户也缓存，防止无效 Token 反复打到数据库
+    principal_cache.set(user_id, principal)
+    return principal
+
+
+def invalidate_principal(user_id: int):
+    """用户状态、等级变更或删除后调用"""
+    principal_cache.invalidate(user_id)
+
+
+def authenticate_principal(token: str, db: Session) -> UserPrincipal:
+    """校验 Token 并返回有效用户的权限快照"""
     payload = decode_token(token)
-    user_id: int = payload.get("sub")
-    if user_id is None:
+    try:
+        # sub 可能以字符串形式签发，统一为 int，便于按 user_id 做字典键
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
         raise HTTPException(status_code=401, detail="无效的认证凭证")
     
     # 验证用户是否存在
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    principal = load_principal(user_id, db)
+    if not principal:
         raise HTTPException(status_code=401, detail="用户不存在")
-    if not user.is_active:
+    if not principal.is_active:
         raise HTTPException(status_code=403, detail="用户已被禁用")
     
-    return user_id
+    return principal
 
 
-def get_current_admin_user(
+def authenticate_token(token: str, db: Session) -> int:
+    """校验 Token 并返回有效的用户ID（WebSocket 等非依赖注入场景使用）"""
+    return authenticate_principal(token, db).id
+
+
+def get_current_principal(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
+) -> UserPrincipal:
+    """获取当前登录用户的权限快照（依赖注入）
+
+    FastAPI 在同一请求内只解析一次该依赖，get_current_user、
+    get_current_admin_user 和需要等级判断的接口共享同一个结果
+    """
+    return authenticate_principal(credentials.credentials, db)
+
+
+def get_current_user(
+    principal: UserPrincipal = Depends(get_current_principal)
+) -> int:
+    """获取当前登录用户ID（依赖注入）"""
+    return principal.id
+
+
+def get_current_admin_user(
+    principal: UserPrincipal = Depends(get_current_principal)
 ) -> int:
     """获取当前管理员用户ID"""
-    user_id = get_current_user(credentials, db)
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user.is_admin:
+    if not principal.is_admin:
         raise HTTPException(status_code=403, detail="需要管理员权限")
-    return user_id
+    return principal.id
 
 
 # ============ API路由 ============
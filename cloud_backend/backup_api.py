@@ -10,7 +10,7 @@ from datetime import datetime, timezone
 from pydantic import BaseModel, Field
 
 from database import get_db
-from auth import get_current_user
+from auth import get_current_user, get_current_principal, UserPrincipal
 from models import User, DataBackup
 
 router = APIRouter()
@@ -60,7 +60,7 @@ class BackupStats(BaseModel):
 
 # ============ Helper Functions ============
 
-def check_user_level(user: User, required_level: int):
+def check_user_level(user: UserPrincipal, required_level: int):
     """检查用户等级是否满足要求"""
     if user.user_level < required_level:
         raise HTTPException(
@@ -69,7 +69,7 @@ def check_user_level(user: User, required_level: int):
         )
 
 
-def check_membership_expiry(user: User):
+def check_membership_expiry(user: UserPrincipal):
     """检查会员是否过期"""
     if user.expires_at and datetime.now(timezone.utc) > user.expires_at:
         raise HTTPException(
@@ -89,6 +89,7 @@ def calculate_backup_size(data: str) -> int:
 async def create_backup(
     backup_data: BackupCreate,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -96,11 +97,6 @@ async def create_backup(
     - 需要 Level 1+ 权限
     - 自动计算备份大小
     """
-    # 获取用户信息
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     # 检查权限和会员状态
     check_user_level(user, 1)
     check_membership_expiry(user)
@@ -129,6 +125,7 @@ async def list_backups(
     skip: int = 0,
     limit: int = 50,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -136,10 +133,6 @@ async def list_backups(
     - 仅返回备份信息，不包含备份数据内容
     - 按创建时间倒序排列
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 1)
 
     backups = db.query(DataBackup).filter(
@@ -155,16 +148,13 @@ async def list_backups(
 async def get_backup(
     backup_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     获取备份详情（包含备份数据）
     - 用于恢复备份
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 1)
 
     backup = db.query(DataBackup).filter(
@@ -182,6 +172,7 @@ async def get_backup(
 async def restore_backup(
     backup_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -189,10 +180,6 @@ async def restore_backup(
     - 实际上只是获取备份数据，由客户端完成恢复操作
     - 返回备份数据供客户端使用
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 1)
     check_membership_expiry(user)
 
@@ -216,15 +203,12 @@ async def restore_backup(
 async def delete_backup(
     backup_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     删除备份
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 1)
 
     backup = db.query(DataBackup).filter(
@@ -244,15 +228,12 @@ async def delete_backup(
 @router.get("/stats/my", response_model=BackupStats)
 async def get_my_backup_stats(
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     获取当前用户的备份统计信息
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 1)
 
     stats = db.query(
@@ -275,12 +256,12 @@ async def get_my_backup_stats(
 @router.get("/admin/overview", response_model=dict)
 async def get_backup_overview(
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     管理员：获取所有备份的概览统计
     """
-    user = db.query(User).filter(User.id == user_id).first()
     if not user or user.user_level != 99:
         raise HTTPException(status_code=403, detail="需要管理员权限")
 
@@ -325,12 +306,12 @@ async def get_backup_overview(
 async def get_user_backups_by_admin(
     unique_id: str,
     user_id: int = Depends(get_current_user),
+    admin: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     管理员：查看指定用户的所有备份
     """
-    admin = db.query(User).filter(User.id == user_id).first()
     if not admin or admin.user_level != 99:
         raise HTTPException(status_code=403, detail="需要管理员权限")
 
@@ -351,12 +332,12 @@ async def get_user_backups_by_admin(
 async def delete_backup_by_admin(
     backup_id: int,
     user_id: int = Depends(get_current_user),
+    admin: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     管理员：删除任意用户的备份
     """
-    admin = db.query(User).filter(User.id == user_id).first()
     if not admin or admin.user_level != 99:
         raise HTTPException(status_code=403, detail="需要管理员权限")
 
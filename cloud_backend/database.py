@@ -1,9 +1,11 @@
 """数据库连接和会话管理"""
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import os
 
+from memory_fts import ngram_tokens, setup_fts
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/sync.db")
 
 # 创建数据库引擎
@@ -12,6 +14,22 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 )
 
+if "sqlite" in DATABASE_URL:
+    @event.listens_for(engine, "connect")
+    def _sqlite_connect(dbapi_connection, connection_record):
+        # 记忆全文索引的触发器要用到（见 memory_fts.py）
+        dbapi_connection.create_function("memory_fts_tokens", 1, ngram_tokens, deterministic=True)
+
+    # pysqlite 延迟到第一条 DML 才发 BEGIN，SAVEPOINT（begin_nested）不会开启事务，
+    # 最外层 RELEASE 时直接提交。用到 savepoint 的都是写事务（push 逐操作隔离、序列号回填），
+    # 还没开始事务时先发 BEGIN IMMEDIATE：事务里先读后写时，并发写入会让升级写锁直接报
+    # database is locked（SQLite 为避免死锁不等待 busy timeout），一开始就拿写锁则按超时排队。
+    # 不在每个事务开头发 BEGIN，只读的查询不持有读锁
+    @event.listens_for(engine, "savepoint")
+    def _sqlite_savepoint(conn, name):
+        if not conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -40,7 +58,7 @@ def init_db():
         # 云触发器
         CloudTrigger, TriggerExecutionLog,
         # 云记忆库
-        MemoryStore, MemorySearchHistory,
+        MemoryStore, MemorySearchHistory, MemoryStatCounter,
         # === 云同步核心表（施工手册定义）===
         SyncScope,       # 同步范围配置
         Conversation,    # 会话/角色卡
@@ -49,10 +67,69 @@ def init_db():
         Provider,        # 渠道商配置
         SyncOperation,   # 幂等操作记录
         SyncCursor,      # 同步游标
+        SyncSequence,    # 每用户序列号
+        SyncChange,      # 变更日志
     )
 
     # 创建所有表
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _add_missing_indexes()
+    setup_fts(engine)
+
+    from memory_relevance import backfill_relevance
+    from memory_stats import initialize_stats
+    backfill_relevance(engine)
+    initialize_stats()
+
+
+def _add_missing_columns():
+    """为已存在的表补齐模型中新增的列
+
+    create_all 只会建新表，不会修改旧表；这里只处理追加列（可空或带标量默认值），
+    足够覆盖增量加字段的场景，改类型/删列仍需手工迁移
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    default = column.default.arg
+                    if isinstance(default, bool):
+                        default = int(default)
+                    ddl += f" DEFAULT {default!r}"
+                conn.exec_driver_sql(ddl)
+                print(f"🔧 已为表 {table.name} 添加列 {column.name}")
+
+
+def _add_missing_indexes():
+    """为已存在的表补建模型中新增的索引（create_all 对已有的表不会建索引）
+
+    同名索引的列与模型定义不一致时（如为 keyset 分页追加了 id 列）先删除再按新定义重建
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"]: index["column_names"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                columns = [column.name for column in index.columns]
+                if existing.get(index.name) == columns:
+                    continue
+                if index.name in existing:
+                    index.drop(conn)
+                    index.create(conn)
+                    print(f"🔧 已重建表 {table.name} 的索引 {index.name}: {', '.join(columns)}")
+                else:
+                    index.create(conn)
+                    print(f"🔧 已为表 {table.name} 创建索引 {index.name}")
 
 
 def get_db() -> Session:
@@ -9,7 +9,7 @@ from cryptography.fernet import Fernet
 import os
 
 from database import get_db
-from auth import get_current_user, get_current_admin_user
+from auth import get_current_user, get_current_admin_user, get_current_principal, UserPrincipal
 from models import User, ApiKeyPool, UserQuota, QuotaUsageLog
 
 router = APIRouter()
@@ -63,7 +63,7 @@ def decrypt_key(encrypted_key: str) -> str:
     return cipher.decrypt(encrypted_key.encode()).decode()
 
 
-def check_user_level(user: User, min_level: int):
+def check_user_level(user: UserPrincipal, min_level: int):
     """检查用户级别"""
     if user.user_level < min_level:
         raise HTTPException(
@@ -77,10 +77,10 @@ def check_user_level(user: User, min_level: int):
 @router.get("/providers")
 async def get_available_providers(
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """获取可用的Provider列表"""
-    user = db.query(User).filter(User.id == user_id).first()
     check_user_level(user, 2)  # 需要Level 2（标准版）
     
     # 查询用户有额度的provider
@@ -106,10 +106,10 @@ async def get_available_providers(
 async def request_key(
     request: KeyRequest,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """请求API Key"""
-    user = db.query(User).filter(User.id == user_id).first()
     check_user_level(user, 2)
     
     # 查询用户额度
@@ -158,10 +158,10 @@ async def request_key(
 @router.get("/quota")
 async def get_user_quota(
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """查看用户额度"""
-    user = db.query(User).filter(User.id == user_id).first()
     check_user_level(user, 2)
     
     quotas = db.query(UserQuota).filter(
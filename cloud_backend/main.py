@@ -13,6 +13,12 @@ from key_distribution import router as key_router
 from backup_api import router as backup_router
 from trigger_api import router as trigger_router
 from memory_api import router as memory_router
+from sync_notifier import notifier as sync_notifier
+from memory_index import index_manager as memory_index_manager
+from memory_telemetry import telemetry as memory_telemetry
+from trigger_engine import executor as trigger_executor, scheduler as trigger_scheduler
+from trigger_events import event_bus as trigger_event_bus
+from trigger_conditions import condition_engine as trigger_condition_engine
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -47,10 +53,29 @@ async def startup_event():
         print("✅ 数据库初始化成功")
     except Exception as e:
         print(f"❌ 数据库初始化失败: {e}")
+    sync_notifier.start()
+    memory_telemetry.start()
+    trigger_executor.start()
+    trigger_scheduler.start()
+    trigger_event_bus.start()
+    trigger_condition_engine.start()
     print(f"🌐 CORS允许的源: {origins}")
     print("✨ 服务已启动！")
 
 
+# 关闭事件：停止后台任务
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时执行"""
+    await sync_notifier.stop()
+    await memory_telemetry.stop()
+    await trigger_condition_engine.stop()
+    await trigger_event_bus.stop()
+    await trigger_scheduler.stop()
+    await trigger_executor.stop()
+    memory_index_manager.flush(force=True)
+
+
 # 根路径
 @app.get("/")
 async def root():
@@ -3,21 +3,39 @@
 提供长期记忆存储、检索和管理功能
 支持关键词搜索和语义搜索（需要向量嵌入）
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, or_
-from typing import List, Optional, Dict, Any
+from sqlalchemy import desc, or_, insert, tuple_, literal, type_coerce, String
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, timezone
 from pydantic import BaseModel, Field
+import asyncio
 import json
+import os
 import time
 
-from database import get_db
-from auth import get_current_user
-from models import User, MemoryStore, MemorySearchHistory
+from database import get_db, SessionLocal
+from auth import get_current_user, get_current_principal, UserPrincipal
+from models import MemoryStore
+from memory_vectors import EmbeddingMatrix, encode_embedding
+from memory_index import index_manager
+from memory_fts import keyword_search
+from memory_telemetry import telemetry
+from memory_consolidate import consolidate_memories, DEDUP_THRESHOLD
+from memory_relevance import relevance_score, current_relevance
+from memory_stats import user_stats, global_stats, track_inserted, reconcile_stats
+from ttl_cache import SizedTTLCache, MISSING
 
 router = APIRouter()
 
+VALID_MEMORY_TYPES = ["conversation", "fact", "preference", "custom"]
+
+# 批量写入单次最多条数
+BATCH_MAX_SIZE = 500
+
+# 多查询搜索单次最多查询向量数
+MULTI_QUERY_MAX_SIZE = 32
+
 
 # ============ Pydantic Models ============
 
@@ -32,6 +50,17 @@ class MemoryCreate(BaseModel):
     importance_score: int = Field(5, ge=1, le=10, description="重要性评分 1-10")
 
 
+class MemoryBatchCreate(BaseModel):
+    """批量创建记忆请求"""
+    memories: List[MemoryCreate] = Field(..., min_length=1, max_length=BATCH_MAX_SIZE)
+
+
+class MemoryBatchResult(BaseModel):
+    """批量创建结果"""
+    created: int
+    ids: List[int]
+
+
 class MemoryUpdate(BaseModel):
     """更新记忆请求"""
     memory_content: Optional[str] = None
@@ -58,10 +87,17 @@ class MemoryInfo(BaseModel):
         from_attributes = True
 
 
+class MemoryPage(BaseModel):
+    """按游标分页的记忆列表"""
+    memories: List[MemoryInfo]
+    scores: List[float] = Field(default_factory=list, description="order=relevance 时为与 memories 一一对应的当前相关度")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，为空表示没有更多")
+
+
 class MemorySearchRequest(BaseModel):
     """记忆搜索请求"""
     query: str = Field(..., min_length=1, description="搜索查询")
-    search_type: str = Field("keyword", description="搜索类型: keyword/semantic")
+    search_type: str = Field("keyword", description="搜索类型: keyword/semantic/hybrid")
     memory_type: Optional[str] = Field(None, description="筛选记忆类型")
     contact_id: Optional[str] = Field(None, description="筛选联系人")
     min_importance: Optional[int] = Field(None, ge=1, le=10, description="最低重要性")
@@ -72,10 +108,32 @@ class MemorySearchRequest(BaseModel):
 class MemorySearchResult(BaseModel):
     """搜索结果"""
     memories: List[MemoryInfo]
+    scores: List[Optional[float]] = Field(default_factory=list, description="与 memories 一一对应的得分（LIKE 回退时为 null）")
     total_results: int
     search_time_ms: int
 
 
+class MemoryMultiSearchRequest(BaseModel):
+    """多查询语义搜索请求"""
+    query_embeddings: List[List[float]] = Field(..., min_length=1, max_length=MULTI_QUERY_MAX_SIZE, description="查询向量（维度需一致）")
+    memory_type: Optional[str] = Field(None, description="筛选记忆类型")
+    contact_id: Optional[str] = Field(None, description="筛选联系人")
+    min_importance: Optional[int] = Field(None, ge=1, le=10, description="最低重要性")
+    limit: int = Field(10, ge=1, le=100, description="每个查询返回的结果数量")
+
+
+class MemoryQueryHits(BaseModel):
+    """单个查询的结果"""
+    memories: List[MemoryInfo]
+    scores: List[float]
+
+
+class MemoryMultiSearchResult(BaseModel):
+    """多查询搜索结果，results 与 query_embeddings 顺序一致"""
+    results: List[MemoryQueryHits]
+    search_time_ms: int
+
+
 class MemoryStats(BaseModel):
     """记忆统计"""
     total_memories: int
@@ -87,7 +145,7 @@ class MemoryStats(BaseModel):
 
 # ============ Helper Functions ============
 
-def check_user_level(user: User, required_level: int):
+def check_user_level(user: UserPrincipal, required_level: int):
     """检查用户等级是否满足要求"""
     if user.user_level < required_level:
         raise HTTPException(
@@ -96,7 +154,7 @@ def check_user_level(user: User, required_level: int):
         )
 
 
-def check_membership_expiry(user: User):
+def check_membership_expiry(user: UserPrincipal):
     """检查会员是否过期"""
     if user.expires_at and datetime.now(timezone.utc) > user.expires_at:
         raise HTTPException(
@@ -105,19 +163,162 @@ def check_membership_expiry(user: User):
         )
 
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """计算余弦相似度"""
-    if len(vec1) != len(vec2):
-        return 0.0
+# 每个用户的记忆向量矩阵（连同筛选用的属性列），按占用字节数做 LRU 淘汰；
+# 本进程的写操作主动失效，其他 worker 的写入靠 TTL 兜底
+embedding_cache = SizedTTLCache(
+    "memory_embeddings",
+    max_bytes=int(os.getenv("MEMORY_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    ttl=float(os.getenv("MEMORY_CACHE_TTL", "300")),
+    sizeof=lambda matrix: matrix.nbytes
+)
+
+
+def get_embedding_matrix(db: Session, user_id: int, dim: int) -> EmbeddingMatrix:
+    """读取用户全部记忆向量组成的矩阵（带缓存），只包含维度为 dim 的向量"""
+    matrix = embedding_cache.get(user_id)
+    if matrix is not MISSING and matrix.dim == dim:
+        return matrix
+
+    rows = db.query(
+        MemoryStore.id, MemoryStore.embedding_blob, MemoryStore.embedding_vector,
+        MemoryStore.memory_type, MemoryStore.contact_id, MemoryStore.importance_score
+    ).filter(
+        MemoryStore.user_id == user_id,
+        or_(MemoryStore.embedding_blob.isnot(None), MemoryStore.embedding_vector.isnot(None))
+    ).all()
+    # 未迁移的旧数据没有二进制向量，回退读取 JSON 文本
+    matrix = EmbeddingMatrix.from_rows(
+        ((memory_id, blob or legacy, memory_type, contact_id, importance)
+         for memory_id, blob, legacy, memory_type, contact_id, importance in rows),
+        dim=dim
+    )
+    embedding_cache.set(user_id, matrix)
+    return matrix
+
+
+def load_memories(db: Session, hits: List[Tuple[int, float]]) -> List[MemoryStore]:
+    """按 (记忆ID, 得分) 的顺序加载命中的记忆"""
+    hit_ids = [memory_id for memory_id, _ in hits]
+    if not hit_ids:
+        return []
+    by_id = {m.id: m for m in db.query(MemoryStore).filter(MemoryStore.id.in_(hit_ids))}
+    return [by_id[memory_id] for memory_id in hit_ids if memory_id in by_id]
+
+
+# ============ 检索 ============
+
+# 混合搜索：每路召回 limit×倍数 条候选，再用倒数排名融合（RRF）合并
+HYBRID_POOL_FACTOR = 3
+HYBRID_RRF_K = int(os.getenv("MEMORY_HYBRID_RRF_K", "60"))
+HYBRID_IMPORTANCE_WEIGHT = float(os.getenv("MEMORY_HYBRID_IMPORTANCE_WEIGHT", "0.2"))
+HYBRID_RECENCY_WEIGHT = float(os.getenv("MEMORY_HYBRID_RECENCY_WEIGHT", "0.2"))
+HYBRID_RECENCY_HALF_LIFE_DAYS = float(os.getenv("MEMORY_HYBRID_RECENCY_HALF_LIFE_DAYS", "30"))
+
+
+def keyword_hits(db: Session, user_id: int, search_request: MemorySearchRequest,
+                 limit: int) -> List[Tuple[int, Optional[float]]]:
+    """关键词检索：优先走全文索引，索引不可用时回退到 LIKE（无得分）"""
+    hits = keyword_search(
+        db, user_id, search_request.query, limit,
+        search_request.memory_type, search_request.contact_id, search_request.min_importance
+    )
+    if hits is not None:
+        return hits
+
+    query = db.query(MemoryStore.id).filter(MemoryStore.user_id == user_id)
+
+    # 应用筛选条件
+    if search_request.memory_type:
+        query = query.filter(MemoryStore.memory_type == search_request.memory_type)
+    if search_request.contact_id:
+        query = query.filter(MemoryStore.contact_id == search_request.contact_id)
+    if search_request.min_importance:
+        query = query.filter(MemoryStore.importance_score >= search_request.min_importance)
+
+    # 关键词匹配
+    search_pattern = f"%{search_request.query}%"
+    query = query.filter(
+        or_(
+            MemoryStore.memory_key.like(search_pattern),
+            MemoryStore.memory_content.like(search_pattern)
+        )
+    )
+
+    rows = query.order_by(
+        desc(MemoryStore.importance_score),
+        desc(MemoryStore.access_count)
+    ).limit(limit).all()
+    return [(row.id, None) for row in rows]
+
+
+def semantic_hits(db: Session, user_id: int, search_request: MemorySearchRequest,
+                  limit: int) -> List[Tuple[int, float]]:
+    """向量检索，返回 (记忆ID, 余弦相似度)"""
+    if index_manager.enabled:
+        # 记忆较多的用户走近似索引，筛选条件在索引内完成
+        hits = index_manager.search(
+            db, user_id, search_request.query_embedding, limit,
+            search_request.memory_type, search_request.contact_id, search_request.min_importance
+        )
+        if hits is not None:
+            return hits
+
+    # 精确搜索：在缓存的整份矩阵上筛选并计算
+    matrix = get_embedding_matrix(db, user_id, len(search_request.query_embedding))
+    mask = matrix.filter_mask(
+        search_request.memory_type, search_request.contact_id, search_request.min_importance
+    )
+    return matrix.search(search_request.query_embedding, limit, mask)
+
 
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    magnitude1 = sum(a * a for a in vec1) ** 0.5
-    magnitude2 = sum(b * b for b in vec2) ** 0.5
+def _with_session(retriever, *args):
+    """在线程池中运行检索函数（Session 不能跨线程共用，每路单独开一个）"""
+    db = SessionLocal()
+    try:
+        return retriever(db, *args)
+    finally:
+        db.close()
 
-    if magnitude1 == 0 or magnitude2 == 0:
+
+def _recency(updated_at: Optional[datetime], now: datetime) -> float:
+    """新近度：刚更新为 1，每过一个半衰期减半"""
+    if updated_at is None:
         return 0.0
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    age_days = max((now - updated_at).total_seconds(), 0) / 86400
+    return 0.5 ** (age_days / HYBRID_RECENCY_HALF_LIFE_DAYS)
+
+
+async def hybrid_hits(db: Session, user_id: int,
+                      search_request: MemorySearchRequest) -> List[Tuple[int, float]]:
+    """混合检索：关键词和向量两路并发召回，按 RRF 融合后再用重要性和新近度加权"""
+    pool = search_request.limit * HYBRID_POOL_FACTOR
+    lexical, vector = await asyncio.gather(
+        asyncio.to_thread(_with_session, keyword_hits, user_id, search_request, pool),
+        asyncio.to_thread(_with_session, semantic_hits, user_id, search_request, pool)
+    )
 
-    return dot_product / (magnitude1 * magnitude2)
+    fused: Dict[int, float] = {}
+    for hits in (lexical, vector):
+        for rank, (memory_id, _) in enumerate(hits, start=1):
+            fused[memory_id] = fused.get(memory_id, 0.0) + 1.0 / (HYBRID_RRF_K + rank)
+    if not fused:
+        return []
+
+    rows = db.query(
+        MemoryStore.id, MemoryStore.importance_score, MemoryStore.updated_at
+    ).filter(MemoryStore.id.in_(list(fused))).all()
+    now = datetime.now(timezone.utc)
+    scored = []
+    for row in rows:
+        importance = row.importance_score or 5
+        score = fused[row.id] \
+            * (1 + HYBRID_IMPORTANCE_WEIGHT * (importance - 5) / 5) \
+            * (1 + HYBRID_RECENCY_WEIGHT * _recency(row.updated_at, now))
+        scored.append((row.id, score))
+    scored.sort(key=lambda hit: hit[1], reverse=True)
+    return scored[:search_request.limit]
 
 
 # ============ User Endpoints ============
@@ -126,6 +327,7 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
 async def create_memory(
     memory_data: MemoryCreate,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -133,25 +335,20 @@ async def create_memory(
     - 需要 Level 4+ 权限
     - 支持可选的向量嵌入
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 4)
     check_membership_expiry(user)
 
     # 验证记忆类型
-    valid_types = ["conversation", "fact", "preference", "custom"]
-    if memory_data.memory_type not in valid_types:
+    if memory_data.memory_type not in VALID_MEMORY_TYPES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"无效的记忆类型，支持: {', '.join(valid_types)}"
+            detail=f"无效的记忆类型，支持: {', '.join(VALID_MEMORY_TYPES)}"
         )
 
     # 准备向量数据
-    embedding_json = None
+    embedding_blob = None
     if memory_data.embedding_vector:
-        embedding_json = json.dumps(memory_data.embedding_vector)
+        embedding_blob = encode_embedding(memory_data.embedding_vector)
 
     # 准备元数据
     metadata_json = None
@@ -165,7 +362,7 @@ async def create_memory(
         memory_type=memory_data.memory_type,
         memory_key=memory_data.memory_key,
         memory_content=memory_data.memory_content,
-        embedding_vector=embedding_json,
+        embedding_blob=embedding_blob,
         metadata=metadata_json,
         importance_score=memory_data.importance_score
     )
@@ -174,9 +371,74 @@ async def create_memory(
     db.commit()
     db.refresh(new_memory)
 
+    if memory_data.embedding_vector:
+        embedding_cache.invalidate(user_id)
+        index_manager.on_upsert(
+            user_id, new_memory.id, memory_data.embedding_vector,
+            new_memory.memory_type, new_memory.contact_id, new_memory.importance_score
+        )
+
     return MemoryInfo(**new_memory.to_dict())
 
 
+@router.post("/batch", response_model=MemoryBatchResult, status_code=status.HTTP_201_CREATED)
+async def create_memories_batch(
+    batch: MemoryBatchCreate,
+    user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    批量创建记忆（供摘要任务等一次写入多条）
+    - 需要 Level 4+ 权限，单次最多 500 条
+    - 任一条校验失败则整批不写入
+    - 全文索引由触发器同步，向量缓存/索引在写入后统一更新一次
+    """
+    check_user_level(user, 4)
+    check_membership_expiry(user)
+
+    for i, memory_data in enumerate(batch.memories):
+        if memory_data.memory_type not in VALID_MEMORY_TYPES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"第 {i + 1} 条记忆类型无效，支持: {', '.join(VALID_MEMORY_TYPES)}"
+            )
+
+    values = [
+        {
+            "user_id": user_id,
+            "contact_id": memory_data.contact_id,
+            "memory_type": memory_data.memory_type,
+            "memory_key": memory_data.memory_key,
+            "memory_content": memory_data.memory_content,
+            "embedding_blob": encode_embedding(memory_data.embedding_vector) if memory_data.embedding_vector else None,
+            "mem_metadata": json.dumps(memory_data.metadata) if memory_data.metadata else None,
+            "importance_score": memory_data.importance_score,
+            # Core 批量插入不触发 ORM 事件，相关度在这里计算
+            "relevance_score": relevance_score(memory_data.importance_score, 0)
+        }
+        for memory_data in batch.memories
+    ]
+    # 多行 INSERT ... RETURNING 批量写入（SQLAlchemy 按驱动自动分批）。
+    # 自增 ID 按 VALUES 顺序分配，RETURNING 结果排序后即与输入一一对应；
+    # 不用 sort_by_parameter_order，它在 SQLite 上会退化成逐条 INSERT
+    ids = sorted(db.scalars(insert(MemoryStore).returning(MemoryStore.id), values))
+    track_inserted(db, values)
+    db.commit()
+
+    embedded = [
+        (memory_id, memory_data.embedding_vector, memory_data.memory_type,
+         memory_data.contact_id, memory_data.importance_score)
+        for memory_id, memory_data in zip(ids, batch.memories)
+        if memory_data.embedding_vector
+    ]
+    if embedded:
+        embedding_cache.invalidate(user_id)
+        index_manager.on_upsert_many(user_id, embedded)
+
+    return MemoryBatchResult(created=len(ids), ids=ids)
+
+
 @router.get("/list", response_model=List[MemoryInfo])
 async def list_memories(
     memory_type: Optional[str] = None,
@@ -185,16 +447,13 @@ async def list_memories(
     skip: int = 0,
     limit: int = 50,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     获取用户的记忆列表
     - 可按类型、联系人、重要性筛选
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 4)
 
     query = db.query(MemoryStore).filter(MemoryStore.user_id == user_id)
@@ -214,20 +473,101 @@ async def list_memories(
     return [MemoryInfo(**m.to_dict()) for m in memories]
 
 
+def _decode_page_cursor(cursor: str, order: str) -> tuple:
+    """解析列表游标，返回与排序键对应的 (..., id)
+
+    游标格式（客户端视为不透明字符串）：
+    - importance: "{id}:{重要性}:{updated_at 原始值}"
+    - relevance:  "{id}:{相关度}"
+    """
+    try:
+        if order == "importance":
+            memory_id, importance, updated_at = cursor.split(":", 2)
+            # updated_at 原样回传给数据库比较：SQLite 中时间以文本存储，
+            # 转成 datetime 再绑定会带上微秒，与库中的文本不再相等
+            return int(importance), literal(updated_at, String), int(memory_id)
+        memory_id, score = cursor.split(":", 1)
+        return float(score), int(memory_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的游标: {cursor}")
+
+
+@router.get("/list/page", response_model=MemoryPage)
+async def list_memories_page(
+    order: str = "importance",
+    cursor: Optional[str] = None,
+    memory_type: Optional[str] = None,
+    contact_id: Optional[str] = None,
+    min_importance: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    按游标分页获取记忆列表
+    - order=importance: 按重要性、更新时间降序（与 /list 相同）
+    - order=relevance: 按 重要性 × 访问频率 × 时间衰减 的相关度降序
+    - 下一页传入上次返回的 next_cursor；翻页走复合索引，页数再深也不需要排序全部记忆
+    """
+    check_user_level(user, 4)
+
+    if order == "importance":
+        sort_columns = (MemoryStore.importance_score, MemoryStore.updated_at, MemoryStore.id)
+    elif order == "relevance":
+        sort_columns = (MemoryStore.relevance_score, MemoryStore.id)
+    else:
+        raise HTTPException(status_code=400, detail="无效的排序方式，支持: importance, relevance")
+
+    query = db.query(
+        MemoryStore,
+        # 游标中保存 updated_at 的原始值，见 _decode_page_cursor
+        type_coerce(MemoryStore.updated_at, String).label("updated_at_raw")
+    ).filter(MemoryStore.user_id == user_id)
+
+    if order == "relevance":
+        query = query.filter(MemoryStore.relevance_score.isnot(None))
+    if memory_type:
+        query = query.filter(MemoryStore.memory_type == memory_type)
+    if contact_id:
+        query = query.filter(MemoryStore.contact_id == contact_id)
+    if min_importance:
+        query = query.filter(MemoryStore.importance_score >= min_importance)
+    if cursor:
+        query = query.filter(tuple_(*sort_columns) < tuple_(*_decode_page_cursor(cursor, order)))
+
+    # 多取一行用于判断是否还有下一页
+    rows = query.order_by(*(desc(column) for column in sort_columns)).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last, updated_at_raw = rows[-1]
+        if order == "importance":
+            next_cursor = f"{last.id}:{last.importance_score}:{updated_at_raw}"
+        else:
+            next_cursor = f"{last.id}:{last.relevance_score!r}"
+
+    now = datetime.now(timezone.utc)
+    return MemoryPage(
+        memories=[MemoryInfo(**m.to_dict()) for m, _ in rows],
+        scores=[current_relevance(m.relevance_score, now) for m, _ in rows] if order == "relevance" else [],
+        next_cursor=next_cursor
+    )
+
+
 @router.get("/{memory_id}", response_model=MemoryInfo)
 async def get_memory(
     memory_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     获取记忆详情
     - 自动更新访问次数和最后访问时间
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 4)
 
     memory = db.query(MemoryStore).filter(
@@ -238,13 +578,14 @@ async def get_memory(
     if not memory:
         raise HTTPException(status_code=404, detail="记忆不存在")
 
-    # 更新访问统计
-    memory.access_count += 1
-    memory.last_accessed_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(memory)
+    # 更新访问统计（由后台批量写入，返回值包含尚未写入的次数）
+    accessed_at = datetime.now(timezone.utc)
+    telemetry.record_access(memory.id, accessed_at)
+    info = memory.to_dict()
+    info["access_count"] = (memory.access_count or 0) + telemetry.pending_accesses(memory.id)
+    info["last_accessed_at"] = accessed_at
 
-    return MemoryInfo(**memory.to_dict())
+    return MemoryInfo(**info)
 
 
 @router.put("/{memory_id}", response_model=MemoryInfo)
@@ -252,13 +593,10 @@ async def update_memory(
     memory_id: int,
     memory_update: MemoryUpdate,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """更新记忆内容"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 4)
     check_membership_expiry(user)
 
@@ -275,7 +613,8 @@ async def update_memory(
         memory.memory_content = memory_update.memory_content
 
     if memory_update.embedding_vector is not None:
-        memory.embedding_vector = json.dumps(memory_update.embedding_vector)
+        memory.embedding_blob = encode_embedding(memory_update.embedding_vector)
+        memory.embedding_vector = None
 
     if memory_update.metadata is not None:
         memory.metadata = json.dumps(memory_update.metadata)
@@ -286,6 +625,16 @@ async def update_memory(
     db.commit()
     db.refresh(memory)
 
+    if memory_update.embedding_vector is not None or memory_update.importance_score is not None:
+        embedding_cache.invalidate(user_id)
+    if memory_update.embedding_vector is not None:
+        index_manager.on_upsert(
+            user_id, memory.id, memory_update.embedding_vector,
+            memory.memory_type, memory.contact_id, memory.importance_score
+        )
+    elif memory_update.importance_score is not None:
+        index_manager.on_importance_many(user_id, [(memory.id, memory.importance_score)])
+
     return MemoryInfo(**memory.to_dict())
 
 
@@ -293,13 +642,10 @@ async def update_memory(
 async def delete_memory(
     memory_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """删除记忆"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 4)
 
     memory = db.query(MemoryStore).filter(
@@ -312,6 +658,8 @@ async def delete_memory(
 
     db.delete(memory)
     db.commit()
+    embedding_cache.invalidate(user_id)
+    index_manager.on_delete(user_id, memory_id)
 
     return None
 
@@ -320,152 +668,119 @@ async def delete_memory(
 async def search_memories(
     search_request: MemorySearchRequest,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     搜索记忆
-    - 支持关键词搜索和语义搜索
-    - 语义搜索需要提供查询向量
+    - 支持关键词搜索、语义搜索和混合搜索
+    - 语义搜索和混合搜索需要提供查询向量
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 4)
 
     start_time = time.time()
 
     if search_request.search_type == "keyword":
-        # 关键词搜索
-        query = db.query(MemoryStore).filter(MemoryStore.user_id == user_id)
-
-        # 应用筛选条件
-        if search_request.memory_type:
-            query = query.filter(MemoryStore.memory_type == search_request.memory_type)
-        if search_request.contact_id:
-            query = query.filter(MemoryStore.contact_id == search_request.contact_id)
-        if search_request.min_importance:
-            query = query.filter(MemoryStore.importance_score >= search_request.min_importance)
-
-        # 关键词匹配
-        search_pattern = f"%{search_request.query}%"
-        query = query.filter(
-            or_(
-                MemoryStore.memory_key.like(search_pattern),
-                MemoryStore.memory_content.like(search_pattern)
-            )
-        )
+        hits = keyword_hits(db, user_id, search_request, search_request.limit)
 
-        memories = query.order_by(
-            desc(MemoryStore.importance_score),
-            desc(MemoryStore.access_count)
-        ).limit(search_request.limit).all()
-
-    elif search_request.search_type == "semantic":
-        # 语义搜索（基于向量相似度）
+    elif search_request.search_type in ("semantic", "hybrid"):
+        # 语义搜索（基于向量相似度）/ 混合搜索
         if not search_request.query_embedding:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="语义搜索需要提供 query_embedding"
+                detail="语义搜索和混合搜索需要提供 query_embedding"
             )
-
-        # 获取所有有向量的记忆
-        query = db.query(MemoryStore).filter(
-            MemoryStore.user_id == user_id,
-            MemoryStore.embedding_vector.isnot(None)
-        )
-
-        # 应用筛选条件
-        if search_request.memory_type:
-            query = query.filter(MemoryStore.memory_type == search_request.memory_type)
-        if search_request.contact_id:
-            query = query.filter(MemoryStore.contact_id == search_request.contact_id)
-        if search_request.min_importance:
-            query = query.filter(MemoryStore.importance_score >= search_request.min_importance)
-
-        all_memories = query.all()
-
-        # 计算相似度并排序
-        memories_with_similarity = []
-        for memory in all_memories:
-            try:
-                memory_vector = json.loads(memory.embedding_vector)
-                similarity = cosine_similarity(search_request.query_embedding, memory_vector)
-                memories_with_similarity.append((memory, similarity))
-            except:
-                continue
-
-        # 按相似度排序
-        memories_with_similarity.sort(key=lambda x: x[1], reverse=True)
-        memories = [m[0] for m in memories_with_similarity[:search_request.limit]]
+        if search_request.search_type == "semantic":
+            # 向量计算和索引访问放到线程池，不阻塞事件循环
+            hits = await asyncio.to_thread(
+                _with_session, semantic_hits, user_id, search_request, search_request.limit
+            )
+        else:
+            hits = await hybrid_hits(db, user_id, search_request)
 
     else:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="无效的搜索类型，支持: keyword, semantic"
+            detail="无效的搜索类型，支持: keyword, semantic, hybrid"
         )
 
+    memories = load_memories(db, hits)
+    scores = dict(hits)
+
     # 记录搜索历史
     search_time_ms = int((time.time() - start_time) * 1000)
-    search_history = MemorySearchHistory(
-        user_id=user_id,
-        search_query=search_request.query,
-        search_type=search_request.search_type,
-        results_count=len(memories),
-        search_time_ms=search_time_ms
+    telemetry.record_search(
+        user_id, search_request.query, search_request.search_type, len(memories), search_time_ms
     )
-    db.add(search_history)
-    db.commit()
 
     return MemorySearchResult(
         memories=[MemoryInfo(**m.to_dict()) for m in memories],
+        scores=[scores[m.id] for m in memories],
         total_results=len(memories),
         search_time_ms=search_time_ms
     )
 
 
-@router.get("/stats/my", response_model=MemoryStats)
-async def get_my_memory_stats(
+@router.post("/search/multi", response_model=MemoryMultiSearchResult)
+async def search_memories_multi(
+    search_request: MemoryMultiSearchRequest,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
-    """获取当前用户的记忆统计"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
+    """
+    多查询语义搜索
+    - 一次传入多个查询向量（如最近几轮对话），分别返回各自最相关的记忆
+    - 所有查询共用一次矩阵乘法，记忆向量只读取一次
+    """
     check_user_level(user, 4)
 
-    # 总数
-    total_memories = db.query(func.count(MemoryStore.id)).filter(
-        MemoryStore.user_id == user_id
-    ).scalar() or 0
+    start_time = time.time()
 
-    # 按类型统计
-    type_stats = db.query(
-        MemoryStore.memory_type,
-        func.count(MemoryStore.id).label('count')
-    ).filter(
-        MemoryStore.user_id == user_id
-    ).group_by(MemoryStore.memory_type).all()
+    dim = len(search_request.query_embeddings[0])
+    if dim == 0 or any(len(query) != dim for query in search_request.query_embeddings):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="query_embeddings 中的向量维度必须一致且不为空"
+        )
 
-    by_type = {stat.memory_type: stat.count for stat in type_stats}
+    matrix = get_embedding_matrix(db, user_id, dim)
+    mask = matrix.filter_mask(
+        search_request.memory_type, search_request.contact_id, search_request.min_importance
+    )
+    hits_per_query = matrix.search_many(search_request.query_embeddings, search_request.limit, mask)
+
+    # 所有查询命中的记忆一次加载
+    all_hits = {memory_id: 0.0 for hits in hits_per_query for memory_id, _ in hits}
+    by_id = {m.id: m for m in load_memories(db, list(all_hits.items()))}
+    results = []
+    for hits in hits_per_query:
+        hits = [(memory_id, score) for memory_id, score in hits if memory_id in by_id]
+        results.append(MemoryQueryHits(
+            memories=[MemoryInfo(**by_id[memory_id].to_dict()) for memory_id, _ in hits],
+            scores=[score for _, score in hits]
+        ))
 
-    # 按联系人统计
-    contact_stats = db.query(
-        MemoryStore.contact_id,
-        func.count(MemoryStore.id).label('count')
-    ).filter(
-        MemoryStore.user_id == user_id,
-        MemoryStore.contact_id.isnot(None)
-    ).group_by(MemoryStore.contact_id).all()
+    # 记录搜索历史
+    search_time_ms = int((time.time() - start_time) * 1000)
+    telemetry.record_search(
+        user_id, f"[{len(search_request.query_embeddings)} 个查询向量]", "semantic_multi",
+        sum(len(result.memories) for result in results), search_time_ms
+    )
+
+    return MemoryMultiSearchResult(results=results, search_time_ms=search_time_ms)
 
-    by_contact = {stat.contact_id: stat.count for stat in contact_stats if stat.contact_id}
 
-    # 存储大小估算（字符数）
-    total_size = db.query(
-        func.sum(func.length(MemoryStore.memory_content))
-    ).filter(MemoryStore.user_id == user_id).scalar() or 0
+@router.get("/stats/my", response_model=MemoryStats)
+async def get_my_memory_stats(
+    user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """获取当前用户的记忆统计（计数来自增量维护的统计表）"""
+    check_user_level(user, 4)
+
+    stats = user_stats(db, user_id)
 
     # 最常访问的记忆
     most_accessed = db.query(MemoryStore).filter(
@@ -475,10 +790,7 @@ async def get_my_memory_stats(
     ).limit(5).all()
 
     return MemoryStats(
-        total_memories=total_memories,
-        by_type=by_type,
-        by_contact=by_contact,
-        total_storage_size=int(total_size),
+        **stats,
         most_accessed=[MemoryInfo(**m.to_dict()) for m in most_accessed]
     )
 
@@ -488,32 +800,63 @@ async def get_my_memory_stats(
 @router.get("/admin/overview", response_model=dict)
 async def get_memory_overview(
     user_id: int = Depends(get_current_user),
+    admin: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """管理员：获取所有记忆的概览统计"""
-    admin = db.query(User).filter(User.id == user_id).first()
     if not admin or admin.user_level != 99:
         raise HTTPException(status_code=403, detail="需要管理员权限")
 
-    total_memories = db.query(func.count(MemoryStore.id)).scalar() or 0
+    return global_stats(db)
 
-    users_with_memories = db.query(
-        func.count(func.distinct(MemoryStore.user_id))
-    ).scalar() or 0
 
-    total_storage = db.query(
-        func.sum(func.length(MemoryStore.memory_content))
-    ).scalar() or 0
+@router.post("/admin/consolidate", response_model=dict)
+async def consolidate_duplicate_memories(
+    threshold: float = DEDUP_THRESHOLD,
+    start_after: int = 0,
+    max_users: Optional[int] = None,
+    user_id: int = Depends(get_current_user),
+    admin: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    管理员：合并近似重复的记忆
+    - 按用户 ID 顺序逐个处理，可用 start_after/max_users 分段执行
+    - 返回合并条数和回收字节数，last_user_id 作为下次的 start_after
+    """
+    if not admin or admin.user_level != 99:
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+    if not 0 < threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold 需在 (0, 1] 范围内")
+
+    def after_user(target_user_id: int, result: dict):
+        if result["deleted_ids"]:
+            embedding_cache.invalidate(target_user_id)
+            index_manager.on_delete_many(target_user_id, result["deleted_ids"])
+            index_manager.on_importance_many(target_user_id, result["keepers"])
+
+    # 整理任务使用独立会话，先结束本请求鉴权查询开启的读事务，避免 SQLite 上阻塞其提交
+    db.commit()
+    return await asyncio.to_thread(
+        consolidate_memories, threshold, start_after, max_users, after_user
+    )
+
 
-    # 按类型统计
-    type_stats = db.query(
-        MemoryStore.memory_type,
-        func.count(MemoryStore.id).label('count')
-    ).group_by(MemoryStore.memory_type).all()
+@router.post("/admin/stats/reconcile", response_model=dict)
+async def reconcile_memory_stats(
+    start_after: int = 0,
+    max_users: Optional[int] = None,
+    user_id: int = Depends(get_current_user),
+    admin: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    管理员：按明细核对并修正记忆统计计数
+    - 按用户 ID 顺序逐个处理，可用 start_after/max_users 分段执行
+    """
+    if not admin or admin.user_level != 99:
+        raise HTTPException(status_code=403, detail="需要管理员权限")
 
-    return {
-        "total_memories": total_memories,
-        "users_with_memories": users_with_memories,
-        "total_storage_bytes": int(total_storage),
-        "by_type": {stat.memory_type: stat.count for stat in type_stats}
-    }
+    # 同 consolidate：先结束本请求的读事务
+    db.commit()
+    return await asyncio.to_thread(reconcile_stats, start_after, max_users)
@@ -0,0 +1,233 @@
+"""记忆整理任务：合并近似重复的记忆
+
+长期运行后同一件事会被反复记成多条内容相近的记忆，既占存储，也拖慢每次语义搜索。
+这里按用户逐个处理：
+- 同一用户内按 (记忆类型, 联系人, 向量维度) 分组，只在组内比较，不会把不同联系人的记忆合并
+- 组内按 重要性、访问次数、更新时间 降序排列，依次以每条仍保留的记忆为中心，
+  把余弦相似度不低于 MEMORY_DEDUP_THRESHOLD 的其余记忆并入它（贪心聚类）
+- 保留的记忆是簇内重要性最高的一条，访问次数累加、最后访问时间取最大值，其余记忆删除
+
+读取和计算不持有写锁；写入按 MEMORY_DEDUP_BATCH_SIZE 条分批提交，每个用户处理完立即提交，
+不会长时间锁表。可用 start_after / max_users 分段执行，返回值中的 last_user_id 作为下次的起点。
+
+用法：
+1. 直接运行: python memory_consolidate.py
+2. 配置 cron/定时任务定期执行；也可由管理员调用 /api/v1/memory/admin/consolidate
+
+环境变量：
+- DATABASE_URL: 数据库连接字符串
+- MEMORY_DEDUP_THRESHOLD: 判定为重复的余弦相似度阈值（默认 0.95）
+- MEMORY_DEDUP_BATCH_SIZE: 每次提交最多删除的记忆数（默认 500）
+"""
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import MemoryStore
+from memory_vectors import parse_embedding
+from memory_relevance import relevance_score
+import memory_stats  # noqa: F401  注册统计计数的 session 事件，删除记忆时同步扣减
+
+DEDUP_THRESHOLD = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.95"))
+BATCH_SIZE = int(os.getenv("MEMORY_DEDUP_BATCH_SIZE", "500"))
+# 分块计算相似度时临时矩阵的元素数上限（float32 约 16MB）
+BLOCK_ELEMENTS = 4 * 1024 * 1024
+
+
+def find_duplicates(vectors: np.ndarray, threshold: float = DEDUP_THRESHOLD) -> List[Tuple[int, np.ndarray]]:
+    """对已按优先级降序排列的向量做贪心聚类
+
+    返回 [(保留行号, 并入它的行号数组)]；靠前的行优先保留。
+    相似度按块计算，临时矩阵不超过 BLOCK_ELEMENTS 个元素
+    """
+    n = len(vectors)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    # 零向量与任何向量都不相似，不参与合并
+    alive = norms[:, 0] > 0
+    positions = np.arange(n)
+    block = max(1, BLOCK_ELEMENTS // max(n, 1))
+
+    clusters = []
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        similarities = unit[start:end] @ unit.T
+        for row in range(start, end):
+            if not alive[row]:
+                continue
+            matched = (similarities[row - start] >= threshold) & alive & (positions > row)
+            duplicates = np.flatnonzero(matched)
+            if duplicates.size:
+                alive[duplicates] = False
+                clusters.append((row, duplicates))
+    return clusters
+
+
+def _row_bytes(memory: MemoryStore) -> int:
+    """一条记忆占用的存储字节数（文本按 UTF-8 计算）"""
+    size = 0
+    for value in (memory.memory_key, memory.memory_content, memory.mem_metadata, memory.embedding_vector):
+        if value:
+            size += len(value.encode("utf-8"))
+    if memory.embedding_blob:
+        size += len(memory.embedding_blob)
+    return size
+
+
+def _plan_user(db: Session, user_id: int, threshold: float) -> List[Tuple[int, List[int]]]:
+    """读取一个用户的记忆向量并找出重复，返回 [(保留的记忆ID, 待合并的记忆ID列表)]"""
+    rows = db.query(
+        MemoryStore.id, MemoryStore.embedding_blob, MemoryStore.embedding_vector,
+        MemoryStore.memory_type, MemoryStore.contact_id
+    ).filter(
+        MemoryStore.user_id == user_id,
+        or_(MemoryStore.embedding_blob.isnot(None), MemoryStore.embedding_vector.isnot(None))
+    ).order_by(
+        MemoryStore.importance_score.desc(),
+        MemoryStore.access_count.desc(),
+        MemoryStore.updated_at.desc(),
+        MemoryStore.id.desc()
+    ).all()
+
+    # 分组后组内仍保持上面的优先级顺序
+    groups: Dict[tuple, Tuple[List[int], List[np.ndarray]]] = defaultdict(lambda: ([], []))
+    for memory_id, blob, legacy, memory_type, contact_id in rows:
+        vector = parse_embedding(blob or legacy)
+        if vector is None:
+            continue
+        ids, vectors = groups[(memory_type, contact_id, vector.shape[0])]
+        ids.append(memory_id)
+        vectors.append(vector)
+
+    plan = []
+    for ids, vectors in groups.values():
+        if len(ids) < 2:
+            continue
+        for keeper, duplicates in find_duplicates(np.vstack(vectors).astype(np.float32), threshold):
+            plan.append((ids[keeper], [ids[i] for i in duplicates]))
+    return plan
+
+
+def _merge(db: Session, user_id: int,
+           clusters: List[Tuple[int, List[int]]]) -> Tuple[List[int], List[Tuple[int, int]], int]:
+    """在一个事务内合并一批簇，返回 (删除的记忆ID, [(保留的记忆ID, 合并后的重要性)], 回收字节数)
+
+    写入前重新读取相关行，读取之后被删除的记忆会被跳过
+    """
+    involved = [memory_id for keeper, duplicates in clusters for memory_id in (keeper, *duplicates)]
+    by_id = {
+        m.id: m for m in db.query(MemoryStore).filter(
+            MemoryStore.user_id == user_id,
+            MemoryStore.id.in_(involved)
+        )
+    }
+
+    deleted_ids = []
+    keepers = []
+    reclaimed = 0
+    for keeper_id, duplicate_ids in clusters:
+        keeper = by_id.get(keeper_id)
+        duplicates = [by_id[memory_id] for memory_id in duplicate_ids if memory_id in by_id]
+        if keeper is None or not duplicates:
+            continue
+
+        keeper.importance_score = max(m.importance_score or 0 for m in (keeper, *duplicates))
+        keepers.append((keeper_id, keeper.importance_score))
+        accessed = [m.last_accessed_at for m in (keeper, *duplicates) if m.last_accessed_at]
+        if accessed:
+            keeper.last_accessed_at = max(accessed)
+        # 访问次数用 SQL 表达式累加，不覆盖后台统计任务同时写入的增量；
+        # 此时 ORM 事件无法计算相关度，在这里按合并后的次数设置
+        added = sum(m.access_count or 0 for m in duplicates)
+        if added:
+            keeper.relevance_score = relevance_score(keeper.importance_score, (keeper.access_count or 0) + added)
+            keeper.access_count = MemoryStore.access_count + added
+
+        for memory in duplicates:
+            reclaimed += _row_bytes(memory)
+            deleted_ids.append(memory.id)
+            db.delete(memory)
+
+    db.commit()
+    return deleted_ids, keepers, reclaimed
+
+
+def consolidate_user(db: Session, user_id: int, threshold: float = DEDUP_THRESHOLD,
+                     batch_size: int = BATCH_SIZE) -> dict:
+    """整理一个用户的记忆，返回统计信息（deleted_ids、keepers 供调用方更新缓存和索引）"""
+    plan = _plan_user(db, user_id, threshold)
+    # 结束读事务，计算期间不持有任何锁
+    db.commit()
+
+    result = {"clusters": 0, "deleted_ids": [], "keepers": [], "bytes_reclaimed": 0}
+    batch: List[Tuple[int, List[int]]] = []
+    pending = 0
+    for keeper_id, duplicate_ids in plan:
+        batch.append((keeper_id, duplicate_ids))
+        pending += len(duplicate_ids)
+        if pending >= batch_size:
+            deleted, keepers, reclaimed = _merge(db, user_id, batch)
+            result["deleted_ids"].extend(deleted)
+            result["keepers"].extend(keepers)
+            result["bytes_reclaimed"] += reclaimed
+            batch, pending = [], 0
+    if batch:
+        deleted, keepers, reclaimed = _merge(db, user_id, batch)
+        result["deleted_ids"].extend(deleted)
+        result["keepers"].extend(keepers)
+        result["bytes_reclaimed"] += reclaimed
+    result["clusters"] = len(plan)
+    return result
+
+
+def consolidate_memories(threshold: float = DEDUP_THRESHOLD, start_after: int = 0,
+                         max_users: Optional[int] = None, on_user_done=None) -> dict:
+    """按用户 ID 顺序逐个整理，返回汇总统计
+
+    on_user_done(user_id, result) 在每个用户提交后调用（服务内执行时用于失效缓存）
+    """
+    db: Session = SessionLocal()
+    stats = {"users": 0, "clusters": 0, "deleted": 0, "bytes_reclaimed": 0, "last_user_id": start_after}
+
+    try:
+        while max_users is None or stats["users"] < max_users:
+            user_id = db.query(func.min(MemoryStore.user_id)).filter(
+                MemoryStore.user_id > stats["last_user_id"]
+            ).scalar()
+            if user_id is None:
+                break
+
+            result = consolidate_user(db, user_id, threshold)
+            stats["users"] += 1
+            stats["clusters"] += result["clusters"]
+            stats["deleted"] += len(result["deleted_ids"])
+            stats["bytes_reclaimed"] += result["bytes_reclaimed"]
+            stats["last_user_id"] = user_id
+            if result["deleted_ids"]:
+                print(f"   用户 {user_id}: 合并 {len(result['deleted_ids'])} 条，回收 {result['bytes_reclaimed']} 字节")
+            if on_user_done is not None:
+                on_user_done(user_id, result)
+
+        print(f"✅ 记忆整理完成: {stats}")
+        return stats
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 记忆整理失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print(f"🧹 开始整理重复记忆... (相似度阈值: {DEDUP_THRESHOLD})")
+    consolidate_memories()
@@ -0,0 +1,197 @@
+"""记忆全文检索
+
+关键词搜索原先用 LIKE '%q%'，每次都要扫描用户的全部记忆。这里按数据库类型建立全文索引：
+
+- SQLite: FTS5 虚拟表 memory_fts（不存原文），由 memory_store 上的触发器自动同步。
+  中文没有空格分词，写入前由 memory_fts_tokens() 把连续的中日韩文字切成重叠的二元组
+  （"小猫咪" -> "小猫 猫咪"），查询时按短语匹配二元组序列，效果等同于子串匹配；
+  该函数在 database.py 中注册到每个连接上
+- PostgreSQL: tsvector 生成列 + GIN 索引负责英文等有空格分词的文本，
+  pg_trgm 三元组索引加速中文的 ILIKE 子串匹配
+
+排序使用 BM25（PostgreSQL 为 ts_rank_cd + 三元组相似度），再按 importance_score 加权：
+重要性每高于/低于 5 一分，得分增减 MEMORY_FTS_IMPORTANCE_WEIGHT/5。
+索引不可用（建表失败、单个汉字的查询等）时返回 None，由调用方回退到 LIKE
+"""
+import os
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# 重要性对相关度的加权幅度（重要性 10 的记忆得分 ×(1+权重)，重要性 1 的 ×(1-0.8×权重)）
+IMPORTANCE_WEIGHT = float(os.getenv("MEMORY_FTS_IMPORTANCE_WEIGHT", "0.2"))
+
+# 中日韩文字（假名、汉字、谚文）
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_RUN_RE = re.compile(f"([{_CJK}]+)|([^{_CJK}]+)")
+_WORD_RE = re.compile(r"\w+")
+
+# 当前使用的全文索引：sqlite / postgresql / None（未启用）
+_backend: Optional[str] = None
+
+
+def _bigrams(run: str) -> str:
+    if len(run) == 1:
+        return run
+    return " ".join(run[i:i + 2] for i in range(len(run) - 1))
+
+
+def ngram_tokens(value: Optional[str]) -> str:
+    """把文本转换为建索引用的词串：中日韩文字切成二元组，其余文本原样交给分词器"""
+    if not value:
+        return ""
+    parts = []
+    for cjk, other in _RUN_RE.findall(value):
+        parts.append(_bigrams(cjk) if cjk else other)
+    return " ".join(parts)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """把用户输入转换为 FTS5 查询；包含单个汉字等无法用二元组匹配的片段时返回 None"""
+    terms = []
+    for cjk, other in _RUN_RE.findall(query):
+        if cjk:
+            if len(cjk) == 1:
+                return None
+            # 短语匹配：二元组必须连续出现
+            terms.append(f'"{_bigrams(cjk)}"')
+        else:
+            # 英文等按词前缀匹配；只取 \w 字符，不会混入 FTS5 语法
+            terms.extend(f'"{word}"*' for word in _WORD_RE.findall(other.lower()))
+    return " AND ".join(terms) or None
+
+
+# ============ 建立索引 ============
+
+_SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_store_fts_insert AFTER INSERT ON memory_store BEGIN
+        INSERT INTO memory_fts(rowid, key_text, content_text)
+        VALUES (new.id, memory_fts_tokens(new.memory_key), memory_fts_tokens(new.memory_content));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_store_fts_delete AFTER DELETE ON memory_store BEGIN
+        INSERT INTO memory_fts(memory_fts, rowid, key_text, content_text)
+        VALUES ('delete', old.id, memory_fts_tokens(old.memory_key), memory_fts_tokens(old.memory_content));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_store_fts_update AFTER UPDATE OF memory_key, memory_content ON memory_store BEGIN
+        INSERT INTO memory_fts(memory_fts, rowid, key_text, content_text)
+        VALUES ('delete', old.id, memory_fts_tokens(old.memory_key), memory_fts_tokens(old.memory_content));
+        INSERT INTO memory_fts(rowid, key_text, content_text)
+        VALUES (new.id, memory_fts_tokens(new.memory_key), memory_fts_tokens(new.memory_content));
+    END
+    """,
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE memory_store ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(memory_key, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(memory_content, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_memory_search_tsv ON memory_store USING GIN (search_tsv)",
+    "CREATE INDEX IF NOT EXISTS idx_memory_key_trgm ON memory_store USING GIN (memory_key gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_memory_content_trgm ON memory_store USING GIN (memory_content gin_trgm_ops)",
+]
+
+
+def setup_fts(engine):
+    """建立全文索引（init_db 时调用，可重复执行）"""
+    global _backend
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as conn:
+            if dialect == "sqlite":
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'memory_fts'"
+                ).first()
+                if not exists:
+                    conn.exec_driver_sql(
+                        "CREATE VIRTUAL TABLE memory_fts USING fts5("
+                        "key_text, content_text, content='', tokenize='unicode61')"
+                    )
+                    # 首次建表时为已有记忆补建索引
+                    conn.exec_driver_sql(
+                        "INSERT INTO memory_fts(rowid, key_text, content_text) "
+                        "SELECT id, memory_fts_tokens(memory_key), memory_fts_tokens(memory_content) "
+                        "FROM memory_store"
+                    )
+                    print("🔧 已创建记忆全文索引 memory_fts")
+                for ddl in _SQLITE_TRIGGERS:
+                    conn.exec_driver_sql(ddl)
+            elif dialect == "postgresql":
+                for ddl in _POSTGRES_DDL:
+                    conn.exec_driver_sql(ddl)
+            else:
+                return
+        _backend = dialect
+    except Exception as e:
+        _backend = None
+        print(f"⚠️ 记忆全文索引不可用，关键词搜索将使用 LIKE: {e}")
+
+
+# ============ 查询 ============
+
+def _filter_sql(memory_type: Optional[str], contact_id: Optional[str],
+                min_importance: Optional[int], params: dict) -> str:
+    clauses = []
+    if memory_type:
+        clauses.append("AND m.memory_type = :memory_type")
+        params["memory_type"] = memory_type
+    if contact_id:
+        clauses.append("AND m.contact_id = :contact_id")
+        params["contact_id"] = contact_id
+    if min_importance:
+        clauses.append("AND m.importance_score >= :min_importance")
+        params["min_importance"] = min_importance
+    return " ".join(clauses)
+
+
+def keyword_search(db: Session, user_id: int, query: str, limit: int,
+                   memory_type: Optional[str] = None, contact_id: Optional[str] = None,
+                   min_importance: Optional[int] = None) -> Optional[List[Tuple[int, float]]]:
+    """全文检索，返回按相关度降序的 (记忆ID, 得分)；索引不可用时返回 None"""
+    params = {"user_id": user_id, "limit": limit, "weight": IMPORTANCE_WEIGHT}
+    boost = "(1.0 + :weight * (COALESCE(m.importance_score, 5) - 5) / 5.0)"
+
+    if _backend == "sqlite":
+        match = build_match_query(query)
+        if match is None:
+            return None
+        params["match"] = match
+        # bm25 越小越相关，取负数；记忆标识的权重是内容的 2 倍
+        sql = f"""
+            SELECT m.id, -bm25(memory_fts, 2.0, 1.0) * {boost} AS score
+            FROM memory_fts JOIN memory_store m ON m.id = memory_fts.rowid
+            WHERE memory_fts MATCH :match AND m.user_id = :user_id
+            {_filter_sql(memory_type, contact_id, min_importance, params)}
+            ORDER BY score DESC
+            LIMIT :limit
+        """
+    elif _backend == "postgresql":
+        params["query"] = query
+        params["pattern"] = f"%{query}%"
+        sql = f"""
+            SELECT m.id,
+                   (ts_rank_cd(m.search_tsv, q) +
+                    GREATEST(word_similarity(:query, m.memory_key), word_similarity(:query, m.memory_content))
+                   ) * {boost} AS score
+            FROM memory_store m, plainto_tsquery('simple', :query) q
+            WHERE m.user_id = :user_id
+              AND (m.search_tsv @@ q OR m.memory_key ILIKE :pattern OR m.memory_content ILIKE :pattern)
+            {_filter_sql(memory_type, contact_id, min_importance, params)}
+            ORDER BY score DESC
+            LIMIT :limit
+        """
+    else:
+        return None
+
+    return [(row.id, float(row.score)) for row in db.execute(text(sql), params)]
@@ -0,0 +1,477 @@
+"""记忆向量近似最近邻索引（IVF）
+
+记忆很多的用户做语义搜索时，精确计算要扫描全部向量。这里为每个用户维护一个倒排索引：
+- 用 k-means 把归一化后的向量聚成 nlist≈√n 个簇，查询时只扫描与查询最接近的 nprobe 个簇
+- nprobe 是召回率与耗时的权衡（MEMORY_ANN_NPROBE），探测的簇内结果不足 k 条时回退为精确搜索
+- 每行同时保存记忆类型、联系人和重要性（与 EmbeddingMatrix 相同的整数编码），
+  类型/联系人/重要性筛选直接在探测到的行上完成，不需要从数据库查候选 ID
+- 记忆总数少于 MEMORY_ANN_MIN_SIZE 时不走索引，直接精确搜索
+- 创建/更新/删除记忆时增量更新索引；规模比训练时翻倍后重新训练聚类中心
+- 首次构建和重新训练在后台线程中进行，期间搜索回退为精确搜索（或继续使用旧索引），
+  构建期间发生的增量更新会在新索引替换旧索引前重放
+- 索引以 .npz 文件保存在 MEMORY_ANN_DIR，按 MEMORY_ANN_FLUSH_INTERVAL 节流写盘，关闭时全部写盘
+
+默认关闭，设置 MEMORY_ANN_ENABLED=true 开启。索引只是加速结构，数据库始终是准确来源：
+索引记录已同步到的最大记忆 ID，搜索时把 ID 更大的向量（其他进程写入或写盘前崩溃）从数据库补齐；
+已删除的记忆在加载结果时被忽略。多 worker 部署时各进程各有一份索引，
+其他进程对已有记忆的向量、重要性修改和删除要等重新训练或删除索引文件后才能生效
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import MemoryStore
+from memory_stats import user_stats
+from memory_vectors import EmbeddingMatrix, parse_embedding, top_k_indices
+
+ANN_ENABLED = os.getenv("MEMORY_ANN_ENABLED", "false").lower() == "true"
+ANN_MIN_SIZE = int(os.getenv("MEMORY_ANN_MIN_SIZE", "2000"))
+ANN_NPROBE = int(os.getenv("MEMORY_ANN_NPROBE", "8"))
+ANN_DIR = os.getenv("MEMORY_ANN_DIR", "./data/memory_index")
+ANN_FLUSH_INTERVAL = float(os.getenv("MEMORY_ANN_FLUSH_INTERVAL", "30"))
+
+# k-means 参数：迭代次数、每个簇的训练样本数、簇数上限
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+MAX_LISTS = 1024
+# 分簇时每次计算的行数，控制临时矩阵大小
+ASSIGN_CHUNK_SIZE = 4096
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行归一化，零向量保持为零"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """对归一化向量做球面 k-means，返回 nlist 个归一化的聚类中心"""
+    rng = np.random.default_rng(seed)
+    sample_size = nlist * KMEANS_SAMPLES_PER_LIST
+    sample = vectors
+    if len(vectors) > sample_size:
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        # 空簇保留原中心
+        centroids = _normalize(np.where(counts[:, None] > 0, sums, centroids))
+    return centroids.astype(np.float32)
+
+
+def _encode(labels: Dict[str, int], value: Optional[str]) -> int:
+    """字符串属性编码为整数（None 编码为 -1），新值追加到 labels"""
+    return -1 if value is None else labels.setdefault(value, len(labels))
+
+
+class IndexRows(NamedTuple):
+    """索引的行数据：ids[i] 对应 vectors 等各列的第 i 行，labels 按编码顺序排列"""
+    ids: np.ndarray
+    vectors: np.ndarray
+    type_codes: np.ndarray
+    type_labels: List[str]
+    contact_codes: np.ndarray
+    contact_labels: List[str]
+    importance: np.ndarray
+
+    @classmethod
+    def from_matrix(cls, matrix: EmbeddingMatrix) -> "IndexRows":
+        """由带属性的 EmbeddingMatrix 构建（沿用它的整数编码）"""
+        return cls(
+            matrix.ids, matrix.vectors,
+            matrix.type_codes, sorted(matrix._type_labels, key=matrix._type_labels.get),
+            matrix.contact_codes, sorted(matrix._contact_labels, key=matrix._contact_labels.get),
+            matrix.importance
+        )
+
+
+class IVFIndex:
+    """单个用户的倒排索引
+
+    向量和属性按行存放在预留容量的数组里（前 size 行有效），删除时用最后一行填补空位；
+    每个簇维护所含行号的集合（倒排表），搜索只访问探测到的簇。增删改都是 O(dim)
+    """
+
+    def __init__(self, centroids: np.ndarray, rows: IndexRows, assign: np.ndarray,
+                 trained_size: int, synced_id: int):
+        self.centroids = centroids
+        self.dim = centroids.shape[1]
+        self.size = len(rows.ids)
+        self.trained_size = trained_size
+        self.synced_id = synced_id  # 已从数据库同步到的最大记忆 ID
+        capacity = max(self.size * 2, 64)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        self.assign = np.zeros(capacity, dtype=np.int32)
+        self.type_codes = np.zeros(capacity, dtype=np.int32)
+        self.contact_codes = np.zeros(capacity, dtype=np.int32)
+        self.importance = np.zeros(capacity, dtype=np.int16)
+        self.ids[:self.size] = rows.ids
+        self.vectors[:self.size] = rows.vectors
+        self.assign[:self.size] = assign
+        self.type_codes[:self.size] = rows.type_codes
+        self.contact_codes[:self.size] = rows.contact_codes
+        self.importance[:self.size] = rows.importance
+        self._type_labels = {label: code for code, label in enumerate(rows.type_labels)}
+        self._contact_labels = {label: code for code, label in enumerate(rows.contact_labels)}
+        self._rows: Dict[int, int] = {int(memory_id): row for row, memory_id in enumerate(rows.ids)}
+        self._lists: List[set] = [set() for _ in range(len(centroids))]
+        for row, list_no in enumerate(self.assign[:self.size]):
+            self._lists[list_no].add(row)
+
+    @classmethod
+    def build(cls, rows: IndexRows, synced_id: int) -> "IVFIndex":
+        """用全部向量训练聚类中心并建立索引"""
+        vectors = _normalize(np.asarray(rows.vectors, dtype=np.float32))
+        nlist = max(1, min(MAX_LISTS, int(len(vectors) ** 0.5)))
+        centroids = train_centroids(vectors, nlist)
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+            chunk = vectors[start:start + ASSIGN_CHUNK_SIZE]
+            assign[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return cls(centroids, rows._replace(vectors=vectors), assign, len(vectors), synced_id)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, memory_id: int) -> bool:
+        return memory_id in self._rows
+
+    def needs_retrain(self) -> bool:
+        return self.size > self.trained_size * 2
+
+    def upsert(self, memory_id: int, vector, memory_type: Optional[str],
+               contact_id: Optional[str], importance: Optional[int]) -> bool:
+        """添加或替换一条记忆；维度不匹配时移除旧行并返回 False"""
+        vector = _normalize(np.asarray(vector, dtype=np.float32))
+        if vector.shape != (self.dim,):
+            # 换了嵌入模型，旧向量作废
+            self.remove(memory_id)
+            return False
+        row = self._rows.get(memory_id)
+        if row is None:
+            if self.size == len(self.ids):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self._rows[memory_id] = row
+            self.ids[row] = memory_id
+        else:
+            self._lists[self.assign[row]].discard(row)
+        self.vectors[row] = vector
+        self.assign[row] = int(np.argmax(self.centroids @ vector))
+        self._lists[self.assign[row]].add(row)
+        self.type_codes[row] = _encode(self._type_labels, memory_type)
+        self.contact_codes[row] = _encode(self._contact_labels, contact_id)
+        self.importance[row] = importance or 0
+        return True
+
+    def set_importance(self, memory_id: int, importance: Optional[int]) -> bool:
+        """只更新重要性（向量未变时）"""
+        row = self._rows.get(memory_id)
+        if row is None:
+            return False
+        self.importance[row] = importance or 0
+        return True
+
+    def remove(self, memory_id: int) -> bool:
+        row = self._rows.pop(memory_id, None)
+        if row is None:
+            return False
+        last = self.size - 1
+        self._lists[self.assign[row]].discard(row)
+        if row != last:
+            moved_id = int(self.ids[last])
+            self._lists[self.assign[last]].discard(last)
+            self._lists[self.assign[last]].add(row)
+            for column in (self.ids, self.vectors, self.assign, self.type_codes,
+                           self.contact_codes, self.importance):
+                column[row] = column[last]
+            self._rows[moved_id] = row
+        self.size = last
+        return True
+
+    def _grow(self):
+        capacity = len(self.ids) * 2
+        self.ids = np.resize(self.ids, capacity)
+        self.assign = np.resize(self.assign, capacity)
+        self.type_codes = np.resize(self.type_codes, capacity)
+        self.contact_codes = np.resize(self.contact_codes, capacity)
+        self.importance = np.resize(self.importance, capacity)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+
+    def _filter(self, rows: np.ndarray, memory_type: Optional[str], contact_id: Optional[str],
+                min_importance: Optional[int]) -> np.ndarray:
+        """按属性筛选行号（条件同 EmbeddingMatrix.filter_mask）"""
+        if memory_type:
+            rows = rows[self.type_codes[rows] == self._type_labels.get(memory_type, -2)]
+        if contact_id:
+            rows = rows[self.contact_codes[rows] == self._contact_labels.get(contact_id, -2)]
+        if min_importance:
+            rows = rows[self.importance[rows] >= min_importance]
+        return rows
+
+    def search(self, query, k: int, nprobe: int = ANN_NPROBE, memory_type: Optional[str] = None,
+               contact_id: Optional[str] = None,
+               min_importance: Optional[int] = None) -> List[Tuple[int, float]]:
+        """返回满足筛选条件、余弦相似度最高的 k 条 (记忆ID, 相似度)
+
+        只在探测到的簇内筛选和计算；结果不足 k 条时改为在全部满足条件的行上精确搜索
+        """
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        if query.shape != (self.dim,) or self.size == 0:
+            return []
+
+        probes = top_k_indices(self.centroids @ query, nprobe)
+        probed = [self._lists[list_no] for list_no in probes]
+        rows = np.fromiter(
+            (row for rows in probed for row in rows), dtype=np.int64, count=sum(map(len, probed))
+        )
+        rows = self._filter(rows, memory_type, contact_id, min_importance)
+        if len(rows) < k and len(rows) < self.size:
+            rows = self._filter(np.arange(self.size), memory_type, contact_id, min_importance)
+
+        scores = self.vectors[rows] @ query
+        top = top_k_indices(scores, k)
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        """写入 .npz 文件（先写临时文件再替换，避免写一半被读到）"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                ids=self.ids[:self.size],
+                vectors=self.vectors[:self.size],
+                assign=self.assign[:self.size],
+                type_codes=self.type_codes[:self.size],
+                type_labels=np.array(sorted(self._type_labels, key=self._type_labels.get), dtype=str),
+                contact_codes=self.contact_codes[:self.size],
+                contact_labels=np.array(sorted(self._contact_labels, key=self._contact_labels.get), dtype=str),
+                importance=self.importance[:self.size],
+                trained_size=np.int64(self.trained_size),
+                synced_id=np.int64(self.synced_id)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            rows = IndexRows(
+                data["ids"], data["vectors"],
+                data["type_codes"], [str(label) for label in data["type_labels"]],
+                data["contact_codes"], [str(label) for label in data["contact_labels"]],
+                data["importance"]
+            )
+            return cls(data["centroids"], rows, data["assign"],
+                       int(data["trained_size"]), int(data["synced_id"]))
+
+
+def _query_rows(db: Session, user_id: int, after_id: int = 0):
+    """读取用户 ID 大于 after_id 的记忆向量和属性（按 ID 升序）"""
+    return db.query(
+        MemoryStore.id, MemoryStore.embedding_blob, MemoryStore.embedding_vector,
+        MemoryStore.memory_type, MemoryStore.contact_id, MemoryStore.importance_score
+    ).filter(
+        MemoryStore.user_id == user_id,
+        MemoryStore.id > after_id,
+        or_(MemoryStore.embedding_blob.isnot(None), MemoryStore.embedding_vector.isnot(None))
+    ).order_by(MemoryStore.id).all()
+
+
+class MemoryIndexManager:
+    """管理各用户的索引：按需加载、后台构建、增量更新、节流写盘
+
+    索引的变更以 (IVFIndex 方法, 参数) 记录：直接作用于当前索引，
+    用户的索引正在后台构建时同时记下，新索引替换旧索引前重放
+    """
+
+    def __init__(self, directory: str = ANN_DIR, enabled: bool = ANN_ENABLED):
+        self.directory = directory
+        self.enabled = enabled
+        self._indexes: Dict[int, IVFIndex] = {}
+        self._dirty: Dict[int, float] = {}  # user_id -> 首次变脏的时间
+        self._building: Dict[int, list] = {}  # user_id -> 构建期间发生的变更
+        self._builder: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"user_{user_id}.npz")
+
+    def _get_loaded(self, user_id: int) -> Optional[IVFIndex]:
+        """取内存中的索引，不在内存时尝试从文件加载"""
+        index = self._indexes.get(user_id)
+        if index is None and os.path.exists(self._path(user_id)):
+            try:
+                index = IVFIndex.load(self._path(user_id))
+            except Exception as e:
+                print(f"⚠️ 记忆索引文件无法读取，将重建: user={user_id}, {e}")
+                return None
+            self._indexes[user_id] = index
+        return index
+
+    def _schedule_build(self, user_id: int, dim: int):
+        """提交后台构建（需持有锁）；同一用户同时只有一个构建任务"""
+        if user_id in self._building:
+            return
+        if self._builder is None:
+            self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-index")
+        self._building[user_id] = []
+        self._builder.submit(self._build, user_id, dim)
+
+    def _build(self, user_id: int, dim: int):
+        """后台线程：从数据库读取向量训练新索引，重放构建期间的变更后替换旧索引"""
+        index = None
+        try:
+            db = SessionLocal()
+            try:
+                rows = _query_rows(db, user_id)
+            finally:
+                db.close()
+            matrix = EmbeddingMatrix.from_rows(
+                ((memory_id, blob or legacy, memory_type, contact_id, importance)
+                 for memory_id, blob, legacy, memory_type, contact_id, importance in rows),
+                dim=dim
+            )
+            if len(matrix) > 0:
+                started = time.time()
+                index = IVFIndex.build(IndexRows.from_matrix(matrix), rows[-1].id)
+                print(f"🧭 已构建记忆索引: user={user_id}, {len(index)} 条, "
+                      f"{len(index.centroids)} 簇, 耗时 {int((time.time() - started) * 1000)}ms")
+        except Exception as e:
+            print(f"⚠️ 记忆索引构建失败: user={user_id}, {e}")
+
+        with self._lock:
+            changes = self._building.pop(user_id, [])
+            if index is None:
+                return
+            for method, args in changes:
+                method(index, *args)
+            self._indexes[user_id] = index
+            self._mark_dirty(user_id)
+        self.flush()
+
+    def _apply(self, user_id: int, changes: list):
+        """把一批变更写入当前索引；用户还没有索引时什么也不做"""
+        with self._lock:
+            if user_id in self._building:
+                self._building[user_id].extend(changes)
+            index = self._get_loaded(user_id)
+            if index is None:
+                return
+            for method, args in changes:
+                method(index, *args)
+            self._mark_dirty(user_id)
+        self.flush()
+
+    def _catch_up(self, db: Session, user_id: int, index: IVFIndex):
+        """把数据库中 ID 大于 synced_id 的向量补进索引（其他进程写入或写盘前崩溃）"""
+        rows = _query_rows(db, user_id, index.synced_id)
+        if not rows:
+            return
+        changes = []
+        for memory_id, blob, legacy, memory_type, contact_id, importance in rows:
+            vector = parse_embedding(blob or legacy)
+            if vector is not None:
+                changes.append((IVFIndex.upsert, (memory_id, vector, memory_type, contact_id, importance)))
+        self._apply(user_id, changes)
+        with self._lock:
+            index.synced_id = max(index.synced_id, rows[-1].id)
+
+    def search(self, db: Session, user_id: int, query: Sequence[float], k: int,
+               memory_type: Optional[str] = None, contact_id: Optional[str] = None,
+               min_importance: Optional[int] = None) -> Optional[List[Tuple[int, float]]]:
+        """近似搜索，筛选条件在索引内完成
+
+        索引不可用（记忆数不足 ANN_MIN_SIZE、尚在后台构建、维度不符）时返回 None，由调用方精确搜索。
+        会读数据库、持有索引锁，应在线程池中调用
+        """
+        with self._lock:
+            index = self._get_loaded(user_id)
+            if index is not None and index.dim != len(query):
+                index = None
+            building = user_id in self._building
+        if index is None:
+            if not building and user_stats(db, user_id)["total_memories"] >= ANN_MIN_SIZE:
+                with self._lock:
+                    self._schedule_build(user_id, len(query))
+            return None
+        if len(index) < ANN_MIN_SIZE:
+            return None
+
+        self._catch_up(db, user_id, index)
+        with self._lock:
+            index = self._indexes.get(user_id, index)
+            if index.needs_retrain():
+                # 重新训练期间继续使用当前索引
+                self._schedule_build(user_id, index.dim)
+            hits = index.search(query, k, memory_type=memory_type, contact_id=contact_id,
+                                min_importance=min_importance)
+        self.flush()
+        return hits
+
+    def on_upsert(self, user_id: int, memory_id: int, vector: Sequence[float], memory_type: str,
+                  contact_id: Optional[str], importance: Optional[int]):
+        """记忆创建或向量更新后调用"""
+        if self.enabled:
+            self._apply(user_id, [(IVFIndex.upsert, (memory_id, vector, memory_type, contact_id, importance))])
+
+    def on_upsert_many(self, user_id: int, items: Sequence[tuple]):
+        """批量写入后调用，items 为 (记忆ID, 向量, 类型, 联系人ID, 重要性)，整批只加锁、写盘一次"""
+        if self.enabled:
+            self._apply(user_id, [(IVFIndex.upsert, tuple(item)) for item in items])
+
+    def on_importance_many(self, user_id: int, items: Sequence[Tuple[int, Optional[int]]]):
+        """只有重要性变化时调用（编辑记忆、整理合并），items 为 (记忆ID, 重要性)"""
+        if self.enabled:
+            self._apply(user_id, [(IVFIndex.set_importance, tuple(item)) for item in items])
+
+    def on_delete(self, user_id: int, memory_id: int):
+        if self.enabled:
+            self._apply(user_id, [(IVFIndex.remove, (memory_id,))])
+
+    def on_delete_many(self, user_id: int, memory_ids: Sequence[int]):
+        """批量删除后调用（如记忆整理任务），整批只加锁、写盘一次"""
+        if self.enabled:
+            self._apply(user_id, [(IVFIndex.remove, (memory_id,)) for memory_id in memory_ids])
+
+    def _mark_dirty(self, user_id: int):
+        self._dirty.setdefault(user_id, time.monotonic())
+
+    def flush(self, force: bool = False):
+        """把变脏超过 ANN_FLUSH_INTERVAL 秒的索引写盘；force=True 时全部写盘"""
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                user_id for user_id, since in self._dirty.items()
+                if force or now - since >= ANN_FLUSH_INTERVAL
+            ]
+            if not due:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            for user_id in due:
+                index = self._indexes.get(user_id)
+                try:
+                    if index is not None:
+                        index.save(self._path(user_id))
+                    del self._dirty[user_id]
+                except OSError as e:
+                    print(f"⚠️ 记忆索引写盘失败: user={user_id}, {e}")
+
+
+# 进程级单例
+index_manager = MemoryIndexManager()
@@ -0,0 +1,91 @@
+"""记忆相关度（重要性 × 访问频率 × 时间衰减）
+
+    相关度 = 重要性 × (1 + 访问次数)^w × 2^(-(now - 最后活跃时间) / 半衰期)
+
+取对数后 now 这一项对所有记忆相同，不影响排序，剩下的部分只随记忆本身的写入/访问变化：
+
+    relevance_score = ln(重要性) + w·ln(1 + 访问次数) + 最后活跃时间·ln2 / 半衰期
+
+因此 relevance_score 写入时算好存在列上，不需要定时刷新，按它降序就是任意时刻的衰减排序，
+列表可以直接走 (user_id, relevance_score, id) 索引。需要展示当前得分时用 current_relevance 换算。
+
+维护方式：ORM 写入由 models.py 中的事件自动计算；批量插入、访问统计回写等 Core 写入显式计算；
+旧数据在 init_db 时由 backfill_relevance 补齐
+"""
+import math
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+HALF_LIFE_DAYS = float(os.getenv("MEMORY_RELEVANCE_HALF_LIFE_DAYS", "30"))
+ACCESS_WEIGHT = float(os.getenv("MEMORY_RELEVANCE_ACCESS_WEIGHT", "0.5"))
+
+_DECAY_PER_SECOND = math.log(2) / (HALF_LIFE_DAYS * 86400)
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    # SQLite 读出的时间不带时区，按 UTC 处理
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def relevance_score(importance: Optional[int], access_count: Optional[int],
+                    *active_at: Optional[datetime]) -> float:
+    """计算存储用的相关度（对数形式）；active_at 取其中最晚的时间，全为空时取当前时间"""
+    timestamps = [ts for ts in map(_timestamp, active_at) if ts is not None]
+    active = max(timestamps) if timestamps else datetime.now(timezone.utc).timestamp()
+    return (
+        math.log(max(importance or 1, 1))
+        + ACCESS_WEIGHT * math.log1p(max(access_count or 0, 0))
+        + active * _DECAY_PER_SECOND
+    )
+
+
+def current_relevance(score: Optional[float], now: Optional[datetime] = None) -> Optional[float]:
+    """把存储的相关度换算为当前时刻的得分（重要性 × 频率因子 × 衰减系数）"""
+    if score is None:
+        return None
+    now_ts = _timestamp(now) if now else datetime.now(timezone.utc).timestamp()
+    return math.exp(score - now_ts * _DECAY_PER_SECOND)
+
+
+def backfill_relevance(engine):
+    """为 relevance_score 为空的旧记忆补算相关度（init_db 时调用，分批提交）"""
+    from sqlalchemy import bindparam, select, update
+    from models import MemoryStore
+
+    memories = MemoryStore.__table__
+    statement = (
+        update(memories)
+        .where(memories.c.id == bindparam("memory_id"))
+        .values(relevance_score=bindparam("score"))
+        # 只补算，不算作一次修改
+        .values(updated_at=memories.c.updated_at)
+    )
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(
+                    memories.c.id, memories.c.importance_score, memories.c.access_count,
+                    memories.c.updated_at, memories.c.last_accessed_at
+                ).where(memories.c.relevance_score.is_(None)).limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            conn.execute(statement, [
+                {
+                    "memory_id": row.id,
+                    "score": relevance_score(
+                        row.importance_score, row.access_count, row.updated_at, row.last_accessed_at
+                    )
+                }
+                for row in rows
+            ])
+        total += len(rows)
+    if total:
+        print(f"🔧 已为 {total} 条记忆补算相关度")
@@ -0,0 +1,324 @@
+"""记忆统计的增量维护
+
+统计接口原先每次都对用户（或全表）的记忆做 COUNT / GROUP BY / SUM(LENGTH(...))。
+现在计数保存在 memory_stat_counters 表中，写入记忆时在同一事务内增减：
+- ORM 写入（创建、更新、删除、整理合并）由 session 的 after_flush 事件自动计算增量
+- Core 批量插入由调用方调用 track_inserted
+- 同一次 flush 内的增量先合并，每个计数行只执行一次 UPSERT
+
+读取统计只需按 user_id 取出少量计数行。计数与明细不一致时（绕过 ORM 的写入、
+历史数据等）由 reconcile_stats 逐个用户重新统计并修正，init_db 时发现计数表为空会自动执行一次。
+
+用法（核对）：
+1. 直接运行: python memory_stats.py
+2. 配置 cron/定时任务定期执行；也可由管理员调用 /api/v1/memory/admin/stats/reconcile
+"""
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event, func, inspect, select, update, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import MemoryStore, MemoryStatCounter
+
+# 全局计数行的 user_id
+GLOBAL_USER_ID = 0
+
+# (user_id, stat_type, stat_key) -> [记忆数增量, 字符数增量]
+Deltas = Dict[Tuple[int, str, str], List[int]]
+
+_TRACKED_FIELDS = ("user_id", "memory_type", "contact_id", "memory_content")
+
+
+def _new_deltas() -> Deltas:
+    return defaultdict(lambda: [0, 0])
+
+
+def _add_memory(deltas: Deltas, user_id: int, memory_type: str, contact_id: Optional[str],
+                content: Optional[str], sign: int):
+    """把一条记忆计入（sign=1）或移出（sign=-1）各项计数"""
+    size = len(content or "") * sign
+    keys = [
+        (user_id, "total", ""),
+        (user_id, "type", memory_type),
+        (GLOBAL_USER_ID, "total", ""),
+        (GLOBAL_USER_ID, "type", memory_type),
+    ]
+    if contact_id:
+        keys.append((user_id, "contact", contact_id))
+    for key in keys:
+        delta = deltas[key]
+        delta[0] += sign
+        delta[1] += size
+
+
+# ============ 写入计数 ============
+
+def _upsert(connection, user_id: int, stat_type: str, stat_key: str, count: int, size: int) -> int:
+    """累加一个计数行（不存在则创建），返回累加后的记忆数"""
+    counters = MemoryStatCounter.__table__
+    values = {
+        "user_id": user_id, "stat_type": stat_type, "stat_key": stat_key,
+        "memory_count": count, "content_size": size
+    }
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        statement = dialect_insert(counters).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id", "stat_type", "stat_key"],
+            set_={
+                "memory_count": counters.c.memory_count + statement.excluded.memory_count,
+                "content_size": counters.c.content_size + statement.excluded.content_size,
+            }
+        ).returning(counters.c.memory_count)
+        return connection.execute(statement).scalar_one()
+
+    # 其他数据库：先更新，不存在再插入
+    where = (
+        (counters.c.user_id == user_id)
+        & (counters.c.stat_type == stat_type)
+        & (counters.c.stat_key == stat_key)
+    )
+    result = connection.execute(update(counters).where(where).values(
+        memory_count=counters.c.memory_count + count,
+        content_size=counters.c.content_size + size
+    ))
+    if result.rowcount == 0:
+        connection.execute(insert(counters).values(**values))
+    return connection.execute(select(counters.c.memory_count).where(where)).scalar_one()
+
+
+def apply_deltas(connection, deltas: Deltas):
+    """把增量写入计数表；用户的记忆数在 0 与非 0 之间变化时同步更新全局的有记忆用户数"""
+    users_delta = 0
+    for (user_id, stat_type, stat_key), (count, size) in deltas.items():
+        if not count and not size:
+            continue
+        new_count = _upsert(connection, user_id, stat_type, stat_key, count, size)
+        if stat_type == "total" and user_id != GLOBAL_USER_ID and count:
+            old_count = new_count - count
+            if old_count <= 0 < new_count:
+                users_delta += 1
+            elif new_count <= 0 < old_count:
+                users_delta -= 1
+    if users_delta:
+        _upsert(connection, GLOBAL_USER_ID, "users", "", users_delta, 0)
+
+
+def track_inserted(db: Session, rows: Iterable[dict]):
+    """Core 批量插入记忆后调用（与插入在同一事务内），rows 为插入的字段字典"""
+    deltas = _new_deltas()
+    for row in rows:
+        _add_memory(deltas, row["user_id"], row["memory_type"], row.get("contact_id"), row["memory_content"], 1)
+    apply_deltas(db.connection(), deltas)
+
+
+def _committed_value(state, name: str):
+    """flush 前的旧值"""
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.obj(), name)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _track_memory_changes(session: Session, flush_context):
+    """after_flush 时 new/dirty/deleted 和属性历史仍是 flush 前的状态，据此计算增量"""
+    deltas = _new_deltas()
+    for memory in session.new:
+        if isinstance(memory, MemoryStore):
+            _add_memory(deltas, memory.user_id, memory.memory_type, memory.contact_id, memory.memory_content, 1)
+
+    for memory in session.deleted:
+        if isinstance(memory, MemoryStore):
+            state = inspect(memory)
+            _add_memory(deltas, *(_committed_value(state, name) for name in _TRACKED_FIELDS), -1)
+
+    for memory in session.dirty:
+        if not isinstance(memory, MemoryStore) or memory in session.deleted:
+            continue
+        state = inspect(memory)
+        if not any(state.attrs[name].history.has_changes() for name in _TRACKED_FIELDS):
+            continue
+        _add_memory(deltas, *(_committed_value(state, name) for name in _TRACKED_FIELDS), -1)
+        _add_memory(deltas, *(getattr(memory, name) for name in _TRACKED_FIELDS), 1)
+
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+# ============ 读取统计 ============
+
+def user_stats(db: Session, user_id: int) -> dict:
+    """用户的记忆统计：total_memories / total_storage_size / by_type / by_contact"""
+    result = {"total_memories": 0, "total_storage_size": 0, "by_type": {}, "by_contact": {}}
+    rows = db.query(MemoryStatCounter).filter(MemoryStatCounter.user_id == user_id).all()
+    for row in rows:
+        if row.stat_type == "total":
+            result["total_memories"] = row.memory_count
+            result["total_storage_size"] = row.content_size
+        elif row.memory_count > 0:
+            result["by_" + row.stat_type][row.stat_key] = row.memory_count
+    return result
+
+
+def global_stats(db: Session) -> dict:
+    """全局记忆统计：total_memories / users_with_memories / total_storage_bytes / by_type"""
+    result = {"total_memories": 0, "users_with_memories": 0, "total_storage_bytes": 0, "by_type": {}}
+    rows = db.query(MemoryStatCounter).filter(MemoryStatCounter.user_id == GLOBAL_USER_ID).all()
+    for row in rows:
+        if row.stat_type == "total":
+            result["total_memories"] = row.memory_count
+            result["total_storage_bytes"] = row.content_size
+        elif row.stat_type == "users":
+            result["users_with_memories"] = row.memory_count
+        elif row.memory_count > 0:
+            result["by_type"][row.stat_key] = row.memory_count
+    return result
+
+
+# ============ 核对 ============
+
+def _expected_user_counters(db: Session, user_id: int) -> Deltas:
+    """按明细重新统计一个用户的计数"""
+    expected = _new_deltas()
+    rows = db.query(
+        MemoryStore.memory_type,
+        MemoryStore.contact_id,
+        func.count(MemoryStore.id),
+        func.coalesce(func.sum(func.length(MemoryStore.memory_content)), 0)
+    ).filter(MemoryStore.user_id == user_id).group_by(
+        MemoryStore.memory_type, MemoryStore.contact_id
+    ).all()
+    for memory_type, contact_id, count, size in rows:
+        keys = [(user_id, "total", ""), (user_id, "type", memory_type)]
+        if contact_id:
+            keys.append((user_id, "contact", contact_id))
+        for key in keys:
+            expected[key][0] += count
+            expected[key][1] += int(size)
+    return expected
+
+
+def reconcile_user(db: Session, user_id: int) -> int:
+    """修正一个用户的计数（差额按增量写入，全局计数随之修正），返回修正的计数行数"""
+    expected = _expected_user_counters(db, user_id)
+    current = {
+        (row.user_id, row.stat_type, row.stat_key): row
+        for row in db.query(MemoryStatCounter).filter(MemoryStatCounter.user_id == user_id)
+    }
+
+    diff = _new_deltas()
+    for key in set(expected) | set(current):
+        want_count, want_size = expected.get(key, (0, 0))
+        row = current.get(key)
+        have_count, have_size = (row.memory_count, row.content_size) if row else (0, 0)
+        if (want_count, want_size) != (have_count, have_size):
+            diff[key] = [want_count - have_count, want_size - have_size]
+    # 用户级的差额同样要体现在全局计数上
+    for (_, stat_type, stat_key), (count, size) in list(diff.items()):
+        if stat_type in ("total", "type"):
+            global_delta = diff[(GLOBAL_USER_ID, stat_type, stat_key)]
+            global_delta[0] += count
+            global_delta[1] += size
+
+    if diff:
+        apply_deltas(db.connection(), diff)
+    # 清理已归零的计数行
+    db.query(MemoryStatCounter).filter(
+        MemoryStatCounter.user_id == user_id,
+        MemoryStatCounter.memory_count == 0,
+        MemoryStatCounter.content_size == 0
+    ).delete(synchronize_session=False)
+    db.commit()
+    return len([key for key in diff if key[0] == user_id])
+
+
+def _reconcile_global(db: Session) -> int:
+    """直接按明细重算全局计数（修正全局计数本身的偏差）"""
+    expected = _new_deltas()
+    for memory_type, count, size in db.query(
+        MemoryStore.memory_type,
+        func.count(MemoryStore.id),
+        func.coalesce(func.sum(func.length(MemoryStore.memory_content)), 0)
+    ).group_by(MemoryStore.memory_type):
+        for key in ((GLOBAL_USER_ID, "total", ""), (GLOBAL_USER_ID, "type", memory_type)):
+            expected[key][0] += count
+            expected[key][1] += int(size)
+    users = db.query(func.count(func.distinct(MemoryStore.user_id))).scalar() or 0
+    expected[(GLOBAL_USER_ID, "users", "")][0] = users
+
+    current = {
+        (row.user_id, row.stat_type, row.stat_key): row
+        for row in db.query(MemoryStatCounter).filter(MemoryStatCounter.user_id == GLOBAL_USER_ID)
+    }
+    fixed = 0
+    for key in set(expected) | set(current):
+        want_count, want_size = expected.get(key, (0, 0))
+        row = current.get(key)
+        have_count, have_size = (row.memory_count, row.content_size) if row else (0, 0)
+        if (want_count, want_size) != (have_count, have_size):
+            _upsert(db.connection(), *key, want_count - have_count, want_size - have_size)
+            fixed += 1
+    db.commit()
+    return fixed
+
+
+def reconcile_stats(start_after: int = 0, max_users: Optional[int] = None) -> dict:
+    """按用户 ID 顺序逐个核对计数（每个用户一个短事务），全部用户处理完后再核对全局计数"""
+    db: Session = SessionLocal()
+    stats = {"users": 0, "fixed_counters": 0, "fixed_global": 0, "last_user_id": start_after}
+
+    try:
+        while max_users is None or stats["users"] < max_users:
+            # 明细或计数表中出现过的用户都要核对（后者用于清理已删光记忆的用户）
+            candidates = [
+                db.query(func.min(MemoryStore.user_id)).filter(MemoryStore.user_id > stats["last_user_id"]).scalar(),
+                db.query(func.min(MemoryStatCounter.user_id)).filter(MemoryStatCounter.user_id > stats["last_user_id"]).scalar(),
+            ]
+            candidates = [user_id for user_id in candidates if user_id is not None]
+            if not candidates:
+                stats["fixed_global"] = _reconcile_global(db)
+                break
+            user_id = min(candidates)
+            stats["fixed_counters"] += reconcile_user(db, user_id)
+            stats["users"] += 1
+            stats["last_user_id"] = user_id
+
+        print(f"✅ 记忆统计核对完成: {stats}")
+        return stats
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 记忆统计核对失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def initialize_stats():
+    """计数表为空而已有记忆时（首次部署）做一次完整统计（init_db 时调用）"""
+    db: Session = SessionLocal()
+    try:
+        initialized = db.query(MemoryStatCounter.id).first() is not None
+        has_memories = db.query(MemoryStore.id).first() is not None
+    finally:
+        db.close()
+    if has_memories and not initialized:
+        print("🔧 正在初始化记忆统计计数...")
+        reconcile_stats()
+
+
+if __name__ == "__main__":
+    print("📊 开始核对记忆统计计数...")
+    reconcile_stats()
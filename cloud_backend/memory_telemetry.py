@@ -0,0 +1,164 @@
+"""记忆访问统计的异步写入
+
+搜索历史（memory_search_history）和访问次数（memory_store.access_count）只是统计数据，
+原先每次搜索/查看都同步写库并提交，读请求也变成了写事务，在 SQLite 上还会互相排队。
+现在先记在进程内的缓冲区，由后台任务定期批量写入：
+- 搜索历史攒成一批后一次 INSERT
+- 同一条记忆的多次访问合并成一次 UPDATE（access_count + n，取最后访问时间）
+
+丢失上限：进程异常退出时最多丢失最近 MEMORY_TELEMETRY_FLUSH_INTERVAL 秒的统计；
+数据库持续不可写时缓冲区最多保留 MEMORY_TELEMETRY_MAX_PENDING 条搜索历史，超出部分丢弃并计数。
+正常关闭时会把缓冲区全部写入
+"""
+import asyncio
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update, bindparam
+
+from database import SessionLocal
+from models import MemoryStore, MemorySearchHistory
+from memory_relevance import relevance_score
+
+FLUSH_INTERVAL = float(os.getenv("MEMORY_TELEMETRY_FLUSH_INTERVAL", "2.0"))
+MAX_PENDING = int(os.getenv("MEMORY_TELEMETRY_MAX_PENDING", "10000"))
+# 缓冲的搜索历史达到这个数量时不等定时器，立即写入
+FLUSH_THRESHOLD = 500
+
+
+class TelemetryBuffer:
+    """搜索历史和访问次数的写缓冲"""
+
+    def __init__(self):
+        self._searches: List[dict] = []
+        self._accesses: Dict[int, Tuple[int, datetime]] = {}  # memory_id -> (次数, 最后访问时间)
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    def start(self):
+        """应用启动时调用，启动后台写入任务"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """应用关闭时调用，停止后台任务并写入剩余数据"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    def record_search(self, user_id: int, search_query: str, search_type: str,
+                      results_count: int, search_time_ms: int):
+        with self._lock:
+            if len(self._searches) >= MAX_PENDING:
+                self.dropped += 1
+                return
+            self._searches.append({
+                "user_id": user_id,
+                "search_query": search_query,
+                "search_type": search_type,
+                "results_count": results_count,
+                "search_time_ms": search_time_ms,
+                "created_at": datetime.now(timezone.utc)
+            })
+            pending = len(self._searches)
+        if pending >= FLUSH_THRESHOLD and self._wakeup is not None:
+            self._wakeup.set()
+
+    def record_access(self, memory_id: int, accessed_at: Optional[datetime] = None):
+        accessed_at = accessed_at or datetime.now(timezone.utc)
+        with self._lock:
+            count, _ = self._accesses.get(memory_id, (0, accessed_at))
+            self._accesses[memory_id] = (count + 1, accessed_at)
+
+    def pending_accesses(self, memory_id: int) -> int:
+        """尚未写入数据库的访问次数"""
+        with self._lock:
+            return self._accesses.get(memory_id, (0, None))[0]
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"⚠️ 记忆统计写入失败，下次重试: {e}")
+
+    def flush(self):
+        """把缓冲区写入数据库；失败时数据放回缓冲区"""
+        with self._lock:
+            searches, self._searches = self._searches, []
+            accesses, self._accesses = self._accesses, {}
+        if not searches and not accesses:
+            return
+
+        db = SessionLocal()
+        try:
+            if searches:
+                db.execute(insert(MemorySearchHistory), searches)
+            if accesses:
+                memories = MemoryStore.__table__
+                # 相关度随访问次数变化，按当前值加上增量重新计算；次数本身仍用 SQL 累加
+                current = {
+                    row.id: row for row in db.execute(
+                        select(memories.c.id, memories.c.importance_score, memories.c.access_count)
+                        .where(memories.c.id.in_(list(accesses)))
+                    )
+                }
+                params = [
+                    {
+                        "memory_id": memory_id,
+                        "increment": count,
+                        "accessed_at": accessed_at,
+                        "score": relevance_score(
+                            current[memory_id].importance_score,
+                            (current[memory_id].access_count or 0) + count,
+                            accessed_at
+                        )
+                    }
+                    for memory_id, (count, accessed_at) in accesses.items()
+                    if memory_id in current  # 已删除的记忆跳过
+                ]
+                if params:
+                    db.connection().execute(
+                        update(memories)
+                        .where(memories.c.id == bindparam("memory_id"))
+                        .values(
+                            access_count=memories.c.access_count + bindparam("increment"),
+                            last_accessed_at=bindparam("accessed_at"),
+                            relevance_score=bindparam("score")
+                        ),
+                        params
+                    )
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._restore(searches, accesses)
+            raise
+        finally:
+            db.close()
+
+    def _restore(self, searches: List[dict], accesses: Dict[int, Tuple[int, datetime]]):
+        with self._lock:
+            room = max(MAX_PENDING - len(self._searches), 0)
+            self.dropped += max(len(searches) - room, 0)
+            self._searches[:0] = searches[-room:] if room else []
+            for memory_id, (count, accessed_at) in accesses.items():
+                newer_count, newer_at = self._accesses.get(memory_id, (0, accessed_at))
+                self._accesses[memory_id] = (count + newer_count, max(accessed_at, newer_at))
+
+
+# 进程级单例
+telemetry = TelemetryBuffer()
@@ -0,0 +1,203 @@
+"""记忆向量检索引擎
+
+把一个用户的记忆向量组织成连续的 float32 矩阵（每行一条记忆），并预先算好每行的范数：
+- 查询时一次矩阵-向量乘法得到全部余弦相似度，不再逐条 Python 循环
+- 取前 k 条用 argpartition 做部分选择，只对选出的 k 条排序
+
+向量以二进制存储（MemoryStore.embedding_blob）：8 字节头 + 原始数组字节，
+头部格式为 <版本 1B><类型 1B><保留 2B><维度 4B>，类型为 float32 或 float16，
+读取时用 frombuffer 直接映射，不做文本解析。旧数据的 JSON 文本（embedding_vector）仍可读取，
+可用 migrate_embeddings.py 批量转换
+"""
+import json
+import os
+import struct
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 新写入向量的存储精度：float32（默认）或 float16（体积再减半，精度略降）
+EMBEDDING_DTYPE = os.getenv("MEMORY_EMBEDDING_DTYPE", "float32")
+
+_HEADER = struct.Struct("<BB2xI")
+_FORMAT_VERSION = 1
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+_CODE_DTYPES = {code: np.dtype(name) for name, code in _DTYPE_CODES.items()}
+
+
+def encode_embedding(values: Sequence[float], dtype: str = EMBEDDING_DTYPE) -> bytes:
+    """把向量编码为带头部的二进制"""
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"不支持的向量存储类型: {dtype}")
+    array = np.asarray(values, dtype=dtype)
+    if array.ndim != 1:
+        raise ValueError("向量必须是一维数组")
+    return _HEADER.pack(_FORMAT_VERSION, _DTYPE_CODES[dtype], array.shape[0]) + array.tobytes()
+
+
+def decode_embedding(blob: bytes) -> Optional[np.ndarray]:
+    """解码二进制向量（不复制数据，返回只读视图），格式不合法时返回 None"""
+    if not blob or len(blob) < _HEADER.size:
+        return None
+    version, code, dim = _HEADER.unpack_from(blob)
+    dtype = _CODE_DTYPES.get(code)
+    if version != _FORMAT_VERSION or dtype is None or len(blob) != _HEADER.size + dim * dtype.itemsize:
+        return None
+    return np.frombuffer(blob, dtype=dtype, count=dim, offset=_HEADER.size)
+
+
+def parse_embedding(raw) -> Optional[np.ndarray]:
+    """解析数据库中的向量字段（二进制或旧版 JSON 文本），无法解析时返回 None"""
+    if not raw:
+        return None
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        vector = decode_embedding(bytes(raw))
+        if vector is None:
+            return None
+    else:
+        try:
+            vector = np.asarray(json.loads(raw), dtype=np.float32)
+        except (TypeError, ValueError):
+            return None
+    if vector.ndim != 1 or vector.size == 0:
+        return None
+    return vector
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回得分最高的 k 个下标，按得分降序"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _encode_labels(values: Sequence[Optional[str]]) -> Tuple[np.ndarray, Dict[str, int]]:
+    """把字符串列编码为整数数组（None 编码为 -1），筛选时比较整数即可"""
+    labels: Dict[str, int] = {}
+    codes = np.fromiter(
+        (-1 if value is None else labels.setdefault(value, len(labels)) for value in values),
+        dtype=np.int32, count=len(values)
+    )
+    return codes, labels
+
+
+class EmbeddingMatrix:
+    """一组记忆向量：ids[i] 对应 vectors 的第 i 行
+
+    可附带每行的记忆类型、联系人和重要性，用于在矩阵上直接筛选（缓存整个用户的矩阵时使用）
+    """
+
+    def __init__(self, ids, vectors: np.ndarray, memory_types: Optional[Sequence[str]] = None,
+                 contact_ids: Optional[Sequence[Optional[str]]] = None,
+                 importance: Optional[Sequence[int]] = None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.dim = self.vectors.shape[1]
+        self.norms = np.linalg.norm(self.vectors, axis=1)
+        self.has_attributes = memory_types is not None
+        if self.has_attributes:
+            self.type_codes, self._type_labels = _encode_labels(memory_types)
+            self.contact_codes, self._contact_labels = _encode_labels(contact_ids)
+            self.importance = np.asarray([score or 0 for score in importance], dtype=np.int16)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple], dim: Optional[int] = None) -> "EmbeddingMatrix":
+        """由 (记忆ID, 二进制或 JSON 向量) 构建
+
+        行里还带有 (记忆类型, 联系人ID, 重要性) 三列时一并保存，之后可用 filter_mask 筛选。
+        只保留维度为 dim 的向量（未指定时取第一条有效向量的维度），
+        维度不同的向量无法比较相似度，直接跳过
+        """
+        ids = []
+        vectors = []
+        attributes = []
+        for memory_id, raw, *extra in rows:
+            vector = parse_embedding(raw)
+            if vector is None:
+                continue
+            if dim is None:
+                dim = vector.shape[0]
+            elif vector.shape[0] != dim:
+                continue
+            ids.append(memory_id)
+            vectors.append(vector)
+            if extra:
+                attributes.append(extra)
+
+        if not vectors:
+            matrix = np.empty((0, dim or 0), dtype=np.float32)
+        else:
+            matrix = np.vstack(vectors)
+        if not attributes:
+            return cls(ids, matrix)
+        memory_types, contact_ids, importance = zip(*attributes)
+        return cls(ids, matrix, memory_types, contact_ids, importance)
+
+    @property
+    def nbytes(self) -> int:
+        """数组占用的内存字节数（用于缓存容量统计）"""
+        total = self.ids.nbytes + self.vectors.nbytes + self.norms.nbytes
+        if self.has_attributes:
+            total += self.type_codes.nbytes + self.contact_codes.nbytes + self.importance.nbytes
+        return total
+
+    def filter_mask(self, memory_type: Optional[str] = None, contact_id: Optional[str] = None,
+                    min_importance: Optional[int] = None) -> Optional[np.ndarray]:
+        """按属性筛选行，返回布尔掩码；没有筛选条件时返回 None"""
+        mask = None
+        if memory_type:
+            mask = self.type_codes == self._type_labels.get(memory_type, -2)
+        if contact_id:
+            matched = self.contact_codes == self._contact_labels.get(contact_id, -2)
+            mask = matched if mask is None else mask & matched
+        if min_importance:
+            matched = self.importance >= min_importance
+            mask = matched if mask is None else mask & matched
+        return mask
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """查询向量与每一行的余弦相似度，任一方为零向量时记为 0"""
+        query_norm = float(np.linalg.norm(query))
+        if query_norm == 0 or len(self) == 0:
+            return np.zeros(len(self), dtype=np.float32)
+        dots = self.vectors @ query
+        denominators = self.norms * query_norm
+        return np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+
+    def search(self, query, k: int, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """返回相似度最高的 k 条 (记忆ID, 相似度)，mask 限定参与排序的行；维度不匹配时返回空列表"""
+        query = np.asarray(query, dtype=np.float32)
+        if query.ndim != 1 or query.shape[0] != self.dim:
+            return []
+        scores = self.scores(query)
+        if mask is None:
+            return [(int(self.ids[i]), float(scores[i])) for i in top_k_indices(scores, k)]
+        rows = np.flatnonzero(mask)
+        top = top_k_indices(scores[rows], k)
+        return [(int(self.ids[rows[i]]), float(scores[rows[i]])) for i in top]
+
+    def search_many(self, queries, k: int, mask: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """多个查询向量一起计算：一次矩阵-矩阵乘法得到全部相似度，每个查询各取前 k 条"""
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.dim:
+            return [[] for _ in range(len(queries))]
+
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        query_norms = np.linalg.norm(queries, axis=1)
+        dots = self.vectors[rows] @ queries.T  # (候选数, 查询数)
+        denominators = np.outer(self.norms[rows], query_norms)
+        scores = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+
+        results = []
+        for column in scores.T:
+            top = top_k_indices(column, k)
+            results.append([(int(self.ids[rows[i]]), float(column[i])) for i in top])
+        return results
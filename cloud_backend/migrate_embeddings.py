@@ -0,0 +1,86 @@
+"""记忆向量存储格式迁移：JSON 文本 -> 二进制
+
+把 memory_store.embedding_vector（JSON 文本）转换为 embedding_blob（二进制），
+转换成功后清空旧字段。分批提交，可随时中断、重复运行；服务运行期间执行也没问题，
+未迁移的行在搜索时仍按 JSON 读取。
+
+用法：
+1. 直接运行: python migrate_embeddings.py
+2. SQLite 迁移完成后执行一次 VACUUM 才会真正缩小数据库文件
+
+环境变量：
+- DATABASE_URL: 数据库连接字符串
+- MEMORY_EMBEDDING_DTYPE: 存储精度 float32（默认）/ float16
+- MIGRATE_BATCH_SIZE: 每批处理行数（默认 500）
+"""
+import os
+import sys
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import bindparam, select, update
+from database import engine, init_db
+from models import MemoryStore
+from memory_vectors import encode_embedding, parse_embedding
+
+BATCH_SIZE = int(os.getenv("MIGRATE_BATCH_SIZE", "500"))
+
+
+def migrate_embeddings(batch_size: int = BATCH_SIZE):
+    """迁移所有旧格式向量，返回统计信息
+
+    用 Core 批量 UPDATE 而不是 ORM：转换格式不算修改，updated_at 和 relevance_score 都保持原值
+    """
+    memories = MemoryStore.__table__
+    statement = (
+        update(memories)
+        .where(memories.c.id == bindparam("memory_id"))
+        .values(embedding_blob=bindparam("blob"), embedding_vector=None)
+        .values(updated_at=memories.c.updated_at)
+    )
+    stats = {"migrated": 0, "invalid": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = 0
+
+    try:
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    select(memories.c.id, memories.c.embedding_vector, memories.c.embedding_blob)
+                    .where(memories.c.id > last_id, memories.c.embedding_vector.isnot(None))
+                    .order_by(memories.c.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+
+                params = []
+                for memory_id, legacy, blob in rows:
+                    last_id = memory_id
+                    vector = parse_embedding(legacy)
+                    if vector is None:
+                        # 无法解析的旧数据保持原样，不影响搜索（会被跳过）
+                        stats["invalid"] += 1
+                        continue
+                    stats["bytes_before"] += len(legacy)
+                    # 已有二进制向量说明是更新后的新数据，以新数据为准
+                    if blob is None:
+                        blob = encode_embedding(vector)
+                    params.append({"memory_id": memory_id, "blob": blob})
+                    stats["bytes_after"] += len(blob)
+                if params:
+                    conn.execute(statement, params)
+            stats["migrated"] += len(params)
+            print(f"   已处理至 ID {last_id}，累计迁移 {stats['migrated']} 条")
+
+        print(f"✅ 迁移完成: {stats}")
+        return stats
+
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    print("🔄 开始迁移记忆向量存储格式...")
+    init_db()  # 确保 embedding_blob 列已存在
+    migrate_embeddings()
@@ -1,8 +1,10 @@
 """数据库模型定义"""
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Text, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Text, DateTime, ForeignKey, Index, UniqueConstraint, LargeBinary, Float, event
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
+from memory_vectors import parse_embedding
+from memory_relevance import relevance_score
 import json
 from typing import Optional, List
 
@@ -286,6 +288,11 @@ class CloudTrigger(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        # 定时调度按 updated_at 增量同步其他进程的修改
+        Index('idx_trigger_type_updated', 'trigger_type', 'updated_at'),
+    )
+
     def to_dict(self):
         trigger_config = {}
         action_config = {}
@@ -351,7 +358,11 @@ class MemoryStore(Base):
     memory_key = Column(String(200), nullable=False, index=True)  # 记忆标识
     memory_content = Column(Text, nullable=False)  # 记忆内容
 
-    # 向量嵌入（JSON存储，用于语义检索）
+    # 向量嵌入（二进制存储，用于语义检索），格式见 memory_vectors.encode_embedding
+    # 1536 维 float32 约 6KB，JSON 文本约 20-30KB
+    embedding_blob = Column(LargeBinary, nullable=True)
+
+    # 旧版向量嵌入（JSON文本），仅用于兼容未迁移的数据，新数据不再写入
     # 格式: [0.1, 0.2, ..., 0.768] (OpenAI ada-002: 1536维)
     embedding_vector = Column(Text, nullable=True)
 
@@ -362,9 +373,20 @@ class MemoryStore(Base):
     access_count = Column(Integer, default=0)  # 访问次数
     last_accessed_at = Column(DateTime(timezone=True), nullable=True)
 
+    # 预计算的相关度（重要性 × 访问频率 × 时间衰减，对数形式），见 memory_relevance.py
+    relevance_score = Column(Float, nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        # 记忆列表的两种排序各有一个复合索引，按游标翻页时直接顺序扫描索引
+        Index('idx_memory_user_importance_updated', 'user_id', 'importance_score', 'updated_at', 'id'),
+        Index('idx_memory_user_relevance', 'user_id', 'relevance_score', 'id'),
+        # 统计接口的"最常访问"
+        Index('idx_memory_user_access', 'user_id', 'access_count'),
+    )
+
     def to_dict(self, include_embedding: bool = False):
         metadata = {}
         try:
@@ -388,15 +410,25 @@ class MemoryStore(Base):
         }
 
         # 仅在需要时包含向量数据（通常用于内部计算）
-        if include_embedding and self.embedding_vector:
-            try:
-                result["embedding_vector"] = json.loads(self.embedding_vector)
-            except:
-                pass
+        if include_embedding:
+            vector = parse_embedding(self.embedding_blob or self.embedding_vector)
+            if vector is not None:
+                result["embedding_vector"] = vector.tolist()
 
         return result
 
 
+@event.listens_for(MemoryStore, "before_insert")
+@event.listens_for(MemoryStore, "before_update")
+def _update_memory_relevance(mapper, connection, target):
+    """ORM 写入记忆时重新计算相关度（写入即视为一次活跃，updated_at 会更新为当前时间）"""
+    for value in (target.importance_score, target.access_count):
+        if value is not None and not isinstance(value, int):
+            # 字段被赋值为 SQL 表达式时无法在这里计算，由调用方自行设置
+            return
+    target.relevance_score = relevance_score(target.importance_score, target.access_count)
+
+
 class MemorySearchHistory(Base):
     """记忆搜索历史"""
     __tablename__ = "memory_search_history"
@@ -421,6 +453,28 @@ class MemorySearchHistory(Base):
         }
 
 
+class MemoryStatCounter(Base):
+    """记忆统计计数（写入记忆时增量维护，定期与明细核对），见 memory_stats.py
+
+    每个用户一组计数行，user_id=0 为全局计数：
+    - total / "": 记忆总数和内容字符数（全局另有 users / "" 记录有记忆的用户数）
+    - type / 记忆类型: 按类型计数
+    - contact / 联系人ID: 按联系人计数（仅用户级）
+    """
+    __tablename__ = "memory_stat_counters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)  # 0 表示全局
+    stat_type = Column(String(20), nullable=False)
+    stat_key = Column(String(100), nullable=False, default="")
+    memory_count = Column(Integer, nullable=False, default=0)
+    content_size = Column(BigInteger, nullable=False, default=0)  # 内容字符数
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'stat_type', 'stat_key', name='uq_memory_stat_counter'),
+    )
+
+
 # ============ 云同步核心表（施工手册定义） ============
 
 class SyncScope(Base):
@@ -508,7 +562,7 @@ class Conversation(Base):
     messages = relationship("SyncMessage", back_populates="conversation", cascade="all, delete-orphan")
 
     __table_args__ = (
-        Index('idx_conv_user_updated', 'user_id', 'updated_at'),
+        Index('idx_conv_user_updated', 'user_id', 'updated_at', 'id'),
         Index('idx_conv_user_pinned', 'user_id', 'is_pinned', 'updated_at'),
     )
 
@@ -578,7 +632,7 @@ class SyncMessage(Base):
 
     __table_args__ = (
         Index('idx_msg_conv_created', 'conversation_id', 'created_at'),
-        Index('idx_msg_user_created', 'user_id', 'created_at'),
+        Index('idx_msg_user_created', 'user_id', 'created_at', 'id'),
     )
 
     def to_dict(self, include_deleted: bool = False, include_blocks: bool = False):
@@ -684,7 +738,7 @@ class Provider(Base):
     updated_at = Column(BigInteger, nullable=False, index=True)
 
     __table_args__ = (
-        Index('idx_provider_user_updated', 'user_id', 'updated_at'),
+        Index('idx_provider_user_updated', 'user_id', 'updated_at', 'id'),
     )
 
     def to_dict(self, include_deleted: bool = False, include_keys: bool = False):
@@ -770,14 +824,60 @@ class SyncCursor(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     device_id = Column(String(100), nullable=False)
 
-    # 各资源类型的游标（unix ms）
+    # 各资源类型的游标（unix ms，时间戳模式，保留兼容）
     conversations_cursor = Column(BigInteger, nullable=False, default=0)
     messages_cursor = Column(BigInteger, nullable=False, default=0)
     providers_cursor = Column(BigInteger, nullable=False, default=0)
 
-    updated_at = Column(BigInteger, nullable=False)
+    # 变更日志模式：设备已确认收到的序列号（只在 ack 时前进）
+    acked_seq = Column(BigInteger, nullable=False, default=0)
+
+    updated_at = Column(BigInteger, nullable=False)  # 最近一次 ack 时间，unix ms
+
+    def to_dict(self):
+        return {
+            "device_id": self.device_id,
+            "acked_seq": self.acked_seq,
+            "updated_at": self.updated_at
+        }
 
     __table_args__ = (
         UniqueConstraint('user_id', 'device_id', name='uq_cursor_user_device'),
         Index('idx_cursor_user', 'user_id'),
     )
+
+
+class SyncSequence(Base):
+    """每用户同步序列号计数器
+
+    每次 push 提交前原子递增 last_seq；计数器行在事务内被锁住，
+    因此同一用户的序列号严格按提交顺序单调递增
+    """
+    __tablename__ = "sync_sequences"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_seq = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(BigInteger, nullable=False)
+
+
+class SyncChange(Base):
+    """变更日志（change feed）
+
+    每个实体一行，记录其最后一次变更的序列号；pull 按 (user_id, seq) 做一次索引范围扫描
+    软删除/恢复/重生成等批量修改也会写入，保证客户端能收到删除和恢复
+    """
+    __tablename__ = "sync_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    entity_type = Column(String(20), nullable=False)  # 'conversation' | 'message' | 'provider'
+    entity_id = Column(String(100), nullable=False)
+    seq = Column(BigInteger, nullable=False)
+    device_id = Column(String(100), nullable=True)  # 发起变更的设备；服务端派生的变更为空
+    updated_at = Column(BigInteger, nullable=False)  # unix ms
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'entity_type', 'entity_id', name='uq_change_entity'),
+        Index('idx_change_user_seq', 'user_id', 'seq'),
+        Index('idx_change_entity', 'entity_id'),
+    )
@@ -8,22 +8,29 @@
 - 分支会话（fork）
 - 幂等操作（op_id）
 """
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import and_, or_, insert
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from datetime import datetime
+import asyncio
 import json
+import os
 import time
 
-from database import get_db
-from auth import get_current_user
+from database import get_db, SessionLocal
+from auth import get_current_user, authenticate_token
 from models import (
     SyncScope, Conversation, SyncMessage, MessageBlock,
-    Provider, SyncOperation, SyncCursor
+    Provider, SyncOperation, SyncCursor, SyncSequence, SyncChange
 )
 from encryption import encrypt_api_keys, decrypt_api_keys
+from sync_notifier import notifier
+from trigger_events import event_bus, EVENT_NEW_MESSAGE
+from ttl_cache import TTLCache, MISSING
 
 router = APIRouter(prefix="/v2")
 
@@ -103,6 +110,11 @@ class PushRequest(BaseModel):
     operations: List[PushOperation]
 
 
+class AckRequest(BaseModel):
+    device_id: str
+    seq: int
+
+
 # ============ Scope 管理 ============
 
 @router.get("/scopes")
@@ -152,163 +164,902 @@ async def update_scopes(
         db.add(scope)
 
     db.commit()
+    scope_cache.invalidate(user_id)
     return scope.to_dict()
 
 
+# ============ 变更日志（change feed） ============
+
+# IN 查询分块大小（SQLite 参数个数有上限）
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = IN_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _ensure_sequence(db: Session, user_id: int, ts: int, exclude: set = frozenset()) -> SyncSequence:
+    """获取用户的序列号计数器；首次使用时把已有数据回填进变更日志
+
+    exclude: 不回填的 (entity_type, entity_id)，调用方随后会为它们分配新序列号
+    """
+    seq_row = db.query(SyncSequence).filter(SyncSequence.user_id == user_id).first()
+    if seq_row:
+        return seq_row
+
+    # 按时间顺序回填，保证旧数据在 feed 中的相对顺序
+    existing = []
+    for conv_id, updated_at in db.query(Conversation.id, Conversation.updated_at).filter(
+        Conversation.user_id == user_id
+    ):
+        existing.append((updated_at, "conversation", conv_id))
+    for msg_id, created_at in db.query(SyncMessage.id, SyncMessage.created_at).filter(
+        SyncMessage.user_id == user_id
+    ):
+        existing.append((created_at, "message", msg_id))
+    for prov_id, updated_at in db.query(Provider.id, Provider.updated_at).filter(
+        Provider.user_id == user_id
+    ):
+        existing.append((updated_at, "provider", prov_id))
+    existing = sorted(e for e in existing if (e[1], e[2]) not in exclude)
+
+    rows = [
+        {"user_id": user_id, "entity_type": t, "entity_id": eid, "seq": i + 1, "updated_at": ts}
+        for i, (_, t, eid) in enumerate(existing)
+    ]
+    # 同一用户的两个首次请求并发回填时，后提交的一方会撞上主键/唯一约束：
+    # 回滚自己的回填，改用对方已经建好的计数器
+    savepoint = db.begin_nested()
+    try:
+        for chunk in _chunks(rows):
+            db.execute(insert(SyncChange), chunk)
+        seq_row = SyncSequence(user_id=user_id, last_seq=len(rows), updated_at=ts)
+        db.add(seq_row)
+        db.flush()
+        savepoint.commit()
+        return seq_row
+    except IntegrityError:
+        savepoint.rollback()
+        seq_row = db.query(SyncSequence).filter(SyncSequence.user_id == user_id).first()
+        if seq_row is None:
+            raise
+        return seq_row
+
+
+def _commit_changes(db: Session, user_id: int, changes: List[tuple], ts: int) -> Optional[int]:
+    """为本次提交的变更分配序列号并写入变更日志
+
+    changes: [(entity_type, entity_id, device_id), ...]，按发生顺序；同一实体以最后一次为准
+    返回分配到的最大序列号；无变更时返回 None
+
+    每个实体只有一行，覆盖时不能丢掉其他设备的变更：只有该行原来就由同一设备写入时才保留
+    device_id，否则置空（所有设备都会收到），避免设备 A 的写入把设备 B 未被 A 拉取的修改
+    标记成 A 自己的变更而被回传抑制跳过
+    """
+    latest = {}
+    for entity_type, entity_id, device_id in changes:
+        key = (entity_type, entity_id)
+        if key in latest and latest.pop(key) != device_id:
+            device_id = None
+        latest[key] = device_id
+    ordered = list(latest)
+    if not ordered:
+        return None
+
+    # 原子递增（同时锁住计数器行直到事务提交）
+    def bump() -> int:
+        return db.query(SyncSequence).filter(SyncSequence.user_id == user_id).update(
+            {SyncSequence.last_seq: SyncSequence.last_seq + len(ordered), SyncSequence.updated_at: ts},
+            synchronize_session=False
+        )
+
+    if not bump():
+        _ensure_sequence(db, user_id, ts, exclude=set(ordered))
+        bump()
+    last_seq = db.query(SyncSequence.last_seq).filter(SyncSequence.user_id == user_id).scalar()
+    base = last_seq - len(ordered)
+
+    existing = {}
+    ids = list({eid for _, eid in ordered})
+    for chunk in _chunks(ids):
+        for change in db.query(SyncChange).filter(
+            SyncChange.user_id == user_id,
+            SyncChange.entity_id.in_(chunk)
+        ):
+            existing[(change.entity_type, change.entity_id)] = change
+
+    new_rows = []
+    for i, (entity_type, entity_id) in enumerate(ordered):
+        seq = base + i + 1
+        device_id = latest[(entity_type, entity_id)]
+        change = existing.get((entity_type, entity_id))
+        if change:
+            change.seq = seq
+            if change.device_id != device_id:
+                change.device_id = None
+            change.updated_at = ts
+        else:
+            new_rows.append({
+                "user_id": user_id, "entity_type": entity_type, "entity_id": entity_id,
+                "seq": seq, "device_id": device_id, "updated_at": ts
+            })
+    for chunk in _chunks(new_rows):
+        db.execute(insert(SyncChange), chunk)
+
+    return last_seq
+
+
+def _current_seq(db: Session, user_id: int) -> int:
+    """用户当前最大序列号"""
+    return db.query(SyncSequence.last_seq).filter(SyncSequence.user_id == user_id).scalar() or 0
+
+
+def _acked_seq(db: Session, user_id: int, device_id: str) -> int:
+    """设备已确认的序列号；新设备为 0（全量）"""
+    return db.query(SyncCursor.acked_seq).filter(
+        SyncCursor.user_id == user_id,
+        SyncCursor.device_id == device_id
+    ).scalar() or 0
+
+
+def _pull_feed_page(
+    db: Session,
+    user_id: int,
+    enabled_scopes: List[str],
+    since_seq: int,
+    include_deleted: bool,
+    limit: int,
+    exclude_device: Optional[str] = None
+) -> dict:
+    """按序列号拉取一页：一次 (user_id, seq) 索引范围扫描 + 每种资源一次 IN 查询
+
+    exclude_device: 跳过该设备自己推送的变更（序列号照常前进）
+    """
+    _ensure_sequence(db, user_id, now_ms())
+
+    changes = db.query(SyncChange).filter(
+        SyncChange.user_id == user_id,
+        SyncChange.seq > since_seq
+    ).order_by(SyncChange.seq).limit(limit + 1).all()
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    allowed = set()
+    if "chat.history" in enabled_scopes or "characters.cards" in enabled_scopes:
+        allowed.add("conversation")
+    if "chat.history" in enabled_scopes:
+        allowed.add("message")
+    if "providers.config" in enabled_scopes:
+        allowed.add("provider")
+
+    ids_by_type = {"conversation": [], "message": [], "provider": []}
+    for change in changes:
+        if exclude_device is not None and change.device_id == exclude_device:
+            continue
+        if change.entity_type in allowed:
+            ids_by_type[change.entity_type].append(change.entity_id)
+
+    def load(model, ids, *options):
+        # 已被回收站清理的实体查不到，直接跳过
+        loaded = {}
+        for chunk in _chunks(ids):
+            query = db.query(model).filter(model.user_id == user_id, model.id.in_(chunk))
+            if options:
+                query = query.options(*options)
+            for obj in query:
+                loaded[obj.id] = obj
+        return [loaded[i] for i in ids if i in loaded]
+
+    result = {"conversations": [], "messages": [], "providers": []}
+    for conv in load(Conversation, ids_by_type["conversation"]):
+        d = conv.to_dict(include_deleted=include_deleted)
+        if d:
+            result["conversations"].append(d)
+    for msg in load(SyncMessage, ids_by_type["message"], selectinload(SyncMessage.blocks)):
+        d = msg.to_dict(include_deleted=include_deleted, include_blocks=True)
+        if d:
+            result["messages"].append(d)
+    include_keys = "providers.keys" in enabled_scopes
+    for prov in load(Provider, ids_by_type["provider"]):
+        d = prov.to_dict(include_deleted=include_deleted, include_keys=include_keys)
+        if d:
+            result["providers"].append(d)
+
+    result["next_seq"] = changes[-1].seq if changes else since_seq
+    result["has_more"] = has_more
+    return result
+
+
 # ============ 增量拉取 ============
 
-@router.get("/pull")
-async def pull_changes(
-    device_id: str,
-    conversations_since: int = 0,
-    messages_since: int = 0,
-    providers_since: int = 0,
-    include_deleted: bool = True,
-    limit: int = 100,
-    user_id: int = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """增量拉取所有变化的数据"""
-    # 获取 scope
+# 默认 scope（用户未配置时）
+DEFAULT_SCOPES = ["chat.history", "characters.cards"]
+
+# 解析后的 scope 缓存（每次 pull 都要读；update_scopes 时失效，其他 worker 靠 TTL 兜底）
+scope_cache = TTLCache(
+    "sync_scopes",
+    maxsize=int(os.getenv("SCOPE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SCOPE_CACHE_TTL", "60"))
+)
+
+# 单页最大条数
+PULL_MAX_LIMIT = 500
+
+
+def _load_enabled_scopes(db: Session, user_id: int) -> tuple:
+    """读取用户启用的 scope（带缓存）"""
+    enabled_scopes = scope_cache.get(user_id)
+    if enabled_scopes is not MISSING:
+        return enabled_scopes
+
     scope_record = db.query(SyncScope).filter(SyncScope.user_id == user_id).first()
-    enabled_scopes = ["chat.history", "characters.cards"]
+    enabled_scopes = DEFAULT_SCOPES
     if scope_record:
         try:
             enabled_scopes = json.loads(scope_record.enabled_scopes)
         except:
             pass
+    # 缓存的是共享对象，转成不可变的 tuple
+    enabled_scopes = tuple(enabled_scopes)
+    scope_cache.set(user_id, enabled_scopes)
+    return enabled_scopes
+
+
+def _encode_cursor(ts: int, row_id: Optional[str]) -> str:
+    """游标格式: "{时间戳}:{id}"，客户端视为不透明字符串；id 为空表示只按时间戳比较"""
+    return f"{ts}:{row_id or ''}"
+
+
+def _decode_cursor(token: Optional[str], since: int) -> tuple:
+    """解析游标，返回 (ts, id)；未提供游标时退化为旧的 since 语义 (since, None)"""
+    if not token:
+        return since, None
+    ts, _, row_id = token.partition(":")
+    try:
+        return int(ts), (row_id or None)
+    except ValueError:
+        raise HTTPException(400, f"无效的游标: {token}")
 
+
+def _keyset_query(query, ts_col, id_col, cursor: tuple, limit: int):
+    """(ts, id) 复合键分页：同一毫秒内的多行按 id 继续翻页，不会漏行也不会死循环"""
+    ts, row_id = cursor
+    if row_id is None:
+        query = query.filter(ts_col > ts)
+    else:
+        query = query.filter(or_(ts_col > ts, and_(ts_col == ts, id_col > row_id)))
+    # 多取一行用于判断 has_more
+    return query.order_by(ts_col, id_col).limit(limit + 1).all()
+
+
+def _pull_page(
+    db: Session,
+    user_id: int,
+    enabled_scopes: List[str],
+    cursors: dict,
+    include_deleted: bool,
+    limit: int
+) -> dict:
+    """拉取一页数据
+
+    cursors: {"conversations": (ts, id), "messages": (ts, id), "providers": (ts, id)}
+    返回的 cursors 为下一页的游标；has_more 表示对应资源是否还有剩余
+    """
     result = {
         "conversations": [],
         "messages": [],
         "providers": [],
-        "server_time": now_ms()
+        "cursors": {},
+        "has_more": {"conversations": False, "messages": False, "providers": False},
     }
+    next_cursors = dict(cursors)
 
     # 拉取会话
     if "chat.history" in enabled_scopes or "characters.cards" in enabled_scopes:
-        conv_query = db.query(Conversation).filter(
-            Conversation.user_id == user_id,
-            Conversation.updated_at > conversations_since
-        ).order_by(Conversation.updated_at).limit(limit)
-
-        for conv in conv_query.all():
+        rows = _keyset_query(
+            db.query(Conversation).filter(Conversation.user_id == user_id),
+            Conversation.updated_at, Conversation.id,
+            cursors["conversations"], limit
+        )
+        if len(rows) > limit:
+            rows = rows[:limit]
+            result["has_more"]["conversations"] = True
+        for conv in rows:
             d = conv.to_dict(include_deleted=include_deleted)
             if d:
                 result["conversations"].append(d)
+        if rows:
+            next_cursors["conversations"] = (rows[-1].updated_at, rows[-1].id)
 
     # 拉取消息
     if "chat.history" in enabled_scopes:
-        msg_query = db.query(SyncMessage).filter(
-            SyncMessage.user_id == user_id,
-            SyncMessage.created_at > messages_since
-        ).order_by(SyncMessage.created_at).limit(limit)
-
-        for msg in msg_query.all():
+        # blocks 按页用一条 IN 查询批量加载，避免逐条消息懒加载（N+1）
+        rows = _keyset_query(
+            db.query(SyncMessage)
+            .options(selectinload(SyncMessage.blocks))
+            .filter(SyncMessage.user_id == user_id),
+            SyncMessage.created_at, SyncMessage.id,
+            cursors["messages"], limit
+        )
+        if len(rows) > limit:
+            rows = rows[:limit]
+            result["has_more"]["messages"] = True
+        for msg in rows:
             d = msg.to_dict(include_deleted=include_deleted, include_blocks=True)
             if d:
                 result["messages"].append(d)
+        if rows:
+            next_cursors["messages"] = (rows[-1].created_at, rows[-1].id)
 
     # 拉取渠道商
     if "providers.config" in enabled_scopes:
-        prov_query = db.query(Provider).filter(
-            Provider.user_id == user_id,
-            Provider.updated_at > providers_since
-        ).order_by(Provider.updated_at).limit(limit)
-
+        rows = _keyset_query(
+            db.query(Provider).filter(Provider.user_id == user_id),
+            Provider.updated_at, Provider.id,
+            cursors["providers"], limit
+        )
+        if len(rows) > limit:
+            rows = rows[:limit]
+            result["has_more"]["providers"] = True
         include_keys = "providers.keys" in enabled_scopes
-        for prov in prov_query.all():
+        for prov in rows:
             d = prov.to_dict(include_deleted=include_deleted, include_keys=include_keys)
             if d:
                 result["providers"].append(d)
+        if rows:
+            next_cursors["providers"] = (rows[-1].updated_at, rows[-1].id)
 
+    for name, (ts, row_id) in next_cursors.items():
+        result["cursors"][name] = _encode_cursor(ts, row_id)
+    result["next_cursors"] = next_cursors
     return result
 
 
+def _has_legacy_position(*positions) -> bool:
+    """请求是否带了时间戳/游标位置（旧客户端）；显式传 0 的首次全量同步也算"""
+    return any(position is not None for position in positions)
+
+
+def _echo_own_changes(echo_own: Optional[bool], since_seq: int) -> bool:
+    """未显式指定时，从 0 开始拉取（新设备，或保留 device_id 但本地数据已清空）需要回传本设备推送过的变更"""
+    return echo_own if echo_own is not None else since_seq == 0
+
+
+@router.get("/pull")
+async def pull_changes(
+    device_id: str,
+    conversations_since: Optional[int] = None,
+    messages_since: Optional[int] = None,
+    providers_since: Optional[int] = None,
+    conversations_cursor: Optional[str] = None,
+    messages_cursor: Optional[str] = None,
+    providers_cursor: Optional[str] = None,
+    since_seq: Optional[int] = None,
+    echo_own: Optional[bool] = None,
+    include_deleted: bool = True,
+    limit: int = 100,
+    user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """增量拉取所有变化的数据
+
+    - 只传 device_id 时从该设备已 ack 的位置续传（按序列号），处理完后调用 /ack 推进游标
+    - 推荐使用 since_seq（上次响应的 next_seq）：按服务端序列号拉取，删除/恢复也能收到
+    - 序列号模式下默认不回传本设备自己推送的变更（echo_own=true 可关闭）；
+      从 0 开始拉取时默认回传，保留 device_id 重装的设备也能取回自己推送过的数据
+    - 否则优先使用 *_cursor（上次响应中 cursors 字段原样回传）；未提供时按 *_since 时间戳拉取
+    - has_more 为 true 时客户端应立即用新游标继续拉取（has_more_by_type 给出各资源的情况）
+    """
+    limit = max(1, min(limit, PULL_MAX_LIMIT))
+    enabled_scopes = _load_enabled_scopes(db, user_id)
+
+    if since_seq is None and not _has_legacy_position(
+        conversations_since, messages_since, providers_since,
+        conversations_cursor, messages_cursor, providers_cursor
+    ):
+        since_seq = _acked_seq(db, user_id, device_id)
+
+    if since_seq is not None:
+        page = _pull_feed_page(
+            db, user_id, enabled_scopes, since_seq, include_deleted, limit,
+            exclude_device=None if _echo_own_changes(echo_own, since_seq) else device_id
+        )
+        db.commit()  # 首次使用时的回填
+        page["server_time"] = now_ms()
+        return page
+
+    cursors = {
+        "conversations": _decode_cursor(conversations_cursor, conversations_since or 0),
+        "messages": _decode_cursor(messages_cursor, messages_since or 0),
+        "providers": _decode_cursor(providers_cursor, providers_since or 0),
+    }
+
+    page = _pull_page(db, user_id, enabled_scopes, cursors, include_deleted, limit)
+    page.pop("next_cursors")
+    page["has_more_by_type"] = page.pop("has_more")
+    page["has_more"] = any(page["has_more_by_type"].values())
+    page["server_time"] = now_ms()
+    return page
+
+
+@router.get("/pull/stream")
+async def pull_changes_stream(
+    device_id: str,
+    conversations_since: Optional[int] = None,
+    messages_since: Optional[int] = None,
+    providers_since: Optional[int] = None,
+    conversations_cursor: Optional[str] = None,
+    messages_cursor: Optional[str] = None,
+    providers_cursor: Optional[str] = None,
+    since_seq: Optional[int] = None,
+    echo_own: Optional[bool] = None,
+    include_deleted: bool = True,
+    page_size: int = 200,
+    user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """流式全量/增量拉取（NDJSON，一个请求走完全部积压数据）
+
+    每行一个 JSON 对象：
+    - {"type": "conversation" | "message" | "provider", "data": {...}}
+    - {"type": "checkpoint", "cursors": {...}}  每页结束后输出，客户端可据此断点续传
+    - {"type": "end", "cursors": {...}, "server_time": ...}
+    按序列号拉取时（传 since_seq 或只传 device_id 续传），checkpoint/end 中为 next_seq 而非 cursors
+    服务端按页查询，内存占用只与 page_size 有关
+    """
+    page_size = max(1, min(page_size, PULL_MAX_LIMIT))
+    enabled_scopes = _load_enabled_scopes(db, user_id)
+    if since_seq is None and not _has_legacy_position(
+        conversations_since, messages_since, providers_since,
+        conversations_cursor, messages_cursor, providers_cursor
+    ):
+        since_seq = _acked_seq(db, user_id, device_id)
+    exclude_device = None
+    if since_seq is not None and not _echo_own_changes(echo_own, since_seq):
+        exclude_device = device_id
+    cursors = {
+        "conversations": _decode_cursor(conversations_cursor, conversations_since or 0),
+        "messages": _decode_cursor(messages_cursor, messages_since or 0),
+        "providers": _decode_cursor(providers_cursor, providers_since or 0),
+    }
+
+    def generate():
+        # 依赖注入的 session 在响应开始前就会关闭，流式输出需要自己的 session
+        stream_db = SessionLocal()
+        try:
+            if since_seq is not None:
+                yield from generate_feed(stream_db)
+                return
+            current = dict(cursors)
+            while True:
+                page = _pull_page(stream_db, user_id, enabled_scopes, current, include_deleted, page_size)
+                for kind, items in (("conversation", page["conversations"]),
+                                    ("message", page["messages"]),
+                                    ("provider", page["providers"])):
+                    for item in items:
+                        yield json.dumps({"type": kind, "data": item}, ensure_ascii=False) + "\n"
+                current = page["next_cursors"]
+                if not any(page["has_more"].values()):
+                    yield json.dumps({
+                        "type": "end",
+                        "cursors": page["cursors"],
+                        "server_time": now_ms()
+                    }) + "\n"
+                    break
+                yield json.dumps({"type": "checkpoint", "cursors": page["cursors"]}) + "\n"
+                # 释放本页加载的 ORM 对象
+                stream_db.expunge_all()
+        finally:
+            stream_db.close()
+
+    def generate_feed(stream_db: Session):
+        current = since_seq
+        while True:
+            page = _pull_feed_page(
+                stream_db, user_id, enabled_scopes, current, include_deleted, page_size,
+                exclude_device=exclude_device
+            )
+            stream_db.commit()
+            for kind, items in (("conversation", page["conversations"]),
+                                ("message", page["messages"]),
+                                ("provider", page["providers"])):
+                for item in items:
+                    yield json.dumps({"type": kind, "data": item}, ensure_ascii=False) + "\n"
+            current = page["next_seq"]
+            if not page["has_more"]:
+                yield json.dumps({"type": "end", "next_seq": current, "server_time": now_ms()}) + "\n"
+                break
+            yield json.dumps({"type": "checkpoint", "next_seq": current}) + "\n"
+            stream_db.expunge_all()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+# ============ 设备游标 ============
+
+@router.post("/ack")
+async def ack_changes(
+    request: AckRequest,
+    user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """确认设备已收到并应用了 seq 及之前的变更（游标只前进不后退）"""
+    return _ack_device(db, user_id, request.device_id, request.seq)
+
+
+def _ack_device(db: Session, user_id: int, device_id: str, seq: int) -> dict:
+    """推进设备游标并提交（HTTP ack 与 WebSocket 共用）"""
+    last_seq = _current_seq(db, user_id)
+    if seq < 0 or seq > last_seq:
+        raise HTTPException(400, f"无效的序列号: {seq}")
+
+    ts = now_ms()
+    cursor = db.query(SyncCursor).filter(
+        SyncCursor.user_id == user_id,
+        SyncCursor.device_id == device_id
+    ).first()
+    if cursor:
+        cursor.acked_seq = max(cursor.acked_seq or 0, seq)
+        cursor.updated_at = ts
+    else:
+        cursor = SyncCursor(
+            user_id=user_id,
+            device_id=device_id,
+            acked_seq=seq,
+            updated_at=ts
+        )
+        db.add(cursor)
+
+    db.commit()
+    return {**cursor.to_dict(), "lag": last_seq - cursor.acked_seq, "server_time": ts}
+
+
+@router.get("/devices")
+async def list_devices(
+    user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """列出用户各设备的同步进度
+
+    lag: 尚未确认的变更数（序列号差）
+    stale: 有未确认变更且超过回收站保留期未 ack —— 期间删除的数据可能已被清理，设备应全量重同步
+    """
+    ts = now_ms()
+    last_seq = _current_seq(db, user_id)
+    devices = []
+    for cursor in db.query(SyncCursor).filter(SyncCursor.user_id == user_id).order_by(SyncCursor.updated_at):
+        d = cursor.to_dict()
+        d["lag"] = last_seq - (cursor.acked_seq or 0)
+        d["stale"] = d["lag"] > 0 and ts - cursor.updated_at > RECYCLE_BIN_MS
+        devices.append(d)
+    return {"devices": devices, "last_seq": last_seq, "server_time": ts}
+
+
+# ============ 变更通知（长轮询 / SSE） ============
+
+# 长轮询最长挂起时间（秒）
+WAIT_MAX_TIMEOUT = 60
+# SSE 心跳间隔（秒），防止中间代理断开空闲连接
+SSE_HEARTBEAT_SECONDS = 20
+
+
+@router.get("/changes/wait")
+async def wait_for_changes(
+    since_seq: int,
+    timeout: int = 25,
+    user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """长轮询：有新变更（序列号大于 since_seq）时立即返回，否则挂起直到超时
+
+    changed 为 true 时客户端再调用 /pull 拉取；超时返回 changed=false，客户端直接重新发起等待
+    """
+    timeout = max(0, min(timeout, WAIT_MAX_TIMEOUT))
+    current = _current_seq(db, user_id)
+    notifier.deliver(user_id, current)
+    # 挂起期间不占用数据库连接
+    db.close()
+
+    last_seq = await notifier.wait(user_id, since_seq, timeout)
+    return {
+        "changed": last_seq is not None,
+        "last_seq": last_seq if last_seq is not None else current,
+        "server_time": now_ms()
+    }
+
+
+@router.get("/changes/events")
+async def change_events(
+    since_seq: int,
+    user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """SSE：每当用户序列号前进时推送一条 change 事件
+
+    event: change
+    data: {"last_seq": 123}
+    空闲时每 SSE_HEARTBEAT_SECONDS 秒发送一行注释心跳
+    """
+    notifier.deliver(user_id, _current_seq(db, user_id))
+    db.close()
+
+    async def events():
+        current = since_seq
+        while True:
+            seq = await notifier.wait(user_id, current, SSE_HEARTBEAT_SECONDS)
+            if seq is None:
+                yield ": ping\n\n"
+                continue
+            current = seq
+            yield f"event: change\ndata: {json.dumps({'last_seq': seq})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ============ 推送操作 ============
 
+# delete / restore 的目标类型
+TARGET_MODELS = {"conversation": Conversation, "message": SyncMessage, "provider": Provider}
+
+
+def _referenced_ids(op: PushOperation):
+    """列出操作执行时需要读取的已有对象 (model, id)"""
+    data = op.data
+    if op.op_type == "upsert_conversation":
+        yield Conversation, data.get("id")
+    elif op.op_type == "append_message":
+        yield Conversation, data.get("conversation_id")
+    elif op.op_type in ("delete", "restore"):
+        model = TARGET_MODELS.get(data.get("type"))
+        if model:
+            yield model, data.get("id")
+    elif op.op_type == "regen":
+        yield SyncMessage, data.get("old_message_id")
+    elif op.op_type == "fork":
+        yield Conversation, data.get("parent_conversation_id")
+        yield SyncMessage, data.get("fork_from_message_id")
+    elif op.op_type == "upsert_provider":
+        yield Provider, data.get("id")
+
+
+class _PushBatch:
+    """一次 push 的预取缓存
+
+    用少量 IN 查询一次性取出本批操作会用到的 op_id / 会话 / 消息 / 渠道商，
+    执行阶段用字典查找代替逐条 SELECT。本批新建的对象也登记进来，
+    所以同一批里先建会话再追加消息可以直接命中
+    """
+
+    def __init__(self, db: Session, user_id: int, operations: List[PushOperation]):
+        self.db = db
+        self.user_id = user_id
+        self.done_ops = {}  # op_id -> 之前的结果
+        self._objects = {model: {} for model in TARGET_MODELS.values()}
+        self._added = []  # 本批新增对象的 (model, id)，按添加顺序
+
+        op_ids = [op.op_id for op in operations]
+        for chunk in _chunks(op_ids):
+            for existing in db.query(SyncOperation).filter(SyncOperation.op_id.in_(chunk)):
+                self.done_ops[existing.op_id] = json.loads(existing.result_data) if existing.result_data else None
+
+        wanted = {model: set() for model in TARGET_MODELS.values()}
+        for op in operations:
+            for model, obj_id in _referenced_ids(op):
+                if obj_id is not None:
+                    wanted[model].add(obj_id)
+        for model, ids in wanted.items():
+            found = self._objects[model]
+            for chunk in _chunks(list(ids)):
+                for obj in db.query(model).filter(model.user_id == user_id, model.id.in_(chunk)):
+                    found[obj.id] = obj
+            # 未命中的记为不存在，执行阶段不再查询
+            for obj_id in ids:
+                found.setdefault(obj_id, None)
+
+    def get(self, model, obj_id):
+        """按 id 取对象；不在预取范围内时回退为单条查询"""
+        found = self._objects[model]
+        if obj_id not in found:
+            found[obj_id] = self.db.query(model).filter(
+                model.user_id == self.user_id,
+                model.id == obj_id
+            ).first()
+        return found[obj_id]
+
+    def add(self, obj):
+        """新增对象（由 flush 按表合并成批量 INSERT）"""
+        self.db.add(obj)
+        if type(obj) in self._objects:
+            self._objects[type(obj)][obj.id] = obj
+            self._added.append((type(obj), obj.id))
+
+    def mark(self) -> int:
+        return len(self._added)
+
+    def discard_since(self, mark: int):
+        """savepoint 回滚后，忘掉该操作新增的对象（它们已被移出 session）"""
+        for model, obj_id in self._added[mark:]:
+            self._objects[model][obj_id] = None
+        del self._added[mark:]
+
+
 @router.post("/push")
 async def push_operations(
     request: PushRequest,
     user_id: int = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """批量推送操作（幂等）"""
-    results = []
+    """批量推送操作（幂等）
+
+    按提交顺序逐个执行并逐个返回结果；读取走 _PushBatch 预取，写入在提交时按表批量 INSERT。
+    单个操作失败只回滚该操作，其余成功的操作在同一事务内提交
+    """
+    response = _push_and_commit(db, user_id, request.operations)
+    if response["last_seq"] is not None:
+        notifier.publish(user_id, response["last_seq"])
+    return response
+
+
+def _push_and_commit(db: Session, user_id: int, operations: List[PushOperation]) -> dict:
+    """执行一批操作、写变更日志并提交（HTTP push 与 WebSocket 共用）"""
     ts = now_ms()
+    results, changes = _apply_operations(db, user_id, operations, ts)
+    last_seq = _commit_changes(db, user_id, changes, ts)
+    db.commit()
+    _publish_events(user_id, operations, results)
+    return {"results": results, "server_time": ts, "last_seq": last_seq}
+
+
+def _publish_events(user_id: int, operations: List[PushOperation], results: List[dict]):
+    """提交后把成功追加的消息发布给事件触发器（只投递，不等待执行）"""
+    if not event_bus.has_listeners(user_id):
+        return
+    events = [
+        {
+            "contact_id": op.data.get("conversation_id"),
+            "message_id": op.data.get("id"),
+            "role": op.data.get("role"),
+        }
+        for op, result in zip(operations, results)
+        if op.op_type == "append_message" and result["status"] == "success"
+    ]
+    event_bus.publish_threadsafe(user_id, EVENT_NEW_MESSAGE, events)
+
+
+def _apply_operations(db: Session, user_id: int, operations: List[PushOperation], ts: int) -> tuple:
+    """执行一批操作，返回 (results, changes)
+
+    先把整批放在一个 savepoint 里执行并 flush（保持批量 INSERT）；
+    只要有任何操作失败，就回滚这个 savepoint，改为每个操作单独一个 savepoint 重放，
+    失败的操作只回滚自己，不会把半成品对象留在 session 里拖垮整批提交
+    """
+    savepoint = db.begin_nested()
+    try:
+        results, changes = _run_operations(db, user_id, operations, ts, isolate=False)
+        db.flush()
+        savepoint.commit()
+        return results, changes
+    except Exception:
+        savepoint.rollback()
+
+    return _run_operations(db, user_id, operations, ts, isolate=True)
+
 
-    for op in request.operations:
-        # 幂等检查
-        existing = db.query(SyncOperation).filter(SyncOperation.op_id == op.op_id).first()
-        if existing:
+def _run_operations(db: Session, user_id: int, operations: List[PushOperation], ts: int, isolate: bool) -> tuple:
+    """逐个执行操作
+
+    isolate=False: 遇到失败直接抛出（由调用方回滚整批）
+    isolate=True: 每个操作在独立 savepoint 中执行并 flush，失败时只回滚该操作
+    """
+    results = []
+    changes = []
+    batch = _PushBatch(db, user_id, operations)
+
+    for op in operations:
+        # 幂等检查（包括同一批内重复的 op_id）
+        if op.op_id in batch.done_ops:
             # 返回之前的结果
             results.append({
                 "op_id": op.op_id,
                 "status": "duplicate",
-                "result": json.loads(existing.result_data) if existing.result_data else None
+                "result": batch.done_ops[op.op_id]
             })
             continue
 
-        try:
-            result = _execute_operation(db, user_id, op, ts)
-
-            # 记录操作
-            sync_op = SyncOperation(
-                op_id=op.op_id,
-                user_id=user_id,
-                device_id=op.device_id,
-                operation_type=op.op_type,
-                operation_data=json.dumps(op.data),
-                result_data=json.dumps(result),
-                created_at=ts
-            )
-            db.add(sync_op)
-
-            results.append({
-                "op_id": op.op_id,
-                "status": "success",
-                "result": result
-            })
-        except Exception as e:
-            results.append({
-                "op_id": op.op_id,
-                "status": "error",
-                "error": str(e)
-            })
-
-    db.commit()
-    return {"results": results, "server_time": ts}
-
-
-def _execute_operation(db: Session, user_id: int, op: PushOperation, ts: int) -> dict:
-    """执行单个操作"""
+        if not isolate:
+            result, op_changes = _run_one(db, user_id, op, ts, batch)
+        else:
+            mark = batch.mark()
+            try:
+                with db.begin_nested():
+                    result, op_changes = _run_one(db, user_id, op, ts, batch)
+                    db.flush()
+            except Exception as e:
+                batch.discard_since(mark)
+                results.append({
+                    "op_id": op.op_id,
+                    "status": "error",
+                    "error": str(e)
+                })
+                continue
+
+        # 未显式标注来源的变更归属发起设备
+        changes.extend(c if len(c) == 3 else (*c, op.device_id) for c in op_changes)
+        batch.done_ops[op.op_id] = result
+        results.append({
+            "op_id": op.op_id,
+            "status": "success",
+            "result": result
+        })
+
+    return results, changes
+
+
+def _run_one(db: Session, user_id: int, op: PushOperation, ts: int, batch: _PushBatch) -> tuple:
+    """执行单个操作并记录 op_id，返回 (result, changes)"""
+    op_changes = []
+    result = _execute_operation(db, user_id, op, ts, op_changes, batch)
+
+    # 记录操作
+    sync_op = SyncOperation(
+        op_id=op.op_id,
+        user_id=user_id,
+        device_id=op.device_id,
+        operation_type=op.op_type,
+        operation_data=json.dumps(op.data),
+        result_data=json.dumps(result),
+        created_at=ts
+    )
+    db.add(sync_op)
+    return result, op_changes
+
+
+def _execute_operation(
+    db: Session,
+    user_id: int,
+    op: PushOperation,
+    ts: int,
+    changes: List[tuple],
+    batch: Optional[_PushBatch] = None
+) -> dict:
+    """执行单个操作
+
+    changes: 收集本操作修改的实体 [(entity_type, entity_id), ...]，用于写变更日志；
+             服务端派生出的变更（客户端本地没有的）记为 (entity_type, entity_id, None)，会回传给所有设备
+    batch: 预取缓存；单独执行时传 None 即可
+    """
     data = op.data
+    if batch is None:
+        batch = _PushBatch(db, user_id, [op])
 
     if op.op_type == "upsert_conversation":
-        return _upsert_conversation(db, user_id, data, ts)
+        return _upsert_conversation(db, user_id, data, ts, changes, batch)
     elif op.op_type == "append_message":
-        return _append_message(db, user_id, data, ts)
+        return _append_message(db, user_id, data, ts, changes, batch)
     elif op.op_type == "delete":
-        return _soft_delete(db, user_id, data, ts)
+        return _soft_delete(db, user_id, data, ts, changes, batch)
     elif op.op_type == "restore":
-        return _restore(db, user_id, data, ts)
+        return _restore(db, user_id, data, ts, changes, batch)
     elif op.op_type == "regen":
-        return _regen_replace(db, user_id, data, ts)
+        return _regen_replace(db, user_id, data, ts, changes, batch)
     elif op.op_type == "fork":
-        return _fork_conversation(db, user_id, data, ts)
+        return _fork_conversation(db, user_id, data, ts, changes, batch)
     elif op.op_type == "upsert_provider":
-        return _upsert_provider(db, user_id, data, ts)
+        return _upsert_provider(db, user_id, data, ts, changes, batch)
     else:
         raise ValueError(f"未知操作类型: {op.op_type}")
 
 
-def _upsert_conversation(db: Session, user_id: int, data: dict, ts: int) -> dict:
+def _upsert_conversation(db: Session, user_id: int, data: dict, ts: int, changes: List[tuple], batch: _PushBatch) -> dict:
     """创建或更新会话"""
     conv_id = data.get("id")
-    existing = db.query(Conversation).filter(
-        Conversation.id == conv_id,
-        Conversation.user_id == user_id
-    ).first()
+    existing = batch.get(Conversation, conv_id)
 
     if existing:
         # 更新
@@ -320,6 +1071,7 @@ def _upsert_conversation(db: Session, user_id: int, data: dict, ts: int) -> dict
             if key in data:
                 setattr(existing, key, data[key])
         existing.updated_at = ts
+        changes.append(("conversation", conv_id))
         return {"id": conv_id, "action": "updated"}
     else:
         # 创建
@@ -348,20 +1100,18 @@ def _upsert_conversation(db: Session, user_id: int, data: dict, ts: int) -> dict
             created_at=ts,
             updated_at=ts
         )
-        db.add(conv)
+        batch.add(conv)
+        changes.append(("conversation", conv_id))
         return {"id": conv_id, "action": "created"}
 
 
-def _append_message(db: Session, user_id: int, data: dict, ts: int) -> dict:
+def _append_message(db: Session, user_id: int, data: dict, ts: int, changes: List[tuple], batch: _PushBatch) -> dict:
     """追加消息"""
     msg_id = data.get("id")
     conv_id = data.get("conversation_id")
 
     # 检查会话存在
-    conv = db.query(Conversation).filter(
-        Conversation.id == conv_id,
-        Conversation.user_id == user_id
-    ).first()
+    conv = batch.get(Conversation, conv_id)
     if not conv:
         raise ValueError(f"会话不存在: {conv_id}")
 
@@ -375,7 +1125,7 @@ def _append_message(db: Session, user_id: int, data: dict, ts: int) -> dict:
         status=data.get("status", "sent"),
         created_at=ts
     )
-    db.add(msg)
+    batch.add(msg)
 
     # 创建 blocks
     blocks = data.get("blocks", [])
@@ -396,87 +1146,65 @@ def _append_message(db: Session, user_id: int, data: dict, ts: int) -> dict:
     conv.last_message_time = ts
     conv.updated_at = ts
 
+    changes.append(("message", msg_id))
+    changes.append(("conversation", conv_id))
     return {"id": msg_id, "action": "created"}
 
 
-def _soft_delete(db: Session, user_id: int, data: dict, ts: int) -> dict:
+def _soft_delete(db: Session, user_id: int, data: dict, ts: int, changes: List[tuple], batch: _PushBatch) -> dict:
     """软删除（进入回收站）"""
     target_type = data.get("type")  # 'conversation', 'message', 'provider'
     target_id = data.get("id")
     purge_at = ts + RECYCLE_BIN_MS
 
-    if target_type == "conversation":
-        obj = db.query(Conversation).filter(
-            Conversation.id == target_id,
-            Conversation.user_id == user_id
-        ).first()
-    elif target_type == "message":
-        obj = db.query(SyncMessage).filter(
-            SyncMessage.id == target_id,
-            SyncMessage.user_id == user_id
-        ).first()
-    elif target_type == "provider":
-        obj = db.query(Provider).filter(
-            Provider.id == target_id,
-            Provider.user_id == user_id
-        ).first()
-    else:
+    model = TARGET_MODELS.get(target_type)
+    if model is None:
         raise ValueError(f"未知删除类型: {target_type}")
+    obj = batch.get(model, target_id)
 
     if not obj:
         raise ValueError(f"对象不存在: {target_type}/{target_id}")
 
     obj.deleted_at = ts
     obj.purge_at = purge_at
+    changes.append((target_type, target_id))
 
     # 如果是会话，同时软删除其消息
     if target_type == "conversation":
-        db.query(SyncMessage).filter(
-            SyncMessage.conversation_id == target_id
-        ).update({"deleted_at": ts, "purge_at": purge_at})
+        msg_query = db.query(SyncMessage).filter(SyncMessage.conversation_id == target_id)
+        changes.extend(("message", msg_id, None) for (msg_id,) in msg_query.with_entities(SyncMessage.id))
+        msg_query.update({"deleted_at": ts, "purge_at": purge_at})
 
     return {"id": target_id, "type": target_type, "action": "deleted", "purge_at": purge_at}
 
 
-def _restore(db: Session, user_id: int, data: dict, ts: int) -> dict:
+def _restore(db: Session, user_id: int, data: dict, ts: int, changes: List[tuple], batch: _PushBatch) -> dict:
     """从回收站恢复"""
     target_type = data.get("type")
     target_id = data.get("id")
 
-    if target_type == "conversation":
-        obj = db.query(Conversation).filter(
-            Conversation.id == target_id,
-            Conversation.user_id == user_id
-        ).first()
-    elif target_type == "message":
-        obj = db.query(SyncMessage).filter(
-            SyncMessage.id == target_id,
-            SyncMessage.user_id == user_id
-        ).first()
-    elif target_type == "provider":
-        obj = db.query(Provider).filter(
-            Provider.id == target_id,
-            Provider.user_id == user_id
-        ).first()
-    else:
+    model = TARGET_MODELS.get(target_type)
+    if model is None:
         raise ValueError(f"未知恢复类型: {target_type}")
+    obj = batch.get(model, target_id)
 
     if not obj:
         raise ValueError(f"对象不存在: {target_type}/{target_id}")
 
     obj.deleted_at = None
     obj.purge_at = None
+    changes.append((target_type, target_id))
 
     # 如果是会话，同时恢复其消息
     if target_type == "conversation":
-        db.query(SyncMessage).filter(
-            SyncMessage.conversation_id == target_id
-        ).update({"deleted_at": None, "purge_at": None})
+        msg_query = db.query(SyncMessage).filter(SyncMessage.conversation_id == target_id)
+        changes.extend(("message", msg_id, None) for (msg_id,) in msg_query.with_entities(SyncMessage.id))
+        msg_query.update({"deleted_at": None, "purge_at": None})
 
     return {"id": target_id, "type": target_type, "action": "restored"}
 
 
-def _regen_replace(db: Session, user_id: int, data: dict, ts: int) -> dict:
+def _regen_replace(db: Session, user_id: int, data: dict, ts: int, changes: List[tuple], batch: _PushBatch) -> dict:
     """重生成覆盖（原子事务）
 
     1. 旧消息软删除 + replaced_by 指向新消息
@@ -487,10 +1215,7 @@ def _regen_replace(db: Session, user_id: int, data: dict, ts: int) -> dict:
     new_msg_data = data.get("new_message")
 
     # 获取旧消息
-    old_msg = db.query(SyncMessage).filter(
-        SyncMessage.id == old_msg_id,
-        SyncMessage.user_id == user_id
-    ).first()
+    old_msg = batch.get(SyncMessage, old_msg_id)
     if not old_msg:
         raise ValueError(f"旧消息不存在: {old_msg_id}")
 
@@ -516,7 +1241,7 @@ def _regen_replace(db: Session, user_id: int, data: dict, ts: int) -> dict:
         status=new_msg_data.get("status", "sent"),
         created_at=ts
     )
-    db.add(new_msg)
+    batch.add(new_msg)
 
     # 创建新消息的 blocks
     for i, b in enumerate(new_msg_data.get("blocks", [])):
@@ -532,12 +1257,16 @@ def _regen_replace(db: Session, user_id: int, data: dict, ts: int) -> dict:
         db.add(block)
 
     # 3. 更新会话摘要
-    conv = db.query(Conversation).filter(Conversation.id == conv_id).first()
+    conv = batch.get(Conversation, conv_id)
     if conv:
         conv.last_message = new_msg_data.get("content", "")[:100]
         conv.last_message_time = ts
         conv.updated_at = ts
 
+    changes.append(("message", old_msg_id))
+    changes.append(("message", new_msg_id))
+    changes.append(("conversation", conv_id))
+
     return {
         "old_message_id": old_msg_id,
         "new_message_id": new_msg_id,
@@ -545,17 +1274,14 @@ def _regen_replace(db: Session, user_id: int, data: dict, ts: int) -> dict:
     }
 
 
-def _fork_conversation(db: Session, user_id: int, data: dict, ts: int) -> dict:
+def _fork_conversation(db: Session, user_id: int, data: dict, ts: int, changes: List[tuple], batch: _PushBatch) -> dict:
     """创建分支会话"""
     parent_conv_id = data.get("parent_conversation_id")
     fork_from_msg_id = data.get("fork_from_message_id")
     new_conv_id = data.get("new_conversation_id")
 
     # 获取父会话
-    parent_conv = db.query(Conversation).filter(
-        Conversation.id == parent_conv_id,
-        Conversation.user_id == user_id
-    ).first()
+    parent_conv = batch.get(Conversation, parent_conv_id)
     if not parent_conv:
         raise ValueError(f"父会话不存在: {parent_conv_id}")
 
@@ -582,15 +1308,16 @@ def _fork_conversation(db: Session, user_id: int, data: dict, ts: int) -> dict:
         created_at=ts,
         updated_at=ts
     )
-    db.add(new_conv)
+    batch.add(new_conv)
+    changes.append(("conversation", new_conv_id, None))
 
     # 复制分叉点之前的消息（可选，根据产品需求）
     if data.get("copy_messages", True):
         # 获取分叉点消息的创建时间
-        fork_msg = db.query(SyncMessage).filter(SyncMessage.id == fork_from_msg_id).first()
+        fork_msg = batch.get(SyncMessage, fork_from_msg_id)
         if fork_msg:
-            # 复制该时间点之前的所有消息
-            old_msgs = db.query(SyncMessage).filter(
+            # 复制该时间点之前的所有消息（blocks 一并批量加载）
+            old_msgs = db.query(SyncMessage).options(selectinload(SyncMessage.blocks)).filter(
                 SyncMessage.conversation_id == parent_conv_id,
                 SyncMessage.created_at <= fork_msg.created_at,
                 SyncMessage.deleted_at.is_(None)
@@ -607,7 +1334,8 @@ def _fork_conversation(db: Session, user_id: int, data: dict, ts: int) -> dict:
                     status=old_msg.status,
                     created_at=old_msg.created_at
                 )
-                db.add(new_msg)
+                batch.add(new_msg)
+                changes.append(("message", new_msg_id, None))
 
                 # 复制 blocks
                 for old_block in old_msg.blocks:
@@ -630,13 +1358,10 @@ def _fork_conversation(db: Session, user_id: int, data: dict, ts: int) -> dict:
     }
 
 
-def _upsert_provider(db: Session, user_id: int, data: dict, ts: int) -> dict:
+def _upsert_provider(db: Session, user_id: int, data: dict, ts: int, changes: List[tuple], batch: _PushBatch) -> dict:
     """创建或更新渠道商配置"""
     prov_id = data.get("id")
-    existing = db.query(Provider).filter(
-        Provider.id == prov_id,
-        Provider.user_id == user_id
-    ).first()
+    existing = batch.get(Provider, prov_id)
 
     if existing:
         # 更新
@@ -650,6 +1375,7 @@ def _upsert_provider(db: Session, user_id: int, data: dict, ts: int) -> dict:
             # 加密存储
             existing.api_keys_encrypted = encrypt_api_keys(data["api_keys"])
         existing.updated_at = ts
+        changes.append(("provider", prov_id))
         return {"id": prov_id, "action": "updated"}
     else:
         # 创建
@@ -668,10 +1394,206 @@ def _upsert_provider(db: Session, user_id: int, data: dict, ts: int) -> dict:
             created_at=ts,
             updated_at=ts
         )
-        db.add(prov)
+        batch.add(prov)
+        changes.append(("provider", prov_id))
         return {"id": prov_id, "action": "created"}
 
 
+# ============ WebSocket 同步通道 ============
+
+# 一次合并执行的 push 帧上限
+WS_MAX_BATCH_FRAMES = 50
+# 每帧下发的变更条数
+WS_FEED_PAGE_SIZE = 200
+
+
+@router.websocket("/ws")
+async def sync_websocket(
+    websocket: WebSocket,
+    device_id: str,
+    token: Optional[str] = None,
+    since_seq: Optional[int] = None
+):
+    """WebSocket 同步通道：一条长连接同时承载 push 和变更下发
+
+    认证：?token=xxx 或 Authorization: Bearer xxx（只在建连时校验一次）
+
+    客户端 -> 服务端：
+    - {"type": "push", "id": "帧id", "operations": [PushOperation, ...]}
+    - {"type": "ack", "seq": 123}
+    - {"type": "ping"}
+    服务端 -> 客户端：
+    - {"type": "push_result", "id": "帧id", "results": [...], "last_seq": ...}
+    - {"type": "changes", "conversations": [...], "messages": [...], "providers": [...], "next_seq": ..., "has_more": ...}
+    - {"type": "ack_result", ...} / {"type": "pong"} / {"type": "error", "id": ..., "error": "..."}
+
+    建连后先从 since_seq（缺省为设备已 ack 的位置）下发积压变更，之后有新提交时实时下发；
+    同时到达的多个 push 帧合并在一个事务内执行
+    """
+    if not token:
+        auth_header = websocket.headers.get("authorization", "")
+        if auth_header.lower().startswith("bearer "):
+            token = auth_header[7:]
+    if not token:
+        await websocket.close(code=1008)
+        return
+
+    def authenticate():
+        db = SessionLocal()
+        try:
+            user_id = authenticate_token(token, db)
+            start = since_seq if since_seq is not None else _acked_seq(db, user_id, device_id)
+            return user_id, start
+        finally:
+            db.close()
+
+    try:
+        user_id, start_seq = await asyncio.to_thread(authenticate)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    await _SyncChannel(websocket, user_id, device_id, start_seq).run()
+
+
+class _SyncChannel:
+    """单个 WebSocket 连接的收发循环"""
+
+    def __init__(self, websocket: WebSocket, user_id: int, device_id: str, since_seq: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.device_id = device_id
+        self.sent_seq = since_seq
+        # 从 0 开始时积压部分回传本设备推送过的变更（见 _echo_own_changes），追上之后不再回传
+        self.echo_own = _echo_own_changes(None, since_seq)
+        self.push_queue: asyncio.Queue = asyncio.Queue()
+        self.send_lock = asyncio.Lock()
+
+    async def run(self):
+        tasks = [
+            asyncio.create_task(self._receive_loop()),
+            asyncio.create_task(self._push_loop()),
+            asyncio.create_task(self._feed_loop()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                exc = task.exception()
+                if exc and not isinstance(exc, WebSocketDisconnect):
+                    print(f"⚠️ 同步 WebSocket 异常: {exc}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def send(self, frame: dict):
+        async with self.send_lock:
+            await self.websocket.send_text(json.dumps(frame, ensure_ascii=False))
+
+    async def _receive_loop(self):
+        while True:
+            try:
+                frame = json.loads(await self.websocket.receive_text())
+            except json.JSONDecodeError:
+                await self.send({"type": "error", "error": "无效的 JSON"})
+                continue
+            if not isinstance(frame, dict):
+                await self.send({"type": "error", "error": "帧必须是 JSON 对象"})
+                continue
+
+            frame_type = frame.get("type")
+            if frame_type == "push":
+                try:
+                    operations = PushRequest(operations=frame.get("operations", [])).operations
+                except ValidationError as e:
+                    await self.send({"type": "error", "id": frame.get("id"), "error": str(e)})
+                    continue
+                await self.push_queue.put((frame.get("id"), operations))
+            elif frame_type == "ack":
+                try:
+                    result = await asyncio.to_thread(self._ack, frame.get("seq"))
+                    await self.send({"type": "ack_result", **result})
+                except (HTTPException, TypeError, ValueError) as e:
+                    await self.send({"type": "error", "error": getattr(e, "detail", str(e))})
+            elif frame_type == "ping":
+                await self.send({"type": "pong", "server_time": now_ms()})
+            else:
+                await self.send({"type": "error", "error": f"未知帧类型: {frame_type}"})
+
+    async def _push_loop(self):
+        while True:
+            frames = [await self.push_queue.get()]
+            while len(frames) < WS_MAX_BATCH_FRAMES and not self.push_queue.empty():
+                frames.append(self.push_queue.get_nowait())
+
+            try:
+                responses = await asyncio.to_thread(self._apply_frames, frames)
+            except Exception as e:
+                for frame_id, _ in frames:
+                    await self.send({"type": "error", "id": frame_id, "error": str(e)})
+                continue
+
+            last_seq = None
+            for (frame_id, _), response in zip(frames, responses):
+                last_seq = response["last_seq"] if response["last_seq"] is not None else last_seq
+                await self.send({"type": "push_result", "id": frame_id, **response})
+            if last_seq is not None:
+                notifier.publish(self.user_id, last_seq)
+
+    async def _feed_loop(self):
+        while True:
+            page = await asyncio.to_thread(self._load_feed, self.sent_seq)
+            if page["next_seq"] > self.sent_seq:
+                self.sent_seq = page["next_seq"]
+                await self.send({"type": "changes", **page})
+            if page["has_more"]:
+                continue
+            self.echo_own = False
+            await notifier.wait(self.user_id, self.sent_seq, SSE_HEARTBEAT_SECONDS)
+
+    def _apply_frames(self, frames: list) -> list:
+        """合并执行多个 push 帧（一个事务），再按帧拆分结果"""
+        operations = [op for _, ops in frames for op in ops]
+        db = SessionLocal()
+        try:
+            response = _push_and_commit(db, self.user_id, operations)
+        finally:
+            db.close()
+
+        responses = []
+        offset = 0
+        for _, ops in frames:
+            responses.append({
+                "results": response["results"][offset:offset + len(ops)],
+                "server_time": response["server_time"],
+                "last_seq": response["last_seq"]
+            })
+            offset += len(ops)
+        return responses
+
+    def _load_feed(self, since_seq: int) -> dict:
+        db = SessionLocal()
+        try:
+            enabled_scopes = _load_enabled_scopes(db, self.user_id)
+            page = _pull_feed_page(
+                db, self.user_id, enabled_scopes, since_seq, True, WS_FEED_PAGE_SIZE,
+                exclude_device=None if self.echo_own else self.device_id
+            )
+            db.commit()
+            page["server_time"] = now_ms()
+            return page
+        finally:
+            db.close()
+
+    def _ack(self, seq: int) -> dict:
+        db = SessionLocal()
+        try:
+            return _ack_device(db, self.user_id, self.device_id, int(seq))
+        finally:
+            db.close()
+
+
 # ============ 回收站管理 ============
 
 @router.get("/recycle-bin")
@@ -0,0 +1,150 @@
+"""同步变更通知（长轮询 / SSE 的唤醒机制）
+
+push 提交后按 user_id 发布最新序列号，挂起在 /v2/changes/wait 上的请求立即返回，
+客户端不必再定时空轮询 /v2/pull。
+
+跨进程分发（后端）通过环境变量 SYNC_NOTIFY_BACKEND 选择：
+- memory（默认）: 只在本进程内唤醒，适合单 worker 部署
+- db: 额外定期查询 sync_sequences 表，能感知其他 worker 的提交，适合多 worker 部署
+"""
+import asyncio
+import os
+from typing import Dict, Optional, Set
+
+from database import SessionLocal
+from models import SyncSequence
+
+# 数据库轮询间隔（秒）
+DB_POLL_INTERVAL = float(os.getenv("SYNC_NOTIFY_POLL_INTERVAL", "1.0"))
+
+
+class MemoryBackend:
+    """单进程后端：本地发布已足够，无需额外分发"""
+
+    def publish(self, user_id: int, seq: int):
+        pass
+
+    async def run(self, notifier: "ChangeNotifier"):
+        pass
+
+
+class DatabasePollingBackend:
+    """多 worker 后端：只在有请求挂起时，按间隔批量查询这些用户的当前序列号"""
+
+    def __init__(self, interval: float = DB_POLL_INTERVAL):
+        self.interval = interval
+
+    def publish(self, user_id: int, seq: int):
+        # 序列号已随 push 事务写入 sync_sequences，其他 worker 会轮询到
+        pass
+
+    async def run(self, notifier: "ChangeNotifier"):
+        while True:
+            await asyncio.sleep(self.interval)
+            user_ids = notifier.waiting_users()
+            if not user_ids:
+                continue
+            try:
+                rows = await asyncio.to_thread(self._load, user_ids)
+            except Exception as e:
+                print(f"⚠️ 同步通知轮询失败: {e}")
+                continue
+            for user_id, seq in rows:
+                notifier.deliver(user_id, seq)
+
+    @staticmethod
+    def _load(user_ids: list) -> list:
+        db = SessionLocal()
+        try:
+            return db.query(SyncSequence.user_id, SyncSequence.last_seq).filter(
+                SyncSequence.user_id.in_(user_ids)
+            ).all()
+        finally:
+            db.close()
+
+
+class ChangeNotifier:
+    """按 user_id 挂起/唤醒等待者
+
+    只在事件循环线程中使用；从其他线程发布时请用 publish_threadsafe
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self._latest: Dict[int, int] = {}  # user_id -> 已知的最大序列号
+        self._waiters: Dict[int, Set[asyncio.Future]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """应用启动时调用，启动后端的后台任务"""
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self.backend.run(self))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish(self, user_id: int, seq: int):
+        """push 提交后调用：唤醒本进程的等待者，并交给后端分发"""
+        self.deliver(user_id, seq)
+        self.backend.publish(user_id, seq)
+
+    def publish_threadsafe(self, user_id: int, seq: int):
+        """在线程池中的同步代码里发布"""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self.publish, user_id, seq)
+
+    def deliver(self, user_id: int, seq: int):
+        """记录序列号；比已知的新时唤醒该用户的所有等待者"""
+        if seq <= self._latest.get(user_id, 0):
+            return
+        self._latest[user_id] = seq
+        for fut in self._waiters.pop(user_id, ()):
+            if not fut.done():
+                fut.set_result(seq)
+
+    def waiting_users(self) -> list:
+        return [user_id for user_id, waiters in self._waiters.items() if waiters]
+
+    async def wait(self, user_id: int, since_seq: int, timeout: float) -> Optional[int]:
+        """等待用户序列号超过 since_seq，返回新的序列号；超时返回 None"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            latest = self._latest.get(user_id, 0)
+            if latest > since_seq:
+                return latest
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+
+            fut = loop.create_future()
+            self._waiters.setdefault(user_id, set()).add(fut)
+            try:
+                await asyncio.wait_for(fut, remaining)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                waiters = self._waiters.get(user_id)
+                if waiters is not None:
+                    waiters.discard(fut)
+                    if not waiters:
+                        del self._waiters[user_id]
+
+
+def _make_backend():
+    name = os.getenv("SYNC_NOTIFY_BACKEND", "memory")
+    if name == "db":
+        return DatabasePollingBackend()
+    return MemoryBackend()
+
+
+# 进程级单例
+notifier = ChangeNotifier(_make_backend())
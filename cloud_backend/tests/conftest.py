@@ -0,0 +1,58 @@
+"""测试公共夹具
+
+模块在导入时就按 DATABASE_URL 创建引擎，因此必须在导入任何后端模块之前
+把数据库指向临时目录（整个测试会话共用一个 SQLite 文件，各测试用不同用户隔离数据）
+"""
+import base64
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+_DATA_DIR = tempfile.mkdtemp(prefix="cloud_backend_test_")
+os.chdir(_DATA_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{_DATA_DIR}/test.db"
+os.environ.setdefault("ENCRYPTION_KEK", base64.b64encode(b"k" * 32).decode())
+os.environ.setdefault("TRIGGER_CONDITION_WINDOW", "0.2")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from auth import create_access_token  # noqa: E402
+from database import SessionLocal, init_db  # noqa: E402
+from models import User  # noqa: E402
+
+init_db()
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    # with 块会执行 startup/shutdown（触发器引擎等后台任务）
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_user(client):
+    """注册用户并返回 (user_id, 认证头)"""
+    def make(level: int = 0, admin: bool = False):
+        response = client.post("/api/v1/auth/register", json={
+            "username": f"user{next(_usernames)}", "password": "pw"
+        })
+        user_id = response.json()["user"]["id"]
+        if level or admin:
+            db = SessionLocal()
+            user = db.get(User, user_id)
+            user.user_level = level
+            user.is_admin = admin
+            db.commit()
+            db.close()
+        token = create_access_token({"sub": str(user_id)})
+        return user_id, {"Authorization": f"Bearer {token}"}
+    return make
@@ -0,0 +1,131 @@
+"""记忆近似索引：索引内筛选与精确搜索一致，构建在后台线程完成，增量更新和补齐生效"""
+import time
+
+import numpy as np
+import pytest
+
+import memory_api
+import memory_index
+from database import SessionLocal
+from memory_index import IndexRows, IVFIndex, MemoryIndexManager
+from memory_vectors import EmbeddingMatrix, encode_embedding
+from models import MemoryStore
+
+DIM = 16
+TYPES = ["fact", "preference"]
+CONTACTS = ["c1", "c2", "c3", None]
+
+
+def _exact(ids, vectors, types, contacts, importance, query, k, **filters):
+    matrix = EmbeddingMatrix(ids, vectors, types, contacts, importance)
+    mask = matrix.filter_mask(filters.get("memory_type"), filters.get("contact_id"),
+                              filters.get("min_importance"))
+    return [memory_id for memory_id, _ in matrix.search(query, k, mask)]
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"memory_type": "fact"},
+    {"contact_id": "c2", "min_importance": 6},
+    {"memory_type": "preference", "contact_id": "c1", "min_importance": 9},
+    {"contact_id": "unknown"},
+])
+def test_filtered_search_matches_exact(tmp_path, filters):
+    rng = np.random.default_rng(1)
+    n = 600
+    ids = list(range(1, n + 1))
+    vectors = rng.normal(size=(n, DIM)).astype(np.float32)
+    types = [TYPES[i % 2] for i in range(n)]
+    contacts = [CONTACTS[i % 4] for i in range(n)]
+    importance = [int(i % 10) + 1 for i in range(n)]
+    index = IVFIndex.build(
+        IndexRows.from_matrix(EmbeddingMatrix(ids, vectors, types, contacts, importance)), n
+    )
+
+    # 增量更新：删除、改属性和向量、只改重要性、新增
+    for memory_id in range(1, n + 1, 7):
+        index.remove(memory_id)
+    for memory_id in range(2, n + 1, 11):
+        if memory_id in index:
+            vectors[memory_id - 1] = rng.normal(size=DIM)
+            contacts[memory_id - 1] = "c3"
+            index.upsert(memory_id, vectors[memory_id - 1], types[memory_id - 1], "c3",
+                         importance[memory_id - 1])
+    for memory_id in range(3, n + 1, 13):
+        importance[memory_id - 1] = 10
+        index.set_importance(memory_id, 10)
+    kept = [memory_id for memory_id in ids if memory_id in index]
+
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    for current in (index, IVFIndex.load(path)):
+        for _ in range(5):
+            query = rng.normal(size=DIM).astype(np.float32)
+            hits = current.search(query, 10, nprobe=len(current.centroids), **filters)
+            expected = _exact(
+                kept, vectors[[i - 1 for i in kept]], [types[i - 1] for i in kept],
+                [contacts[i - 1] for i in kept], [importance[i - 1] for i in kept],
+                query, 10, **filters
+            )
+            assert [memory_id for memory_id, _ in hits] == expected
+
+
+def _seed_memories(client, headers, count: int):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(count, DIM)).round(4)
+    response = client.post("/api/v1/memory/batch", headers=headers, json={"memories": [
+        {
+            "memory_type": TYPES[i % 2], "memory_key": f"k{i}", "memory_content": f"content {i}",
+            "contact_id": CONTACTS[i % 4], "embedding_vector": vectors[i].tolist(),
+            "importance_score": i % 10 + 1
+        }
+        for i in range(count)
+    ]})
+    assert response.status_code == 201
+    return response.json()["ids"], vectors
+
+
+def _search(client, headers, vector, **filters):
+    response = client.post("/api/v1/memory/search", headers=headers, json={
+        "query": "q", "search_type": "semantic", "query_embedding": [float(x) for x in vector],
+        "limit": 5, **filters
+    })
+    assert response.status_code == 200
+    return response.json()["memories"]
+
+
+def test_index_built_in_background_and_kept_up_to_date(client, make_user, tmp_path, monkeypatch):
+    manager = MemoryIndexManager(directory=str(tmp_path), enabled=True)
+    monkeypatch.setattr(memory_index, "ANN_MIN_SIZE", 100)
+    monkeypatch.setattr(memory_api, "index_manager", manager)
+    user_id, headers = make_user(level=4)
+    ids, vectors = _seed_memories(client, headers, 300)
+
+    # 第一次搜索提交后台构建，本次走精确搜索
+    assert _search(client, headers, vectors[5])[0]["id"] == ids[5]
+    deadline = time.time() + 10
+    db = SessionLocal()
+    while manager.search(db, user_id, vectors[5], 5) is None:
+        assert time.time() < deadline, "后台构建超时"
+        time.sleep(0.05)
+    db.close()
+
+    hits = _search(client, headers, vectors[6], contact_id="c3", min_importance=5)
+    assert hits[0]["id"] == ids[6]
+    assert all(hit["contact_id"] == "c3" and hit["importance_score"] >= 5 for hit in hits)
+
+    # 本进程删除的记忆立即从索引中移除
+    assert client.delete(f"/api/v1/memory/{ids[6]}", headers=headers).status_code == 204
+    assert ids[6] not in [hit["id"] for hit in _search(client, headers, vectors[6], contact_id="c3")]
+
+    # 绕过本进程索引写入的记忆（其他 worker）在搜索时按 ID 补齐
+    vector = np.random.default_rng(3).normal(size=DIM).astype(np.float32)
+    db = SessionLocal()
+    memory = MemoryStore(user_id=user_id, memory_type="fact", memory_key="other", memory_content="x",
+                         contact_id="c9", embedding_blob=encode_embedding(vector), importance_score=5)
+    db.add(memory)
+    db.commit()
+    memory_id = memory.id
+    db.close()
+    hits = _search(client, headers, vector, contact_id="c9")
+    assert [hit["id"] for hit in hits] == [memory_id]
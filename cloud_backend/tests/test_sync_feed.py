@@ -0,0 +1,52 @@
+"""删除和恢复通过变更日志送达其他设备"""
+from test_sync_pull import pull, push
+
+
+def _setup(client, headers, prefix: str) -> int:
+    """手机创建会话和两条消息，平板同步到当前位置，返回平板的 next_seq"""
+    push(client, headers, "phone",
+         ("upsert_conversation", {"id": f"{prefix}-c1", "title": "t", "display_name": "d"}),
+         ("append_message", {"id": f"{prefix}-m1", "conversation_id": f"{prefix}-c1", "role": "user", "content": "a"}),
+         ("append_message", {"id": f"{prefix}-m2", "conversation_id": f"{prefix}-c1", "role": "user", "content": "b"}))
+    page = pull(client, headers, device_id="tablet")
+    assert [c["id"] for c in page["conversations"]] == [f"{prefix}-c1"]
+    return page["next_seq"]
+
+
+def test_conversation_delete_reaches_other_device(client, make_user):
+    _, headers = make_user()
+    since = _setup(client, headers, "del")
+
+    push(client, headers, "phone", ("delete", {"type": "conversation", "id": "del-c1"}))
+
+    page = pull(client, headers, device_id="tablet", since_seq=since)
+    assert [(c["id"], c["deleted_at"] is not None) for c in page["conversations"]] == [("del-c1", True)]
+    # 会话下的消息随之删除，也要送达
+    assert sorted((m["id"], m["deleted_at"] is not None) for m in page["messages"]) == [
+        ("del-m1", True), ("del-m2", True)
+    ]
+
+
+def test_message_delete_reaches_other_device(client, make_user):
+    _, headers = make_user()
+    since = _setup(client, headers, "msg")
+
+    push(client, headers, "phone", ("delete", {"type": "message", "id": "msg-m1"}))
+
+    page = pull(client, headers, device_id="tablet", since_seq=since)
+    assert [(m["id"], m["deleted_at"] is not None) for m in page["messages"]] == [("msg-m1", True)]
+
+
+def test_conversation_restore_reaches_other_device(client, make_user):
+    _, headers = make_user()
+    _setup(client, headers, "res")
+    push(client, headers, "phone", ("delete", {"type": "conversation", "id": "res-c1"}))
+    since = pull(client, headers, device_id="tablet")["next_seq"]
+
+    push(client, headers, "phone", ("restore", {"type": "conversation", "id": "res-c1"}))
+
+    page = pull(client, headers, device_id="tablet", since_seq=since)
+    assert [(c["id"], c["deleted_at"]) for c in page["conversations"]] == [("res-c1", None)]
+    assert sorted((m["id"], m["deleted_at"]) for m in page["messages"]) == [
+        ("res-m1", None), ("res-m2", None)
+    ]
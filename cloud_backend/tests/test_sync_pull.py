@@ -0,0 +1,74 @@
+"""/v2/pull 同步位置与本设备变更回传"""
+import itertools
+
+_op_ids = itertools.count(1)
+
+
+def push(client, headers, device_id, *operations):
+    response = client.post("/api/v1/sync/v2/push", headers=headers, json={"operations": [
+        {"op_id": f"op{next(_op_ids)}", "device_id": device_id, "op_type": op_type, "data": data}
+        for op_type, data in operations
+    ]})
+    assert response.status_code == 200
+    return response.json()
+
+
+def pull(client, headers, **params):
+    response = client.get("/api/v1/sync/v2/pull", headers=headers, params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_explicit_zero_since_is_legacy_full_sync(client, make_user):
+    _, headers = make_user()
+    push(client, headers, "phone",
+         ("upsert_conversation", {"id": "legacy-c1", "title": "t", "display_name": "d"}))
+
+    page = pull(client, headers, device_id="phone",
+                conversations_since=0, messages_since=0, providers_since=0)
+
+    assert "cursors" in page and "next_seq" not in page
+    assert [c["id"] for c in page["conversations"]] == ["legacy-c1"]
+
+
+def test_device_id_only_resumes_by_sequence(client, make_user):
+    _, headers = make_user()
+    page = pull(client, headers, device_id="phone")
+    assert "next_seq" in page and "cursors" not in page
+
+
+def test_reinstalled_device_recovers_own_changes(client, make_user):
+    _, headers = make_user()
+    push(client, headers, "phone",
+         ("upsert_conversation", {"id": "own-c1", "title": "t", "display_name": "d"}),
+         ("append_message", {"id": "own-m1", "conversation_id": "own-c1", "role": "user", "content": "hi"}))
+
+    # 同一 device_id 重装：没有 ack 过，从 0 续传，应取回自己推送过的数据
+    page = pull(client, headers, device_id="phone")
+    assert [c["id"] for c in page["conversations"]] == ["own-c1"]
+    assert [m["id"] for m in page["messages"]] == ["own-m1"]
+
+    # 已经同步过的设备继续增量拉取时，不回传自己刚推送的变更
+    since = page["next_seq"]
+    push(client, headers, "phone",
+         ("append_message", {"id": "own-m2", "conversation_id": "own-c1", "role": "user", "content": "again"}))
+    page = pull(client, headers, device_id="phone", since_seq=since)
+    assert page["messages"] == []
+    assert page["next_seq"] > since
+
+
+def test_own_write_does_not_hide_other_device_change(client, make_user):
+    _, headers = make_user()
+    push(client, headers, "phone",
+         ("upsert_conversation", {"id": "shared-c1", "title": "t", "display_name": "old"}))
+    since = pull(client, headers, device_id="phone")["next_seq"]
+
+    # 平板改名后，手机向同一会话追加消息（会话的变更行被手机的写入覆盖）
+    push(client, headers, "tablet",
+         ("upsert_conversation", {"id": "shared-c1", "title": "t", "display_name": "renamed"}))
+    push(client, headers, "phone",
+         ("append_message", {"id": "shared-m1", "conversation_id": "shared-c1", "role": "user", "content": "hi"}))
+
+    page = pull(client, headers, device_id="phone", since_seq=since)
+    assert [c["display_name"] for c in page["conversations"]] == ["renamed"]
+    assert page["messages"] == []
@@ -0,0 +1,87 @@
+"""/v2/pull 每页的 SQL 语句数不随数据量增长（blocks 批量加载，没有 N+1）"""
+import itertools
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from database import SessionLocal, engine
+from models import Conversation, MessageBlock, SyncMessage
+from sync_api_v2 import _pull_page
+
+_ids = itertools.count(1)
+
+
+def seed(user_id: int, conversations: int, messages_per_conversation: int):
+    db = SessionLocal()
+    ts = 1000
+    for _ in range(conversations):
+        conv_id = f"qc{next(_ids)}"
+        ts += 1
+        db.add(Conversation(id=conv_id, user_id=user_id, title="t", display_name="d", created_at=ts, updated_at=ts))
+        for _ in range(messages_per_conversation):
+            msg_id = f"qm{next(_ids)}"
+            ts += 1
+            db.add(SyncMessage(id=msg_id, user_id=user_id, conversation_id=conv_id, role="user",
+                               content="x", created_at=ts))
+            for order in range(2):
+                db.add(MessageBlock(id=f"qb{next(_ids)}", message_id=msg_id, type="text",
+                                    data="{}", sort_order=order, created_at=ts))
+    db.commit()
+    db.close()
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def pull_page_statements(user_id: int) -> int:
+    cursors = {"conversations": (0, None), "messages": (0, None), "providers": (0, None)}
+    db = SessionLocal()
+    try:
+        with count_statements() as statements:
+            page = _pull_page(db, user_id, ["chat.history", "providers.config"], cursors, True, 100)
+        assert all(len(m["blocks"]) == 2 for m in page["messages"])
+        return len(statements)
+    finally:
+        db.close()
+
+
+def pull_request_statements(client, headers, **params) -> int:
+    with count_statements() as statements:
+        response = client.get("/api/v1/sync/v2/pull", headers=headers, params={"device_id": "d", **params})
+    assert response.status_code == 200
+    assert response.json()["messages"]
+    return len(statements)
+
+
+def test_pull_page_statement_count_is_constant(make_user):
+    small, _ = make_user()
+    large, _ = make_user()
+    seed(small, conversations=2, messages_per_conversation=2)
+    seed(large, conversations=20, messages_per_conversation=4)
+
+    assert pull_page_statements(small) == pull_page_statements(large)
+
+
+def test_pull_request_statement_count_is_constant(client, make_user):
+    small, small_headers = make_user()
+    large, large_headers = make_user()
+    seed(small, conversations=2, messages_per_conversation=2)
+    seed(large, conversations=20, messages_per_conversation=4)
+
+    for params in ({"conversations_since": 0, "messages_since": 0, "providers_since": 0}, {"since_seq": 0}):
+        # 先各请求一次，排除认证缓存、首次回填变更日志等一次性开销
+        pull_request_statements(client, small_headers, **params)
+        pull_request_statements(client, large_headers, **params)
+        assert (pull_request_statements(client, small_headers, **params)
+                == pull_request_statements(client, large_headers, **params))
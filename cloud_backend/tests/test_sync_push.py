@@ -0,0 +1,44 @@
+"""/v2/push：单个操作失败只回滚该操作"""
+from database import SessionLocal
+from models import Conversation, SyncMessage
+from test_sync_pull import pull, push
+
+
+def _message(msg_id: str, conv_id: str, content: str, blocks=None) -> tuple:
+    data = {"id": msg_id, "conversation_id": conv_id, "role": "user", "content": content}
+    if blocks:
+        data["blocks"] = blocks
+    return "append_message", data
+
+
+def test_failed_operation_does_not_roll_back_batch(client, make_user):
+    user_id, headers = make_user()
+    push(client, headers, "phone",
+         ("upsert_conversation", {"id": "iso-c1", "title": "t", "display_name": "d"}),
+         _message("iso-m1", "iso-c1", "first", [{"id": "iso-b1", "type": "text", "data": {}}]))
+    since = pull(client, headers, device_id="tablet")["next_seq"]
+
+    # 第二个操作的 block 主键重复，到 flush 时才失败
+    response = push(client, headers, "phone",
+                    _message("iso-m2", "iso-c1", "second"),
+                    _message("iso-m3", "iso-c1", "dup", [{"id": "iso-b1", "type": "text", "data": {}}]),
+                    _message("iso-m4", "iso-c1", "fourth"),
+                    ("upsert_conversation", {"id": "iso-c2", "title": "t", "display_name": "d"}))
+
+    assert [r["status"] for r in response["results"]] == ["success", "error", "success", "success"]
+    assert [r["result"]["id"] for r in response["results"] if r["status"] == "success"] == [
+        "iso-m2", "iso-m4", "iso-c2"
+    ]
+
+    db = SessionLocal()
+    try:
+        stored = {m.id for m in db.query(SyncMessage).filter(SyncMessage.user_id == user_id)}
+        assert stored == {"iso-m1", "iso-m2", "iso-m4"}
+        # 失败操作对会话摘要的修改也一并回滚
+        assert db.get(Conversation, "iso-c1").last_message == "fourth"
+    finally:
+        db.close()
+
+    page = pull(client, headers, device_id="tablet", since_seq=since)
+    assert sorted(m["id"] for m in page["messages"]) == ["iso-m2", "iso-m4"]
+    assert sorted(c["id"] for c in page["conversations"]) == ["iso-c1", "iso-c2"]
@@ -0,0 +1,49 @@
+"""WebSocket 同步通道：push -> push_result、变更实时下发、ack、非法帧不断开连接"""
+from auth import create_access_token
+from test_sync_pull import push
+
+
+def _connect(client, user_id: int, device_id: str, since_seq: int):
+    token = create_access_token({"sub": str(user_id)})
+    return client.websocket_connect(
+        f"/api/v1/sync/v2/ws?device_id={device_id}&token={token}&since_seq={since_seq}"
+    )
+
+
+def test_push_changes_and_ack(client, make_user):
+    user_id, headers = make_user()
+    # 从非 0 位置建连：从 0 开始时积压部分会回传本设备的变更，与实时下发的时序有竞争
+    since = push(client, headers, "phone",
+                 ("upsert_conversation", {"id": "ws-c0", "title": "t", "display_name": "d"}))["last_seq"]
+    with _connect(client, user_id, "phone", since) as phone, _connect(client, user_id, "tablet", since) as tablet:
+        # 不是对象的合法 JSON 返回错误帧，连接保持可用
+        for raw in ("[]", "1", "not json"):
+            phone.send_text(raw)
+            assert phone.receive_json()["type"] == "error"
+
+        phone.send_json({"type": "push", "id": "f1", "operations": [
+            {"op_id": "ws-op1", "device_id": "phone", "op_type": "upsert_conversation",
+             "data": {"id": "ws-c1", "title": "t", "display_name": "d"}},
+        ]})
+        result = phone.receive_json()
+        assert result["type"] == "push_result" and result["id"] == "f1"
+        assert [r["status"] for r in result["results"]] == ["success"]
+        assert result["last_seq"] > 0
+
+        # 另一台设备实时收到变更
+        changes = tablet.receive_json()
+        assert changes["type"] == "changes"
+        assert [c["id"] for c in changes["conversations"]] == ["ws-c1"]
+        assert changes["next_seq"] == result["last_seq"]
+
+        # 推送方自己的变更不回传，只推进序列号
+        own = phone.receive_json()
+        assert own["type"] == "changes" and own["conversations"] == []
+        assert own["next_seq"] == result["last_seq"]
+
+        tablet.send_json({"type": "ack", "seq": changes["next_seq"]})
+        ack = tablet.receive_json()
+        assert ack["type"] == "ack_result" and ack["acked_seq"] == changes["next_seq"]
+
+        phone.send_json({"type": "ping"})
+        assert phone.receive_json()["type"] == "pong"
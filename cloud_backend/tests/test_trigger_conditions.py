@@ -0,0 +1,74 @@
+"""条件触发器：额度写入后重新评估，每次由不满足变为满足只触发一次"""
+import itertools
+import time
+
+from database import SessionLocal
+from models import TriggerExecutionLog, UserQuota
+from trigger_conditions import condition_engine
+from test_trigger_engine import create_trigger
+
+_providers = itertools.count(1)
+
+
+def _fire_count(trigger_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(TriggerExecutionLog).filter(TriggerExecutionLog.trigger_id == trigger_id).count()
+    finally:
+        db.close()
+
+
+def _settle(trigger_id: int, expected: int):
+    """等评估窗口和执行结束，再多等几个窗口确认没有多余的触发"""
+    deadline = time.time() + 5
+    while _fire_count(trigger_id) < expected and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(condition_engine.window * 3)
+    assert _fire_count(trigger_id) == expected
+
+
+def test_quota_low_fires_once_per_transition(client, make_user):
+    _, admin_headers = make_user(admin=True)
+    user_id, headers = make_user(level=3)
+    provider = f"provider{next(_providers)}"
+
+    def assign(total: int):
+        response = client.post("/api/v1/keys/admin/assign", headers=admin_headers, json={
+            "user_id": user_id, "provider": provider, "quota_total": total
+        })
+        assert response.status_code == 200
+
+    def use(amount: int):
+        """逐次提交 ORM 写入，模拟用量累加（每次一个事务）"""
+        db = SessionLocal()
+        try:
+            for _ in range(amount):
+                quota = db.query(UserQuota).filter(
+                    UserQuota.user_id == user_id, UserQuota.provider == provider
+                ).one()
+                quota.quota_used = (quota.quota_used or 0) + 1
+                db.commit()
+        finally:
+            db.close()
+
+    assign(10)
+    trigger_id = create_trigger(
+        client, headers, trigger_type="condition",
+        trigger_config={"condition_type": "quota_low", "provider": provider, "threshold": 5}
+    )
+    # 创建后的首次评估只记录状态（剩余 10，不满足）
+    _settle(trigger_id, 0)
+
+    # 一个窗口内多次写入：剩余 10 -> 3，跨过阈值一次
+    use(7)
+    _settle(trigger_id, 1)
+
+    # 已满足时继续写入不再触发
+    use(2)
+    _settle(trigger_id, 1)
+
+    # 管理员追加额度恢复为不满足（剩余 11），再次跌破阈值（剩余 4）时触发第二次
+    assign(20)
+    _settle(trigger_id, 1)
+    use(7)
+    _settle(trigger_id, 2)
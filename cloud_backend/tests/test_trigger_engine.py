@@ -0,0 +1,38 @@
+"""触发器执行"""
+from datetime import datetime, timezone
+
+from database import SessionLocal
+from models import CloudTrigger, TriggerExecutionLog
+from trigger_engine import execute_trigger
+
+
+def create_trigger(client, headers, **fields) -> int:
+    response = client.post("/api/v1/triggers/create", headers=headers, json={
+        "trigger_name": "t",
+        "action_config": {"action_type": "notification", "params": {"message": "hello"}},
+        **fields,
+    })
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def test_execution_does_not_touch_updated_at(client, make_user):
+    _, headers = make_user(level=3)
+    trigger_id = create_trigger(client, headers, trigger_type="schedule", trigger_config={"cron": "0 0 1 1 *"})
+    # 放到过去，避免和执行时的 now() 落在同一秒
+    updated_at = datetime(2020, 1, 1)
+    db = SessionLocal()
+    db.query(CloudTrigger).filter(CloudTrigger.id == trigger_id).update({CloudTrigger.updated_at: updated_at})
+    db.commit()
+    db.close()
+
+    fired_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    assert execute_trigger(trigger_id, fired_at) == "success"
+
+    db = SessionLocal()
+    trigger = db.get(CloudTrigger, trigger_id)
+    assert trigger.updated_at == updated_at
+    assert trigger.last_triggered_at.replace(tzinfo=timezone.utc) == fired_at
+    logs = db.query(TriggerExecutionLog).filter(TriggerExecutionLog.trigger_id == trigger_id).all()
+    assert [(log.status, log.result_message) for log in logs] == [("success", "hello")]
+    db.close()
@@ -12,8 +12,12 @@ from pydantic import BaseModel, Field
 import json
 
 from database import get_db
-from auth import get_current_user
+from auth import get_current_user, get_current_principal, UserPrincipal
 from models import User, CloudTrigger, TriggerExecutionLog
+from trigger_cron import CronError, parse_schedule
+from trigger_engine import scheduler
+from trigger_events import event_bus
+from trigger_conditions import condition_engine, validate_condition
 
 router = APIRouter()
 
@@ -77,7 +81,7 @@ class TriggerStats(BaseModel):
 
 # ============ Helper Functions ============
 
-def check_user_level(user: User, required_level: int):
+def check_user_level(user: UserPrincipal, required_level: int):
     """检查用户等级是否满足要求"""
     if user.user_level < required_level:
         raise HTTPException(
@@ -86,7 +90,7 @@ def check_user_level(user: User, required_level: int):
         )
 
 
-def check_membership_expiry(user: User):
+def check_membership_expiry(user: UserPrincipal):
     """检查会员是否过期"""
     if user.expires_at and datetime.now(timezone.utc) > user.expires_at:
         raise HTTPException(
@@ -95,6 +99,19 @@ def check_membership_expiry(user: User):
         )
 
 
+def _sync_engines(trigger: CloudTrigger):
+    """把触发器的修改同步给本进程的定时调度、事件分发和条件评估"""
+    scheduler.sync_trigger(trigger)
+    event_bus.sync_trigger(trigger)
+    condition_engine.sync_trigger(trigger)
+
+
+def _remove_from_engines(trigger_id: int):
+    scheduler.remove(trigger_id)
+    event_bus.remove(trigger_id)
+    condition_engine.remove(trigger_id)
+
+
 def validate_trigger_type(trigger_type: str):
     """验证触发器类型"""
     valid_types = ["schedule", "event", "condition"]
@@ -113,6 +130,13 @@ def validate_trigger_config(trigger_type: str, config: Dict[str, Any]):
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="定时触发器需要提供 cron 表达式"
             )
+        try:
+            parse_schedule(config)
+        except CronError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"无效的定时配置: {e}"
+            )
     elif trigger_type == "event":
         if "event_type" not in config:
             raise HTTPException(
@@ -125,6 +149,13 @@ def validate_trigger_config(trigger_type: str, config: Dict[str, Any]):
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="条件触发器需要提供 condition_type"
             )
+        try:
+            validate_condition(config)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"无效的条件配置: {e}"
+            )
 
 
 def validate_action_config(config: Dict[str, Any]):
@@ -142,6 +173,7 @@ def validate_action_config(config: Dict[str, Any]):
 async def create_trigger(
     trigger_data: TriggerCreate,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -149,10 +181,6 @@ async def create_trigger(
     - 需要 Level 3+ 权限
     - 支持三种触发类型：schedule（定时）、event（事件）、condition（条件）
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
     check_membership_expiry(user)
 
@@ -174,6 +202,7 @@ async def create_trigger(
     db.add(new_trigger)
     db.commit()
     db.refresh(new_trigger)
+    _sync_engines(new_trigger)
 
     return TriggerInfo(**new_trigger.to_dict())
 
@@ -185,16 +214,13 @@ async def list_triggers(
     skip: int = 0,
     limit: int = 50,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     获取用户的触发器列表
     - 可按类型和状态筛选
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
 
     query = db.query(CloudTrigger).filter(CloudTrigger.user_id == user_id)
@@ -213,13 +239,10 @@ async def list_triggers(
 async def get_trigger(
     trigger_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """获取触发器详情"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
 
     trigger = db.query(CloudTrigger).filter(
@@ -238,15 +261,12 @@ async def update_trigger(
     trigger_id: int,
     trigger_update: TriggerUpdate,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     更新触发器配置
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
     check_membership_expiry(user)
 
@@ -275,6 +295,7 @@ async def update_trigger(
 
     db.commit()
     db.refresh(trigger)
+    _sync_engines(trigger)
 
     return TriggerInfo(**trigger.to_dict())
 
@@ -283,13 +304,10 @@ async def update_trigger(
 async def delete_trigger(
     trigger_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """删除触发器"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
 
     trigger = db.query(CloudTrigger).filter(
@@ -302,6 +320,7 @@ async def delete_trigger(
 
     db.delete(trigger)
     db.commit()
+    _remove_from_engines(trigger_id)
 
     return None
 
@@ -310,15 +329,12 @@ async def delete_trigger(
 async def toggle_trigger(
     trigger_id: int,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     切换触发器启用/禁用状态
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
 
     trigger = db.query(CloudTrigger).filter(
@@ -332,6 +348,7 @@ async def toggle_trigger(
     trigger.is_active = not trigger.is_active
     db.commit()
     db.refresh(trigger)
+    _sync_engines(trigger)
 
     return TriggerInfo(**trigger.to_dict())
 
@@ -342,15 +359,12 @@ async def get_trigger_logs(
     skip: int = 0,
     limit: int = 50,
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     获取触发器执行日志
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
 
     # 验证触发器所属
@@ -374,15 +388,12 @@ async def get_trigger_logs(
 @router.get("/stats/my", response_model=TriggerStats)
 async def get_my_trigger_stats(
     user_id: int = Depends(get_current_user),
+    user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     获取当前用户的触发器统计信息
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-
     check_user_level(user, 3)
 
     # 触发器统计
@@ -424,12 +435,12 @@ async def get_my_trigger_stats(
 @router.get("/admin/overview", response_model=dict)
 async def get_triggers_overview(
     user_id: int = Depends(get_current_user),
+    admin: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     管理员：获取所有触发器的概览统计
     """
-    admin = db.query(User).filter(User.id == user_id).first()
     if not admin or admin.user_level != 99:
         raise HTTPException(status_code=403, detail="需要管理员权限")
 
@@ -458,7 +469,10 @@ async def get_triggers_overview(
         "active_triggers": active_triggers,
         "trigger_types": {stat.trigger_type: stat.count for stat in type_stats},
         "total_executions": total_executions,
-        "execution_status": {stat.status: stat.count for stat in execution_stats}
+        "execution_status": {stat.status: stat.count for stat in execution_stats},
+        "scheduler": scheduler.stats(),
+        "events": event_bus.stats(),
+        "conditions": condition_engine.stats()
     }
 
 
@@ -466,12 +480,12 @@ async def get_triggers_overview(
 async def get_user_triggers_by_admin(
     unique_id: str,
     user_id: int = Depends(get_current_user),
+    admin: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     管理员：查看指定用户的所有触发器
     """
-    admin = db.query(User).filter(User.id == user_id).first()
     if not admin or admin.user_level != 99:
         raise HTTPException(status_code=403, detail="需要管理员权限")
 
@@ -0,0 +1,292 @@
+"""条件触发器评估
+
+不定时轮询全部条件触发器，而是在条件依赖的数据变化时才重新评估：
+- CONDITIONS 按 condition_type 注册：依赖的表、批量读取状态的 load、判断条件的 check
+- 依赖表的 ORM 写入提交后（after_commit），把 (condition_type, user_id) 交给 ConditionEngine；
+  没有该类条件触发器的用户在提交线程里直接跳过
+- 变化先记入待评估集合，每 TRIGGER_CONDITION_WINDOW 秒合并评估一次：同一用户在窗口内
+  无论写入多少次都只评估一次，同一类条件的所有用户一次查询读出
+- 条件由不满足变为满足时触发一次；触发器创建、修改或加载时只记录当前状态，不触发
+
+条件状态只在写入发生的进程内评估和记录，与事件触发器一样每个 worker 进程都维护自己的索引。
+绕过 ORM 的写入（Core update 等）需要自行调用 condition_engine.notify_threadsafe
+"""
+import asyncio
+import itertools
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import UserQuota
+from trigger_engine import CHECK_INTERVAL, TriggerExecutor, TriggerIndex, executor
+
+# 合并评估的窗口（秒）
+EVALUATE_WINDOW = float(os.getenv("TRIGGER_CONDITION_WINDOW", "5"))
+# 批量读取状态时 IN 查询的分块大小
+LOAD_CHUNK_SIZE = 500
+
+
+# ============ 条件 ============
+
+class Condition(NamedTuple):
+    model: type  # 状态所在的表，该表的 ORM 写入会触发重新评估（需要有 user_id 列）
+    load: Callable[[Session, List[int]], Dict[int, Any]]  # 批量读取用户的当前状态
+    check: Callable[[Any, dict], Optional[dict]]  # 条件满足时返回写入执行上下文的详情，否则返回 None
+    validate: Callable[[dict], None]  # 校验触发器配置，不合法时抛出 ValueError
+
+
+# condition_type -> Condition
+CONDITIONS: Dict[str, Condition] = {}
+
+
+def _load_quotas(db: Session, user_ids: List[int]) -> Dict[int, list]:
+    states: Dict[int, list] = {}
+    rows = db.query(
+        UserQuota.user_id, UserQuota.provider, UserQuota.quota_total, UserQuota.quota_used
+    ).filter(UserQuota.user_id.in_(user_ids), UserQuota.is_active == True).all()
+    for user_id, provider, total, used in rows:
+        states.setdefault(user_id, []).append((provider, (total or 0) - (used or 0)))
+    return states
+
+
+def _check_quota_low(quotas: Optional[list], config: dict) -> Optional[dict]:
+    """任一（或指定 provider 的）启用额度的剩余量低于 threshold 时满足"""
+    provider = config.get("provider")
+    low = [
+        {"provider": name, "quota_remaining": remaining}
+        for name, remaining in quotas or ()
+        if (provider is None or name == provider) and remaining < config["threshold"]
+    ]
+    return {"quotas": low} if low else None
+
+
+def _validate_quota_low(config: dict):
+    threshold = config.get("threshold")
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+        raise ValueError("quota_low 需要提供数值类型的 threshold")
+
+
+# 目前写入 UserQuota 的只有管理员分配额度（ORM）；用量扣减接入时同样要走 ORM 或自行调用 notify_threadsafe
+CONDITIONS["quota_low"] = Condition(UserQuota, _load_quotas, _check_quota_low, _validate_quota_low)
+
+
+def validate_condition(config: dict):
+    """校验条件触发器配置（trigger_api 创建/修改时调用），不合法时抛出 ValueError"""
+    condition = CONDITIONS.get(config.get("condition_type"))
+    if condition is None:
+        raise ValueError(f"不支持的条件类型，支持的类型: {', '.join(CONDITIONS)}")
+    condition.validate(config)
+
+
+# ============ 评估引擎 ============
+
+class _ConditionEntry(NamedTuple):
+    user_id: int
+    condition_type: str
+    config: dict
+    raw_config: str
+
+
+_PendingKey = Tuple[str, int]  # (condition_type, user_id)
+
+
+class ConditionEngine(TriggerIndex):
+    """条件触发器索引 + 合并窗口评估"""
+
+    trigger_type = "condition"
+    label = "条件触发器"
+
+    def __init__(self, executor: TriggerExecutor, window: float = EVALUATE_WINDOW,
+                 check_interval: float = CHECK_INTERVAL):
+        super().__init__(check_interval)
+        self.executor = executor
+        self.window = window
+        self.evaluations = 0
+        self.fired = 0
+        self._entries: Dict[int, _ConditionEntry] = {}
+        self._by_user: Dict[_PendingKey, Set[int]] = {}
+        self._states: Dict[int, bool] = {}  # trigger_id -> 上次评估时条件是否满足
+        self._baseline: Set[int] = set()  # 新加入、下次评估只记录状态的触发器
+        self._pending: Set[_PendingKey] = set()
+        self._dirty: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._dirty = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._sync_forever()),
+            asyncio.create_task(self._evaluate_forever()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._loop = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def sync_trigger(self, trigger):
+        """触发器创建/修改后调用；非条件或已停用的会被移出索引"""
+        if not self._tasks:
+            return
+        if trigger.trigger_type != self.trigger_type or not trigger.is_active:
+            self.remove(trigger.id)
+            return
+        entry = self._entries.get(trigger.id)
+        if entry is not None and entry.raw_config == trigger.trigger_config:
+            return
+        self.remove(trigger.id)
+        try:
+            config = json.loads(trigger.trigger_config)
+            validate_condition(config)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"⚠️ 条件触发器 {trigger.id} 配置无效，已跳过: {e}")
+            return
+
+        key = (config["condition_type"], trigger.user_id)
+        self._entries[trigger.id] = _ConditionEntry(
+            trigger.user_id, config["condition_type"], config, trigger.trigger_config
+        )
+        self._by_user.setdefault(key, set()).add(trigger.id)
+        self._baseline.add(trigger.id)
+        self.notify([key])
+
+    def remove(self, trigger_id: int):
+        entry = self._entries.pop(trigger_id, None)
+        if entry is None:
+            return
+        key = (entry.condition_type, entry.user_id)
+        self._by_user[key].discard(trigger_id)
+        if not self._by_user[key]:
+            del self._by_user[key]
+        self._states.pop(trigger_id, None)
+        self._baseline.discard(trigger_id)
+
+    def notify(self, keys: Iterable[_PendingKey]):
+        """记录需要重新评估的 (condition_type, user_id)（只能在事件循环线程中调用）"""
+        keys = [key for key in keys if key in self._by_user]
+        if keys and self._dirty is not None:
+            self._pending.update(keys)
+            self._dirty.set()
+
+    def notify_threadsafe(self, keys: Iterable[_PendingKey]):
+        """在任意线程中通知状态变化；没有对应条件触发器的用户直接跳过"""
+        keys = [key for key in keys if key in self._by_user]
+        if keys and self._loop is not None:
+            self._loop.call_soon_threadsafe(self.notify, keys)
+
+    @staticmethod
+    def _load_states(pending: Set[_PendingKey]) -> Dict[str, Dict[int, Any]]:
+        """按条件类型分组批量读取状态"""
+        user_ids: Dict[str, List[int]] = {}
+        for condition_type, user_id in pending:
+            user_ids.setdefault(condition_type, []).append(user_id)
+
+        db = SessionLocal()
+        try:
+            states: Dict[str, Dict[int, Any]] = {}
+            for condition_type, ids in user_ids.items():
+                load = CONDITIONS[condition_type].load
+                states[condition_type] = {}
+                for start in range(0, len(ids), LOAD_CHUNK_SIZE):
+                    states[condition_type].update(load(db, ids[start:start + LOAD_CHUNK_SIZE]))
+            return states
+        finally:
+            db.close()
+
+    def _apply(self, pending: Set[_PendingKey], states: Dict[str, Dict[int, Any]]):
+        fired_at = datetime.now(timezone.utc)
+        for condition_type, user_id in pending:
+            check = CONDITIONS[condition_type].check
+            state = states[condition_type].get(user_id)
+            for trigger_id in self._by_user.get((condition_type, user_id), ()):
+                self.evaluations += 1
+                detail = check(state, self._entries[trigger_id].config)
+                was_met = self._states.get(trigger_id, False)
+                self._states[trigger_id] = detail is not None
+                if trigger_id in self._baseline:
+                    self._baseline.discard(trigger_id)
+                    continue
+                if detail is None or was_met:
+                    continue
+                context = {"condition_type": condition_type, **detail}
+                if self.executor.submit_nowait(trigger_id, fired_at, context, self.remove):
+                    self.fired += 1
+
+    async def _evaluate_forever(self):
+        while True:
+            await self._dirty.wait()
+            # 等满一个窗口，把窗口内的所有变化合并成一次评估
+            await asyncio.sleep(self.window)
+            self._dirty.clear()
+            pending, self._pending = self._pending, set()
+            try:
+                states = await asyncio.to_thread(self._load_states, pending)
+            except Exception as e:
+                print(f"⚠️ 条件触发器评估失败: {e}")
+                # 放回待评估集合，下个窗口重试
+                self._pending |= pending
+                self._dirty.set()
+                continue
+            self._apply(pending, states)
+
+    def stats(self) -> dict:
+        return {
+            "condition_triggers": len(self._entries),
+            "pending": len(self._pending),
+            "evaluations": self.evaluations,
+            "conditions_fired": self.fired,
+        }
+
+
+# 进程级单例
+condition_engine = ConditionEngine(executor)
+
+
+# ============ 数据变化通知 ============
+
+# 表 -> 依赖它的条件类型
+_WATCHED_MODELS: Dict[type, List[str]] = {}
+for _condition_type, _condition in CONDITIONS.items():
+    _WATCHED_MODELS.setdefault(_condition.model, []).append(_condition_type)
+
+_CHANGED_KEY = "trigger_condition_changes"
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _track_condition_changes(session: Session, flush_context):
+    """记录本事务写入过的 (condition_type, user_id)，提交后再通知，回滚的写入不会触发评估"""
+    if len(condition_engine) == 0:
+        return
+    changed = session.info.setdefault(_CHANGED_KEY, set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        for condition_type in _WATCHED_MODELS.get(type(obj), ()):
+            if obj.user_id is not None:
+                changed.add((condition_type, obj.user_id))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_condition_changes(session: Session):
+    changed = session.info.pop(_CHANGED_KEY, None)
+    if changed:
+        condition_engine.notify_threadsafe(changed)
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_condition_changes(session: Session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_CHANGED_KEY, None)
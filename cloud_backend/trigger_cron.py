@@ -0,0 +1,140 @@
+"""定时触发器的 cron 表达式解析
+
+支持标准 5 段格式：分 时 日 月 周
+- 每段可用 *、数字、a-b 范围、/n 步长和逗号列表，月和周也可用英文缩写（jan、mon）
+- 周的 0 和 7 都表示周日
+- 日和周都不是 * 时按 cron 惯例取"或"：满足其一即可
+时间按触发器配置的时区（IANA 名称，默认 UTC）计算，夏令时跳过的时刻按 zoneinfo 的规则换算
+"""
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+_MONTH_NAMES = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+_WEEKDAY_NAMES = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+# 找不到下一个触发时刻时（如 2 月 30 日）最多向后查找的年数
+_MAX_SEARCH_YEARS = 5
+
+
+class CronError(ValueError):
+    """cron 表达式或时区不合法"""
+
+
+def _parse_value(token: str, names: Optional[List[str]], offset: int) -> int:
+    token = token.lower()
+    if names and token in names:
+        return names.index(token) + offset
+    if not token.isdigit():
+        raise CronError(f"无法识别的取值: {token}")
+    return int(token)
+
+
+def _parse_field(field: str, low: int, high: int, names: Optional[List[str]] = None,
+                 name_offset: int = 0) -> List[int]:
+    """解析一段，返回升序的取值列表"""
+    values = set()
+    for part in field.split(","):
+        expression, _, step_text = part.partition("/")
+        step = 1
+        if step_text:
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise CronError(f"无效的步长: {part}")
+            step = int(step_text)
+
+        if expression == "*":
+            start, end = low, high
+        elif "-" in expression:
+            start_text, end_text = expression.split("-", 1)
+            start = _parse_value(start_text, names, name_offset)
+            end = _parse_value(end_text, names, name_offset)
+        else:
+            start = _parse_value(expression, names, name_offset)
+            # "5/15" 表示从 5 开始每 15 个单位
+            end = high if step_text else start
+
+        if not low <= start <= end <= high:
+            raise CronError(f"取值超出范围 {low}-{high}: {part}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronSchedule:
+    """解析后的 cron 表达式，next_after 计算下一个触发时刻"""
+
+    def __init__(self, expression: str, tz_name: Optional[str] = None):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise CronError("cron 表达式需要 5 段：分 时 日 月 周")
+        try:
+            self.tz = ZoneInfo(tz_name) if tz_name else timezone.utc
+        except (ZoneInfoNotFoundError, ValueError):
+            raise CronError(f"未知的时区: {tz_name}")
+
+        self.expression = expression
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, _MONTH_NAMES, 1)
+        weekdays = _parse_field(fields[4], 0, 7, _WEEKDAY_NAMES, 0)
+        # cron 的周日是 0（或 7），转换为 Python 的 weekday()：周一 0 … 周日 6
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, local: datetime) -> bool:
+        day_ok = local.day in self.days
+        weekday_ok = local.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        """严格晚于 after 的下一个触发时刻（UTC）；表达式永远不会触发时返回 None"""
+        if after.tzinfo is None:
+            after = after.replace(tzinfo=timezone.utc)
+        # 在本地墙上时间里逐级跳到下一个匹配的 月 → 日 → 时 → 分
+        local = after.astimezone(self.tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        limit = local.year + _MAX_SEARCH_YEARS
+
+        while local.year <= limit:
+            if local.month not in self.months:
+                index = bisect_left(self.months, local.month)
+                if index == len(self.months):
+                    local = datetime(local.year + 1, self.months[0], 1)
+                else:
+                    local = datetime(local.year, self.months[index], 1)
+                continue
+            if not self._day_matches(local):
+                local = datetime(local.year, local.month, local.day) + timedelta(days=1)
+                continue
+            if local.hour not in self.hours:
+                index = bisect_left(self.hours, local.hour)
+                if index == len(self.hours):
+                    local = datetime(local.year, local.month, local.day) + timedelta(days=1)
+                else:
+                    local = local.replace(hour=self.hours[index], minute=0)
+                continue
+            if local.minute not in self.minutes:
+                index = bisect_left(self.minutes, local.minute)
+                if index == len(self.minutes):
+                    local = local.replace(minute=0) + timedelta(hours=1)
+                else:
+                    local = local.replace(minute=self.minutes[index])
+                continue
+
+            fire_at = local.replace(tzinfo=self.tz).astimezone(timezone.utc)
+            # 夏令时回拨时同一墙上时间出现两次、跳过的时刻换算后可能早于 after，继续向后找
+            if fire_at > after:
+                return fire_at
+            local += timedelta(minutes=1)
+        return None
+
+
+def parse_schedule(config: dict) -> CronSchedule:
+    """从定时触发器的 trigger_config（{"cron": ..., "timezone": ...}）构建"""
+    expression = config.get("cron")
+    if not isinstance(expression, str):
+        raise CronError("定时触发器需要提供 cron 表达式")
+    return CronSchedule(expression, config.get("timezone"))
@@ -0,0 +1,448 @@
+"""云触发器执行引擎
+
+- 动作：ACTION_HANDLERS 按 action_type 注册处理函数，执行结果写入 TriggerExecutionLog
+- TriggerExecutor: 有界队列 + 固定数量的 worker，动作在专用线程池中执行，
+  不占用事件循环，也不会因为触发器过多而无限堆积（定时触发在队列满时等待，事件触发直接丢弃并计数）
+- TriggerIndex: 触发器在内存中的副本。启动时读取一次全部启用的触发器，
+  本进程的增删改由 trigger_api 直接通知，其他进程的修改每 TRIGGER_CHECK_INTERVAL 秒
+  按 updated_at 增量同步一次
+- TriggerScheduler: 定时触发器调度。按下一次触发时间放进最小堆，
+  只在堆顶到期（或有触发器变更）时唤醒，不按 tick 扫表。服务停机期间错过的触发不补执行
+
+环境变量：
+- TRIGGER_ENABLED: 是否在本进程运行定时调度（默认 true；多 worker 部署时只应在一个进程中开启）
+- TRIGGER_MAX_WORKERS: 同时执行的动作数（默认 4，SQLite 为 1）
+- TRIGGER_QUEUE_SIZE: 等待执行的队列长度（默认 1000）
+- TRIGGER_CHECK_INTERVAL: 同步其他进程修改的间隔秒数（默认 60）
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session, selectinload
+
+from database import SessionLocal, DATABASE_URL
+from auth import load_principal
+from models import CloudTrigger, TriggerExecutionLog, DataBackup, Conversation, SyncMessage, Provider
+from trigger_cron import CronError, CronSchedule, parse_schedule
+
+TRIGGER_ENABLED = os.getenv("TRIGGER_ENABLED", "true").lower() == "true"
+# SQLite 同一时刻只能有一个写事务，并发执行只会互相锁冲突，默认单个 worker
+MAX_WORKERS = int(os.getenv("TRIGGER_MAX_WORKERS", "1" if "sqlite" in DATABASE_URL else "4"))
+QUEUE_SIZE = int(os.getenv("TRIGGER_QUEUE_SIZE", "1000"))
+CHECK_INTERVAL = float(os.getenv("TRIGGER_CHECK_INTERVAL", "60"))
+
+# 云触发器需要的会员等级（与 trigger_api 的权限检查一致）
+REQUIRED_LEVEL = 3
+# 增量同步时向前多取的秒数（SQLite 的时间戳精度为秒）
+SYNC_OVERLAP_SECONDS = 2
+
+
+# ============ 动作 ============
+
+# action_type -> 处理函数(db, trigger, params, context)，返回写入日志的结果说明；抛出异常记为失败
+ACTION_HANDLERS: Dict[str, Callable[[Session, CloudTrigger, dict, dict], str]] = {}
+
+
+def action(action_type: str):
+    """注册动作处理函数"""
+    def register(handler):
+        ACTION_HANDLERS[action_type] = handler
+        return handler
+    return register
+
+
+@action("notification")
+def _notification_action(db: Session, trigger: CloudTrigger, params: dict, context: dict) -> str:
+    """通知：目前没有服务端推送通道，通知内容记录在执行日志中，由客户端拉取日志展示"""
+    message = params.get("message") or params.get("template")
+    if not message:
+        raise ValueError("通知动作需要提供 params.message")
+    return str(message)
+
+
+@action("backup")
+def _backup_action(db: Session, trigger: CloudTrigger, params: dict, context: dict) -> str:
+    """自动备份：把用户已同步的会话、消息和渠道商配置（不含 Key）存为一份 auto 类型的备份"""
+    user_id = trigger.user_id
+    conversations = db.query(Conversation).filter(
+        Conversation.user_id == user_id, Conversation.deleted_at.is_(None)
+    ).all()
+    messages = db.query(SyncMessage).options(selectinload(SyncMessage.blocks)).filter(
+        SyncMessage.user_id == user_id, SyncMessage.deleted_at.is_(None)
+    ).all()
+    providers = db.query(Provider).filter(
+        Provider.user_id == user_id, Provider.deleted_at.is_(None)
+    ).all()
+
+    backup_data = json.dumps({
+        "source": "cloud_trigger",
+        "trigger_id": trigger.id,
+        "conversations": [c.to_dict() for c in conversations],
+        "messages": [m.to_dict(include_blocks=True) for m in messages],
+        "providers": [p.to_dict() for p in providers],
+    }, ensure_ascii=False, default=str)
+
+    now = datetime.now(timezone.utc)
+    db.add(DataBackup(
+        user_id=user_id,
+        backup_name=params.get("backup_name") or f"{trigger.trigger_name} {now:%Y-%m-%d %H:%M}",
+        description=f"由触发器「{trigger.trigger_name}」自动创建",
+        backup_type="auto",
+        backup_data=backup_data,
+        file_size=len(backup_data.encode("utf-8"))
+    ))
+    return f"已创建自动备份：{len(conversations)} 个会话，{len(messages)} 条消息，{len(providers)} 个渠道商"
+
+
+def _membership_ok(db: Session, user_id: int) -> bool:
+    principal = load_principal(user_id, db)
+    if principal is None or not principal.is_active or principal.user_level < REQUIRED_LEVEL:
+        return False
+    expires_at = principal.expires_at
+    if expires_at and expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return not (expires_at and datetime.now(timezone.utc) > expires_at)
+
+
+def execute_trigger(trigger_id: int, fired_at: datetime, context: Optional[dict] = None) -> Optional[str]:
+    """执行一次触发器动作并写执行日志，返回日志状态
+
+    触发器已删除或已停用时返回 None；写日志本身失败（如数据库不可用）时返回 "error"
+    """
+    db = SessionLocal()
+    try:
+        trigger = db.get(CloudTrigger, trigger_id)
+        if trigger is None or not trigger.is_active:
+            return None
+
+        start = time.perf_counter()
+        status, result, error = "success", None, None
+        if not _membership_ok(db, trigger.user_id):
+            status, error = "skipped", "用户已禁用，或会员等级/有效期不满足云触发器要求"
+        else:
+            try:
+                action_config = json.loads(trigger.action_config or "{}")
+                handler = ACTION_HANDLERS.get(action_config.get("action_type"))
+                if handler is None:
+                    raise ValueError(f"不支持的动作类型: {action_config.get('action_type')}")
+                result = handler(db, trigger, action_config.get("params") or {}, context or {})
+            except Exception as e:
+                db.rollback()
+                status, error = "failed", str(e)
+                trigger = db.get(CloudTrigger, trigger_id)
+                if trigger is None:
+                    return None
+
+        # 用 Core 写入并保持 updated_at：执行不算用户修改，也不应让增量同步重新读取该触发器
+        db.execute(
+            update(CloudTrigger)
+            .where(CloudTrigger.id == trigger.id)
+            .values(last_triggered_at=fired_at, updated_at=CloudTrigger.updated_at)
+        )
+        db.add(TriggerExecutionLog(
+            trigger_id=trigger.id,
+            user_id=trigger.user_id,
+            status=status,
+            execution_time_ms=int((time.perf_counter() - start) * 1000),
+            result_message=result,
+            error_message=error
+        ))
+        db.commit()
+        return status
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ 触发器 {trigger_id} 执行失败: {e}")
+        return "error"
+    finally:
+        db.close()
+
+
+# ============ 执行池 ============
+
+class _Job(NamedTuple):
+    trigger_id: int
+    fired_at: datetime
+    context: Optional[dict]
+    on_gone: Optional[Callable[[int], None]]  # 触发器已删除/停用时回调
+
+
+class TriggerExecutor:
+    """有界队列 + 固定数量 worker 的执行池"""
+
+    def __init__(self, workers: int = MAX_WORKERS, queue_size: int = QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="trigger")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._pool:
+            # 等待已在执行的动作完成
+            await asyncio.to_thread(self._pool.shutdown, True)
+            self._pool = None
+
+    async def submit(self, trigger_id: int, fired_at: datetime, context: Optional[dict] = None,
+                     on_gone: Optional[Callable[[int], None]] = None):
+        """加入执行队列；队列满时等待"""
+        await self._queue.put(_Job(trigger_id, fired_at, context, on_gone))
+
+    def submit_nowait(self, trigger_id: int, fired_at: datetime, context: Optional[dict] = None,
+                      on_gone: Optional[Callable[[int], None]] = None) -> bool:
+        """加入执行队列；未启动或队列满时丢弃并计数，返回是否已加入（只能在事件循环线程中调用）"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(_Job(trigger_id, fired_at, context, on_gone))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                status = await loop.run_in_executor(
+                    self._pool, execute_trigger, job.trigger_id, job.fired_at, job.context
+                )
+                if status is None and job.on_gone is not None:
+                    job.on_gone(job.trigger_id)
+            except Exception as e:
+                print(f"⚠️ 触发器 {job.trigger_id} 执行异常: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "dropped": self.dropped,
+        }
+
+
+# ============ 触发器同步 ============
+
+class TriggerIndex(ABC):
+    """某一类触发器在本进程内存中的副本（定时调度、事件分发共用的同步逻辑）
+
+    启动时读取一次全部启用的该类触发器；本进程的增删改由 trigger_api 直接调用
+    sync_trigger / remove，其他进程的修改每 check_interval 秒按 updated_at 增量同步一次。
+    子类实现 sync_trigger / remove，只能在事件循环线程中调用
+    """
+
+    trigger_type = ""
+    label = ""
+
+    def __init__(self, check_interval: float = CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._synced_at: Optional[datetime] = None
+
+    @abstractmethod
+    def sync_trigger(self, trigger):
+        """trigger 需要有 id、user_id、trigger_type、trigger_config、is_active 属性"""
+
+    @abstractmethod
+    def remove(self, trigger_id: int):
+        """把触发器移出索引（不在索引中时什么也不做）"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """索引中的触发器数量"""
+
+    def _load(self, since: Optional[datetime]) -> list:
+        """since 为空时读取全部启用的，否则读取 since 之后修改过的（含已停用的）"""
+        db = SessionLocal()
+        try:
+            query = db.query(
+                CloudTrigger.id, CloudTrigger.user_id, CloudTrigger.trigger_type,
+                CloudTrigger.trigger_config, CloudTrigger.is_active
+            ).filter(CloudTrigger.trigger_type == self.trigger_type)
+            if since is None:
+                query = query.filter(CloudTrigger.is_active == True)
+            else:
+                query = query.filter(CloudTrigger.updated_at >= since)
+            return query.all()
+        finally:
+            db.close()
+
+    async def _sync(self):
+        started = datetime.now(timezone.utc)
+        since = None
+        if self._synced_at is not None:
+            since = self._synced_at - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+        rows = await asyncio.to_thread(self._load, since)
+        for row in rows:
+            self.sync_trigger(row)
+        if self._synced_at is None:
+            print(f"⏰ {self.label}已加载，共 {len(self)} 个")
+        self._synced_at = started
+
+    async def _sync_forever(self):
+        """按间隔增量同步（自身没有其他循环的子类使用）"""
+        while True:
+            try:
+                await self._sync()
+            except Exception as e:
+                print(f"⚠️ {self.label}同步失败: {e}")
+            await asyncio.sleep(self.check_interval)
+
+
+# ============ 定时调度 ============
+
+class _ScheduleEntry(NamedTuple):
+    version: int
+    schedule: CronSchedule
+    raw_config: str
+
+
+class TriggerScheduler(TriggerIndex):
+    """定时触发器的最小堆调度
+
+    堆中元素为 (触发时间戳, 触发器ID, 版本号)。触发器修改或删除时不在堆里查找旧元素，
+    只更新 _entries 中的版本号，旧元素弹出时发现版本不符直接丢弃
+    """
+
+    trigger_type = "schedule"
+    label = "定时触发器"
+
+    def __init__(self, executor: TriggerExecutor, enabled: bool = TRIGGER_ENABLED,
+                 check_interval: float = CHECK_INTERVAL):
+        super().__init__(check_interval)
+        self.executor = executor
+        self.enabled = enabled
+        self._heap: List[Tuple[float, int, int]] = []
+        self._entries: Dict[int, _ScheduleEntry] = {}
+        self._versions = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def sync_trigger(self, trigger):
+        """触发器创建/修改后调用；非定时或已停用的会被移出调度"""
+        if self._task is None:
+            return
+        if trigger.trigger_type != self.trigger_type or not trigger.is_active:
+            self.remove(trigger.id)
+            return
+        entry = self._entries.get(trigger.id)
+        if entry is not None and entry.raw_config == trigger.trigger_config:
+            return
+        try:
+            schedule = parse_schedule(json.loads(trigger.trigger_config))
+        except (CronError, ValueError, TypeError, AttributeError) as e:
+            print(f"⚠️ 定时触发器 {trigger.id} 配置无效，已跳过: {e}")
+            self.remove(trigger.id)
+            return
+
+        version = next(self._versions)
+        self._entries[trigger.id] = _ScheduleEntry(version, schedule, trigger.trigger_config)
+        next_fire = schedule.next_after(datetime.now(timezone.utc))
+        if next_fire is not None:
+            self._push(next_fire.timestamp(), trigger.id, version)
+
+    def remove(self, trigger_id: int):
+        """移出调度（堆中的旧元素到期时丢弃）"""
+        self._entries.pop(trigger_id, None)
+
+    def _push(self, fire_ts: float, trigger_id: int, version: int):
+        earliest = not self._heap or fire_ts < self._heap[0][0]
+        heapq.heappush(self._heap, (fire_ts, trigger_id, version))
+        # 过期元素太多时重建堆
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [
+                item for item in self._heap
+                if item[1] in self._entries and self._entries[item[1]].version == item[2]
+            ]
+            heapq.heapify(self._heap)
+        if earliest and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        next_sync = 0.0
+        while True:
+            if time.time() >= next_sync:
+                try:
+                    await self._sync()
+                except Exception as e:
+                    print(f"⚠️ 定时触发器同步失败: {e}")
+                next_sync = time.time() + self.check_interval
+
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                fire_ts, trigger_id, version = heapq.heappop(self._heap)
+                entry = self._entries.get(trigger_id)
+                if entry is None or entry.version != version:
+                    continue
+                fired_at = datetime.fromtimestamp(fire_ts, timezone.utc)
+                await self.executor.submit(trigger_id, fired_at, None, self.remove)
+                # 从当前时间往后算，积压时不补触发已错过的时刻
+                next_fire = entry.schedule.next_after(datetime.fromtimestamp(max(fire_ts, now), timezone.utc))
+                if next_fire is not None:
+                    self._push(next_fire.timestamp(), trigger_id, version)
+
+            timeout = next_sync - time.time()
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def stats(self) -> dict:
+        next_fire = None
+        if self._heap:
+            next_fire = datetime.fromtimestamp(self._heap[0][0], timezone.utc).isoformat()
+        return {
+            "enabled": self.enabled,
+            "scheduled": len(self._entries),
+            "next_fire_at": next_fire,
+            **self.executor.stats(),
+        }
+
+
+# 进程级单例
+executor = TriggerExecutor()
+scheduler = TriggerScheduler(executor)
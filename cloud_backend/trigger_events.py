@@ -0,0 +1,117 @@
+"""事件触发器分发
+
+push 提交后由 sync_api_v2 发布事件（目前为 new_message），按
+(user_id, event_type, contact_id) 在内存索引里查出要执行的触发器，交给 TriggerExecutor 异步执行：
+- 匹配是字典查找，不按消息查询 cloud_triggers 表；没有事件触发器的用户在 push 线程里直接返回
+- 发布只把事件投递到事件循环（call_soon_threadsafe），不等待执行，push 延迟不受触发器影响
+- 执行队列满时事件直接丢弃并计入 dropped
+
+触发器配置 {"event_type": "new_message", "contact_id": "xxx"}，contact_id 即会话 ID，
+不填时匹配该用户所有会话的事件。
+
+事件在处理 push 的进程内发布，因此每个 worker 进程都维护自己的索引（不受 TRIGGER_ENABLED 影响）
+"""
+import asyncio
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from trigger_engine import CHECK_INTERVAL, TriggerExecutor, TriggerIndex, executor
+
+EVENT_NEW_MESSAGE = "new_message"
+
+_IndexKey = Tuple[int, str, Optional[str]]
+
+
+class TriggerEventBus(TriggerIndex):
+    """事件触发器索引 + 事件发布"""
+
+    trigger_type = "event"
+    label = "事件触发器"
+
+    def __init__(self, executor: TriggerExecutor, check_interval: float = CHECK_INTERVAL):
+        super().__init__(check_interval)
+        self.executor = executor
+        self.published = 0
+        self._index: Dict[_IndexKey, Set[int]] = {}
+        self._keys: Dict[int, _IndexKey] = {}  # trigger_id -> 索引键
+        self._user_counts: Dict[int, int] = {}  # user_id -> 事件触发器数量
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._sync_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def sync_trigger(self, trigger):
+        """触发器创建/修改后调用；非事件或已停用的会被移出索引"""
+        if self._task is None:
+            return
+        self.remove(trigger.id)
+        if trigger.trigger_type != self.trigger_type or not trigger.is_active:
+            return
+        try:
+            config = json.loads(trigger.trigger_config)
+            key = (trigger.user_id, config["event_type"], config.get("contact_id") or None)
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"⚠️ 事件触发器 {trigger.id} 配置无效，已跳过: {e}")
+            return
+
+        self._index.setdefault(key, set()).add(trigger.id)
+        self._keys[trigger.id] = key
+        self._user_counts[trigger.user_id] = self._user_counts.get(trigger.user_id, 0) + 1
+
+    def remove(self, trigger_id: int):
+        key = self._keys.pop(trigger_id, None)
+        if key is None:
+            return
+        trigger_ids = self._index[key]
+        trigger_ids.discard(trigger_id)
+        if not trigger_ids:
+            del self._index[key]
+        user_id = key[0]
+        self._user_counts[user_id] -= 1
+        if not self._user_counts[user_id]:
+            del self._user_counts[user_id]
+
+    def has_listeners(self, user_id: int) -> bool:
+        """用户是否有启用的事件触发器（可在任意线程调用，用于发布前快速跳过）"""
+        return self._loop is not None and user_id in self._user_counts
+
+    def publish_threadsafe(self, user_id: int, event_type: str, events: List[dict]):
+        """在任意线程中发布一批同类事件；每个事件是包含 contact_id 的上下文字典"""
+        if not events or not self.has_listeners(user_id):
+            return
+        self._loop.call_soon_threadsafe(self.publish, user_id, event_type, events)
+
+    def publish(self, user_id: int, event_type: str, events: List[dict]):
+        """匹配触发器并加入执行队列（只能在事件循环线程中调用）"""
+        fired_at = datetime.now(timezone.utc)
+        for event in events:
+            trigger_ids = self._index.get((user_id, event_type, event.get("contact_id")), set())
+            trigger_ids = trigger_ids | self._index.get((user_id, event_type, None), set())
+            for trigger_id in trigger_ids:
+                if self.executor.submit_nowait(
+                    trigger_id, fired_at, {"event_type": event_type, **event}, self.remove
+                ):
+                    self.published += 1
+
+    def stats(self) -> dict:
+        return {"event_triggers": len(self._keys), "events_dispatched": self.published}
+
+
+# 进程级单例
+event_bus = TriggerEventBus(executor)
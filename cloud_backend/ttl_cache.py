@@ -0,0 +1,130 @@
+"""进程内 TTL + LRU 缓存
+
+用于热点接口上读多写少的小数据（同步 scope、用户身份等）：
+- 超过 ttl 秒的条目视为过期；超过 maxsize 时淘汰最久未使用的条目
+- SizedTTLCache 按值占用的字节数而不是条目数限制容量，用于向量矩阵等大对象
+- 线程安全（WebSocket/流式接口会在线程池里访问）
+- 记录命中/未命中次数，通过 all_stats() 汇总给管理接口
+
+多 worker 部署时各进程各有一份缓存：写操作调用 invalidate() 只清本进程，
+其他进程依赖 ttl 兜底；需要即时失效时可用 add_invalidation_listener 挂一个广播钩子，
+收到广播的进程调用 invalidate(key, propagate=False)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+# 未命中标记（缓存值本身可能是 None）
+MISSING = object()
+
+# 已创建的缓存，用于汇总统计
+_registry: Dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    """带过期时间和容量上限的缓存"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (过期时间, value, 权重)
+        self._weight = 0  # 当前条目权重之和，与 maxsize 比较
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Any], None]] = []
+        _registry[name] = self
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        weight = self._weigh(value)
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, weight)
+            self._weight += weight
+            while self._weight > self.maxsize and self._data:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self._weight -= evicted
+                self.evictions += 1
+
+    def _weigh(self, value) -> int:
+        """条目权重，默认每个条目计 1（即按条目数限制容量）"""
+        return 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[2]
+
+    def invalidate(self, key, propagate: bool = True):
+        """删除一个键；propagate=True 时通知监听者（用于跨进程广播）"""
+        with self._lock:
+            self._remove(key)
+        if propagate:
+            for listener in self._listeners:
+                try:
+                    listener(key)
+                except Exception as e:
+                    print(f"⚠️ 缓存 {self.name} 失效广播失败: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def add_invalidation_listener(self, listener: Callable[[Any], None]):
+        """注册失效钩子，invalidate(key) 时以 key 调用"""
+        self._listeners.append(listener)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class SizedTTLCache(TTLCache):
+    """按字节数限制容量的 TTL 缓存，sizeof(value) 返回值占用的字节数"""
+
+    def __init__(self, name: str, max_bytes: int, ttl: float, sizeof: Callable[[Any], int]):
+        super().__init__(name, max_bytes, ttl)
+        self._sizeof = sizeof
+
+    def _weigh(self, value) -> int:
+        return int(self._sizeof(value))
+
+    def stats(self) -> dict:
+        result = super().stats()
+        with self._lock:
+            result["resident_bytes"] = self._weight
+        result["max_bytes"] = result.pop("maxsize")
+        return result
+
+
+def all_stats() -> List[dict]:
+    """所有缓存的统计信息"""
+    return [cache.stats() for cache in _registry.values()]